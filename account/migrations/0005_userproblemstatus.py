@@ -0,0 +1,69 @@
+# Generated by Django 2.1.7 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+def copy_problems_status(apps, schema_editor):
+    """
+    把 UserProfile 中 acm_problems_status / oi_problems_status 的json拆成 user_problem_status 表的行
+    """
+    UserProfile = apps.get_model("account", "UserProfile")
+    UserProblemStatus = apps.get_model("account", "UserProblemStatus")
+    ContestProblem = apps.get_model("problem", "ContestProblem")
+
+    contest_of_problem = dict(ContestProblem.objects.values_list("id", "contest_id"))
+
+    rows = []
+    profiles = UserProfile.objects.values_list("user_id", "acm_problems_status", "oi_problems_status")
+    for user_id, acm_status, oi_status in profiles.iterator():
+        user_rows = {}
+        for blob in (acm_status or {}, oi_status or {}):
+            for key, contest in (("problems", False), ("contest_problems", True)):
+                for problem_id, item in (blob.get(key) or {}).items():
+                    problem_id = int(problem_id)
+                    contest_id = contest_of_problem.get(problem_id, 0) if contest else 0
+                    if contest and not contest_id:
+                        # 竞赛试题已被删除
+                        continue
+                    user_rows[(problem_id, contest_id)] = UserProblemStatus(
+                        user_id=user_id,
+                        problem_id=problem_id,
+                        contest_id=contest_id,
+                        display_id=item.get("_id"),
+                        status=item.get("status", 0),
+                        score=item.get("score", 0))
+        rows.extend(user_rows.values())
+        if len(rows) >= 1000:
+            UserProblemStatus.objects.bulk_create(rows)
+            rows = []
+    UserProblemStatus.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('account', '0004_auto_20200708_1417'),
+        ('problem', '0006_auto_20200117_0951'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProblemStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(verbose_name='用户id')),
+                ('problem_id', models.IntegerField(verbose_name='试题id')),
+                ('contest_id', models.IntegerField(default=0, verbose_name='竞赛id')),
+                ('display_id', models.IntegerField(null=True, verbose_name='试题编号')),
+                ('status', models.IntegerField(verbose_name='结果')),
+                ('score', models.IntegerField(default=0, verbose_name='得分')),
+            ],
+            options={
+                'db_table': 'user_problem_status',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='userproblemstatus',
+            unique_together={('user_id', 'problem_id', 'contest_id')},
+        ),
+        migrations.RunPython(copy_problems_status, migrations.RunPython.noop),
+    ]
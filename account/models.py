@@ -187,6 +187,24 @@ class UserProfile(models.Model):
         db_table = "user_profile"
 
 
+class UserProblemStatus(models.Model):
+    """
+    用户在每道题上的做题状态, 代替 acm_problems_status / oi_problems_status 中的json
+    """
+    user_id = models.IntegerField(verbose_name="用户id")
+    problem_id = models.IntegerField(verbose_name="试题id")
+    # 0 表示公有题库的试题
+    contest_id = models.IntegerField(default=0, verbose_name="竞赛id")
+    display_id = models.IntegerField(null=True, verbose_name="试题编号")
+    status = models.IntegerField(verbose_name="结果")
+    # 仅OI试题使用
+    score = models.IntegerField(default=0, verbose_name="得分")
+
+    class Meta:
+        db_table = "user_problem_status"
+        unique_together = (("user_id", "problem_id", "contest_id"),)
+
+
 class Grade(models.Model):
     id = models.AutoField(primary_key=True, max_length=5)
     teacher = models.CharField(
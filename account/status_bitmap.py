@@ -0,0 +1,128 @@
+from submission.models import JudgeStatus
+from utils.cache import cache
+from utils.constants import CacheKey
+from .models import UserProblemStatus
+
+# 位图的过期时间(秒), 每次写入都会续期
+STATUS_BITMAP_TTL = 7 * 24 * 3600
+
+
+class ProblemStatusBits(object):
+    """
+    某个用户在公有题库或某场竞赛中的做题状态, 第 problem_id 位为1表示通过/做过,
+    results 为做过未通过的试题最后一次的判题结果
+    """
+
+    def __init__(self, solved, attempted, results=None):
+        self.solved = solved or b""
+        self.attempted = attempted or b""
+        self.results = results or {}
+
+    @staticmethod
+    def _test(bits, problem_id):
+        index = problem_id >> 3
+        return index < len(bits) and bits[index] >> (7 - (problem_id & 7)) & 1
+
+    def status(self, problem_id):
+        """
+        :return: 通过为 ACCEPTED, 做过未通过为最后一次的判题结果, 没做过为None
+        """
+        if self._test(self.solved, problem_id):
+            return JudgeStatus.ACCEPTED
+        if self._test(self.attempted, problem_id):
+            result = self.results.get(str(problem_id).encode("utf-8"))
+            return int(result) if result is not None else JudgeStatus.WRONG_ANSWER
+        return None
+
+    def filter(self, status, problems):
+        # status = 0 解决
+        # status = 1 未解决
+        # status = -1 未做过
+        if status == '0':
+            return [problem for problem in problems if self._test(self.solved, problem["id"])]
+        elif status == '-1':
+            return [problem for problem in problems if not self._test(self.attempted, problem["id"])]
+        return [problem for problem in problems
+                if self._test(self.attempted, problem["id"]) and not self._test(self.solved, problem["id"])]
+
+
+class ProblemStatusBitmap(object):
+    """
+    user_problem_status 表在redis中的位图, 每个用户每场竞赛(公有题库为0)两个位图:
+    <key>:<uid>:<contest_id>:solved / attempted, 按试题id置位
+    做题状态只会从"做过"变成"通过", 所以判题时直接置位, 从数据库重建时与已有的位图按位或,
+    不会覆盖重建期间新写入的状态
+    <key>:<uid>:<contest_id>:results 是试题id -> 未通过时最后一次的判题结果的hash,
+    重建时同样不覆盖已有的字段
+    """
+
+    @staticmethod
+    def _keys(user_id, contest_id):
+        key = f"{CacheKey.user_problem_status}:{user_id}:{contest_id or 0}"
+        return f"{key}:solved", f"{key}:attempted", f"{key}:results", f"{key}:built"
+
+    def mark(self, user_id, contest_id, problem_id, result):
+        """
+        判题结束后调用
+        """
+        solved_key, attempted_key, results_key, built_key = self._keys(user_id, contest_id)
+        p = cache.pipeline()
+        p.setbit(attempted_key, int(problem_id), 1)
+        if result == JudgeStatus.ACCEPTED:
+            p.setbit(solved_key, int(problem_id), 1)
+        else:
+            p.hset(results_key, int(problem_id), result)
+        for key in (solved_key, attempted_key, results_key, built_key):
+            p.expire(key, STATUS_BITMAP_TTL)
+        p.execute()
+
+    def rebuild(self, user_id, contest_id):
+        solved_key, attempted_key, results_key, built_key = self._keys(user_id, contest_id)
+        statuses = list(UserProblemStatus.objects.filter(
+            user_id=user_id, contest_id=contest_id or 0).values_list("problem_id", "status"))
+        size = max((problem_id for problem_id, _ in statuses), default=0) // 8 + 1
+        solved, attempted = bytearray(size), bytearray(size)
+        for problem_id, status in statuses:
+            attempted[problem_id >> 3] |= 0x80 >> (problem_id & 7)
+            if status == JudgeStatus.ACCEPTED:
+                solved[problem_id >> 3] |= 0x80 >> (problem_id & 7)
+
+        p = cache.pipeline()
+        for key, bits in ((solved_key, solved), (attempted_key, attempted)):
+            p.set(f"{key}:tmp", bytes(bits))
+            p.bitop("OR", key, key, f"{key}:tmp")
+            p.delete(f"{key}:tmp")
+        for problem_id, status in statuses:
+            if status != JudgeStatus.ACCEPTED:
+                p.hsetnx(results_key, problem_id, status)
+        p.set(built_key, 1)
+        for key in (solved_key, attempted_key, results_key, built_key):
+            p.expire(key, STATUS_BITMAP_TTL)
+        p.get(solved_key)
+        p.get(attempted_key)
+        p.hgetall(results_key)
+        return ProblemStatusBits(*p.execute()[-3:])
+
+    def load(self, user_id, contest_id=0):
+        """
+        一次读取整个位图, 列表页的状态标注和筛选都在内存中完成
+        """
+        solved_key, attempted_key, results_key, built_key = self._keys(user_id, contest_id)
+        p = cache.pipeline(transaction=False)
+        p.exists(built_key)
+        p.get(solved_key)
+        p.get(attempted_key)
+        p.hgetall(results_key)
+        built, solved, attempted, results = p.execute()
+        if not built:
+            return self.rebuild(user_id, contest_id)
+        return ProblemStatusBits(solved, attempted, results)
+
+    def invalidate(self, user_id, contest_id=0):
+        """
+        重新判题后状态可能从"通过"变回"未通过", 不能按位或, 删除后下次读取时重建
+        """
+        cache.delete(*self._keys(user_id, contest_id))
+
+
+problem_status_bitmap = ProblemStatusBitmap()
@@ -14,6 +14,7 @@ from django.http import HttpResponse, StreamingHttpResponse
 from contest.models import ContestPartner, Contest
 from submission.models import Submission
 from utils.api import APIView, validate_serializer
+from utils.cache import user_rank_namespace
 from utils.shortcuts import rand_str
 from ..models import AdminType, ProblemPermission, User, UserProfile, Grade, OwnInfo, UserRegisterType, \
     AdminOperationRecord
@@ -142,6 +143,7 @@ class UserAdminAPI(APIView):
         )
         data.pop("grade", None)
         UserProfile.objects.filter(user_id=uid).update(**data)
+        user_rank_namespace.invalidate()
         return self.success()
 
     # todo 登陆限制
@@ -254,6 +256,7 @@ class UserAdminAPI(APIView):
                 error = self.delete_one(_id)
                 if error:
                     return self.error(error)
+        user_rank_namespace.invalidate()
         return self.success()
 
 
@@ -580,6 +583,7 @@ class UserTobeDisable(APIView):
 
         if uid:
             u = User.objects.filter(id=uid).update(is_disabled=opera)
+            user_rank_namespace.invalidate()
         else:
             return self.error("修改失败")
         return self.success(data=u)
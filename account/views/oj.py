@@ -13,11 +13,12 @@ from contest.models import ContestPartner, Contest
 from options.options import SysOptions
 from problem.models import Problem
 from utils.api import APIView
-from utils.cache import cache
+from utils.api.pagination import cached_count
+from utils.cache import cache, user_rank_namespace
 from utils.constants import CacheKey
 from utils.shortcuts import rand_str, m_decrypt
 from ..decorators import login_required
-from ..models import User, UserProfile, AdminType, Grade, ProblemPermission, UserRecord, UserRegisterType
+from ..models import User, UserProfile, UserProblemStatus, AdminType, Grade, ProblemPermission, UserRecord, UserRegisterType
 from ..serializers import (
     RankInfoSerializer,
     UserRecordSerializer,
@@ -32,17 +33,15 @@ class UserDoProblemStatus(APIView):
         if not uid:
             return self.success()
 
-        data = UserProfile.objects.values_list(
-            "acm_problems_status",
-            "accepted_number").filter(
+        accepted_number = UserProfile.objects.values_list(
+            "accepted_number", flat=True).filter(
             user_id=uid)[0]
         # 解决的题目数
 
         user_problems_status = dict()
 
-        user_problems_status["accepted_number"] = data[1]
-        problems = data[0].get("problems", [])
-        have_do = len(problems) if problems else 0
+        user_problems_status["accepted_number"] = accepted_number
+        have_do = UserProblemStatus.objects.filter(user_id=uid, contest_id=0).count()
 
         # 尝试过失败的题目数
         user_problems_status["try"] = have_do - \
@@ -815,7 +814,8 @@ class UserRankAPI(APIView):
         return self.paginate_data(
             request,
             list_rank,
-            RankInfoSerializer)
+            RankInfoSerializer,
+            count_strategy=cached_count)
 
     def get(self, request):
 
@@ -824,7 +824,7 @@ class UserRankAPI(APIView):
         real_name = request.GET.get("real_name")
 
         if not real_name:
-            cache_key = f"{CacheKey.user_rank}:{limit}:{offset}"
+            cache_key = user_rank_namespace.key(limit, offset)
             data = cache.get(cache_key)
             if not data:
                 data = self.get_user_rank(request)
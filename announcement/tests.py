@@ -0,0 +1,28 @@
+from announcement.models import Announcements
+from utils.api.tests import APIClient, APITestCase
+from utils.cache import announcement_list_namespace
+
+
+class AnnouncementListTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        announcement_list_namespace.invalidate()
+        Announcements.objects.create(title="visible", content="content")
+        Announcements.objects.create(title="hidden", content="content", visible=False)
+
+    def test_list(self):
+        result = self.client.get("/api/announcement", data={"limit": 10, "offset": 0}).json()
+        self.assertEqual(result["result"], "successful")
+        self.assertEqual(result["data"]["total"], 1)
+        self.assertEqual(result["data"]["results"][0]["title"], "visible")
+
+    def test_list_invalidate(self):
+        self.client.get("/api/announcement", data={"limit": 10, "offset": 0})
+        Announcements.objects.create(title="new", content="content")
+        result = self.client.get("/api/announcement", data={"limit": 10, "offset": 0}).json()
+        self.assertEqual(result["data"]["total"], 1)
+
+        announcement_list_namespace.invalidate()
+        result = self.client.get("/api/announcement", data={"limit": 10, "offset": 0}).json()
+        self.assertEqual(result["data"]["total"], 2)
@@ -1,6 +1,5 @@
 from utils.api import APIView, validate_serializer
-from utils.constants import CacheKey
-from utils.cache import _redis, cache
+from utils.cache import announcement_list_namespace
 from contest.models import Contest
 from announcement.models import Announcements
 from announcement.serializers import (
@@ -30,8 +29,7 @@ class MessagePush(APIView):
 
 class AnnouncementAdminAPI(APIView):
     def flush_cacke(self):
-        list_cache_prefix = _redis.keys(f"{CacheKey.announcementsList}:*")
-        [cache.delete(key.decode()) for key in list_cache_prefix]
+        announcement_list_namespace.invalidate()
 
     @validate_serializer(CreateAnnouncementSerializer)
     def post(self, request):
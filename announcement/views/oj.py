@@ -1,5 +1,5 @@
 from utils.api import APIView
-from utils.cache import cache
+from utils.cache import cache, announcement_list_namespace
 from django.db.models import F
 from utils.constants import CacheKey
 from announcement.models import Announcements, UserMessage, Message
@@ -30,7 +30,7 @@ class AnnouncementAPI(APIView):
         limit = request.GET.get("limit", 10)
         offset = request.GET.get("offset", 10)
 
-        cache_key = f"{CacheKey.announcementsList}:{limit}:{offset}"
+        cache_key = announcement_list_namespace.key(limit, offset)
         announcements = cache.get(cache_key)
         if not announcements:
             fields = (
@@ -0,0 +1,257 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+回放提交记录, 模拟对比判题机分配策略 least_loaded 和 affinity (judge/scheduler.py 中的 _CLAIM_SCRIPT)
+
+每台判题机有 cores 个判题进程, 占用数量的上限与 TASK_PER_CORE 一致; 每台判题机用LRU模拟page cache,
+测试用例不在page cache中时加上从磁盘读取的时间, spj试题第一次在这台判题机上运行时加上编译spj的时间;
+排队的提交和 process_pending_task 一样出队时不区分测试用例, 按负载最小分配
+
+    # 从数据库导出最近7天的提交记录(需要能加载项目配置的环境, 如容器内)
+    python benchmark/judge_affinity.py --export-trace trace.csv --days 7
+    # 回放导出的记录
+    python benchmark/judge_affinity.py --trace trace.csv --servers 4 --cores 4 --cache-mb 512
+    # 没有记录时使用生成的记录: 试题热度服从zipf分布
+    python benchmark/judge_affinity.py --submissions 50000 --problems 2000
+"""
+import argparse
+import csv
+import hashlib
+import heapq
+import math
+import os
+import random
+import sys
+from collections import OrderedDict, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+
+# 与 judge.scheduler.TASK_PER_CORE 保持一致, 这里不导入以免依赖django配置
+TASK_PER_CORE = 5
+TRACE_FIELDS = ("time", "test_case_id", "size_mb", "cpu_ms", "spj")
+
+
+def export_trace(path, days):
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.utils import timezone
+    from problem.models import Problem, ContestProblem
+    from submission.models import Submission
+
+    start = timezone.now() - timezone.timedelta(days=days)
+    problems = {}
+    for model, contest in ((Problem, False), (ContestProblem, True)):
+        for pk, test_case_id, spj in model.objects.values_list("id", "test_case_id", "spj"):
+            problems[(contest, pk)] = (test_case_id, spj)
+
+    sizes = {}
+
+    def test_case_size(test_case_id):
+        if test_case_id not in sizes:
+            test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+            try:
+                sizes[test_case_id] = sum(os.path.getsize(os.path.join(test_case_dir, name))
+                                          for name in os.listdir(test_case_dir))
+            except FileNotFoundError:
+                sizes[test_case_id] = 0
+        return sizes[test_case_id]
+
+    count = 0
+    submissions = Submission.objects.filter(create_time__gte=start).order_by("create_time").values_list(
+        "create_time", "problem_id", "contest_id", "statistic_info")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(TRACE_FIELDS)
+        for create_time, problem_id, contest_id, statistic_info in submissions.iterator():
+            problem = problems.get((bool(contest_id), problem_id))
+            if not problem or not problem[0]:
+                continue
+            test_case_id, spj = problem
+            writer.writerow((f"{create_time.timestamp():.3f}", test_case_id,
+                             f"{test_case_size(test_case_id) / 1024 / 1024:.3f}",
+                             (statistic_info or {}).get("time_cost", 0), int(spj)))
+            count += 1
+    print(f"exported {count} submissions to {path}")
+
+
+def load_trace(path):
+    with open(path, newline="") as f:
+        rows = [(float(row["time"]), row["test_case_id"], float(row["size_mb"]), float(row["cpu_ms"] or 0),
+                 row["spj"] == "1") for row in csv.DictReader(f)]
+    start = rows[0][0] if rows else 0
+    return [(t - start, test_case_id, size, cpu, spj) for t, test_case_id, size, cpu, spj in rows]
+
+
+def synthetic_trace(submissions, problems, rate, seed):
+    rnd = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(problems)]
+    catalog = [(f"{i:032x}", rnd.lognormvariate(1.5, 1.5), rnd.random() < 0.1) for i in range(problems)]
+    picks = rnd.choices(catalog, weights=weights, k=submissions)
+    trace, now = [], 0.0
+    for test_case_id, size, spj in picks:
+        now += rnd.expovariate(rate)
+        trace.append((now, test_case_id, size, rnd.lognormvariate(4.5, 1), spj))
+    return trace
+
+
+class Server(object):
+    def __init__(self, server_id, cores, cache_mb):
+        self.id = server_id
+        self.cores = cores
+        self.limit = cores * TASK_PER_CORE
+        self.task = 0
+        self.running = 0
+        self.local_queue = deque()
+        self.cache_mb = cache_mb
+        self.page_cache = OrderedDict()
+        self.cached_mb = 0.0
+        self.spj = set()
+        self.judged = 0
+
+    def read(self, test_case_id, size):
+        """
+        :return: 是否命中page cache
+        """
+        if test_case_id in self.page_cache:
+            self.page_cache.move_to_end(test_case_id)
+            return True
+        self.page_cache[test_case_id] = size
+        self.cached_mb += size
+        while self.cached_mb > self.cache_mb and len(self.page_cache) > 1:
+            _, evicted = self.page_cache.popitem(last=False)
+            self.cached_mb -= evicted
+        return False
+
+
+def least_loaded(servers):
+    best = None
+    for s in servers:
+        if s.task < s.limit and (best is None or s.task < best.task):
+            best = s
+    return best
+
+
+def affinity(servers, test_case_id, load_factor):
+    total = sum(s.task for s in servers)
+    bound = math.ceil((total + 1) / len(servers) * load_factor)
+    best, best_rank = None, None
+    for s in servers:
+        if s.task < s.limit and s.task + 1 <= max(bound, s.cores):
+            rank = hashlib.sha1(f"{test_case_id}:{s.id}".encode("utf-8")).hexdigest()
+            if best is None or rank > best_rank:
+                best, best_rank = s, rank
+    return best or least_loaded(servers)
+
+
+def simulate(trace, policy, args):
+    servers = [Server(i + 1, args.cores, args.cache_mb) for i in range(args.servers)]
+    events, seq = [], 0
+    for job in trace:
+        heapq.heappush(events, (job[0], seq, "arrive", job, None))
+        seq += 1
+    waiting = deque()
+    turnaround, hits, cold_mb, spj_compiles = [], 0, 0.0, 0
+
+    def start(server, job, now):
+        nonlocal seq, hits, cold_mb, spj_compiles
+        _, test_case_id, size, cpu_ms, spj = job
+        cost = args.overhead_ms / 1000 + cpu_ms / 1000
+        if server.read(test_case_id, size):
+            hits += 1
+        else:
+            cold_mb += size
+            cost += size / args.disk_mb_per_s
+        if spj and test_case_id not in server.spj:
+            server.spj.add(test_case_id)
+            spj_compiles += 1
+            cost += args.spj_compile_ms / 1000
+        server.running += 1
+        heapq.heappush(events, (now + cost, seq, "finish", job, server))
+        seq += 1
+
+    def assign(server, job, now):
+        server.task += 1
+        server.judged += 1
+        if server.running < server.cores:
+            start(server, job, now)
+        else:
+            server.local_queue.append(job)
+
+    while events:
+        now, _, kind, job, server = heapq.heappop(events)
+        if kind == "arrive":
+            if policy == "affinity":
+                server = affinity(servers, job[1], args.load_factor)
+            else:
+                server = least_loaded(servers)
+            if server is None:
+                waiting.append(job)
+            else:
+                assign(server, job, now)
+            continue
+
+        turnaround.append(now - job[0])
+        server.running -= 1
+        server.task -= 1
+        if server.local_queue:
+            start(server, server.local_queue.popleft(), now)
+        while waiting:
+            server = least_loaded(servers)
+            if server is None:
+                break
+            assign(server, waiting.popleft(), now)
+
+    turnaround.sort()
+    judged = [s.judged for s in servers]
+    return {
+        "mean": sum(turnaround) / len(turnaround),
+        "p50": turnaround[len(turnaround) // 2],
+        "p95": turnaround[int(len(turnaround) * 0.95)],
+        "p99": turnaround[int(len(turnaround) * 0.99)],
+        "hit": hits / len(trace),
+        "cold_mb": cold_mb,
+        "spj": spj_compiles,
+        "balance": max(judged) / (sum(judged) / len(judged)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", help="csv: " + ",".join(TRACE_FIELDS))
+    parser.add_argument("--export-trace", help="从数据库导出提交记录到此文件后退出")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--submissions", type=int, default=50000, help="生成的提交数量")
+    parser.add_argument("--problems", type=int, default=2000, help="生成的试题数量")
+    parser.add_argument("--rate", type=float, default=20, help="生成的记录每秒提交数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--servers", type=int, default=4)
+    parser.add_argument("--cores", type=int, default=4)
+    parser.add_argument("--cache-mb", type=float, default=512, help="每台判题机可用于测试用例的page cache")
+    parser.add_argument("--disk-mb-per-s", type=float, default=150)
+    parser.add_argument("--overhead-ms", type=float, default=50, help="编译运行等与测试用例无关的耗时")
+    parser.add_argument("--spj-compile-ms", type=float, default=1500)
+    parser.add_argument("--load-factor", type=float, default=1.25)
+    args = parser.parse_args()
+
+    if args.export_trace:
+        export_trace(args.export_trace, args.days)
+        return
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.submissions, args.problems, args.rate, args.seed)
+    if not trace:
+        sys.exit("empty trace")
+    print(f"{len(trace)} submissions, {len({job[1] for job in trace})} test cases, "
+          f"{args.servers} servers x {args.cores} cores, page cache {args.cache_mb:.0f}MB per server")
+    for policy in ("least_loaded", "affinity"):
+        r = simulate(trace, policy, args)
+        print(f"{policy:<13} turnaround mean {r['mean'] * 1000:.0f}ms  p50 {r['p50'] * 1000:.0f}ms  "
+              f"p95 {r['p95'] * 1000:.0f}ms  p99 {r['p99'] * 1000:.0f}ms  page cache hit {r['hit'] * 100:.1f}%  "
+              f"disk read {r['cold_mb']:.0f}MB  spj compiles {r['spj']}  max/avg load {r['balance']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+对比每次新建连接的 requests.post 和按 service_url 复用连接的 JudgeServerClient
+
+在本地启动一个模拟判题机, 分别发送 N 次判题请求, 统计每次提交的平均耗时和建立的tcp连接数
+
+    python benchmark/judge_transport.py -n 2000 --src-size 4096
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from judge.client import JudgeServerClient  # noqa: E402
+
+JUDGE_RESP = json.dumps({"err": None, "data": [
+    {"test_case": "1", "result": 0, "cpu_time": 1, "memory": 1024, "output": ""}]}).encode("utf-8")
+
+
+class StubJudgeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubJudgeHandler.lock:
+            StubJudgeHandler.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        json.loads(body.decode("utf-8"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(JUDGE_RESP)))
+        self.end_headers()
+        self.wfile.write(JUDGE_RESP)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_data(src_size):
+    return {
+        "language_config": {},
+        "src": "a" * src_size,
+        "max_cpu_time": 1000,
+        "max_memory": 128 << 20,
+        "test_case_id": "0123456789abcdef0123456789abcdef",
+        "output": True}
+
+
+def run(name, post, times, data):
+    StubJudgeHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(times):
+        post(data)
+    cost = time.perf_counter() - start
+    print(f"{name:<16} total: {cost:.3f}s  per submission: {cost / times * 1000:.3f}ms  "
+          f"tcp connections: {StubJudgeHandler.connections}")
+    return cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--times", type=int, default=1000)
+    parser.add_argument("--src-size", type=int, default=2048)
+    parser.add_argument("--gzip-threshold", type=int, default=1024)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubJudgeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    service_url = f"http://127.0.0.1:{server.server_address[1]}"
+    data = make_data(args.src_size)
+
+    pooled = JudgeServerClient()
+    pooled_gzip = JudgeServerClient(gzip_threshold=args.gzip_threshold)
+
+    baseline = run("requests.post", lambda d: requests.post(
+        f"{service_url}/judge", json=d, timeout=(3, 60)).json(), args.times, data)
+    reuse = run("pooled", lambda d: pooled.post(service_url, "/judge", data=d), args.times, data)
+    run("pooled+gzip", lambda d: pooled_gzip.post(service_url, "/judge", data=d), args.times, data)
+
+    print(f"saved per submission: {(baseline - reuse) / args.times * 1000:.3f}ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+对比 TestCaseZipProcessor.process_zip 改为分块流式解压 + 线程池并行之前和之后, 导入测试用例的耗时和内存峰值
+
+生成一个 N 组测试用例(.in/.out, CRLF换行)的压缩包, 分别在子进程中用旧的实现(整个文件读入内存)和
+当前的实现导入到临时目录, 内存峰值取子进程的 ru_maxrss, 需要在能加载项目配置的环境中运行(如容器内):
+
+    python benchmark/test_case_ingest.py --cases 500 --size-mb 1024
+    # 少量大文件, 对比内存峰值
+    python benchmark/test_case_ingest.py --cases 10 --size-mb 1024
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+
+
+def make_archive(path, cases, size_mb):
+    """
+    每个文件大小为 size_mb / (cases * 2), 内容为随机数字行, 压缩比与真实的测试数据接近
+    """
+    file_size = size_mb * 1024 * 1024 // (cases * 2)
+    lines = [" ".join(str(random.randint(0, 10 ** 9)) for _ in range(8)).encode("utf-8") + b"\r\n"
+             for _ in range(4096)]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for index in range(1, cases + 1):
+            for suffix in ("in", "out"):
+                zip_info = zipfile.ZipInfo(f"{index}.{suffix}")
+                zip_info.compress_type = zipfile.ZIP_DEFLATED
+                with zip_file.open(zip_info, "w") as f:
+                    written = 0
+                    while written < file_size:
+                        line = random.choice(lines)
+                        f.write(line)
+                        written += len(line)
+
+
+def legacy_process_zip(zip_path, test_case_dir):
+    """
+    改动之前的 process_zip: 逐个文件整体读入内存后替换换行符并计算md5
+    """
+    zip_file = zipfile.ZipFile(zip_path, "r")
+    name_list = zip_file.namelist()
+    test_case_list, prefix = [], 1
+    while f"{prefix}.in" in name_list and f"{prefix}.out" in name_list:
+        test_case_list.extend((f"{prefix}.in", f"{prefix}.out"))
+        prefix += 1
+    size_cache, md5_cache = {}, {}
+    for item in test_case_list:
+        with open(os.path.join(test_case_dir, item), "wb") as f:
+            content = zip_file.read(item).replace(b"\r\n", b"\n")
+            size_cache[item] = len(content)
+            if item.endswith(".out"):
+                md5_cache[item] = hashlib.md5(content.rstrip()).hexdigest()
+            f.write(content)
+    return [{"stripped_output_md5": md5_cache[f"{i}.out"], "input_size": size_cache[f"{i}.in"],
+             "output_size": size_cache[f"{i}.out"]} for i in range(1, prefix)]
+
+
+def run(mode, zip_path, test_case_root):
+    start = time.time()
+    if mode == "legacy":
+        test_case_dir = os.path.join(test_case_root, "legacy")
+        os.mkdir(test_case_dir)
+        info = legacy_process_zip(zip_path, test_case_dir)
+    else:
+        import django
+        django.setup()
+        from django.conf import settings
+        from problem.views.admin import TestCaseZipProcessor
+
+        settings.TEST_CASE_DIR = test_case_root
+        settings.TEST_CASE_BLOB_DIR = os.path.join(test_case_root, "_blobs")
+        info, _ = TestCaseZipProcessor().process_zip(zip_path, spj=False)
+        info = [{k: item[k] for k in ("stripped_output_md5", "input_size", "output_size")} for item in info]
+    cost = time.time() - start
+    # linux 下 ru_maxrss 的单位是KB
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"cost": cost, "max_rss": max_rss,
+                      "info": hashlib.md5(json.dumps(info).encode("utf-8")).hexdigest()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--size-mb", type=int, default=1024, help="解压后的总大小(MB)")
+    parser.add_argument("--run", choices=("legacy", "current"), help=argparse.SUPPRESS)
+    parser.add_argument("--archive", help=argparse.SUPPRESS)
+    parser.add_argument("--test-case-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, args.archive, args.test_case_dir)
+        return
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        zip_path = os.path.join(work_dir, "test_cases.zip")
+        make_archive(zip_path, args.cases, args.size_mb)
+        print(f"{args.cases} cases, {args.size_mb}MB uncompressed, "
+              f"{os.path.getsize(zip_path) / 1024 / 1024:.0f}MB zip")
+        results = {}
+        for mode in ("legacy", "current"):
+            test_case_root = tempfile.mkdtemp(dir=work_dir)
+            output = subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), "--run", mode,
+                "--archive", zip_path, "--test-case-dir", test_case_root])
+            results[mode] = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+            shutil.rmtree(test_case_root, ignore_errors=True)
+            print(f"{mode:<8} cost: {results[mode]['cost']:.2f}s  max rss: {results[mode]['max_rss']:.0f}MB")
+        print("same info:", results["legacy"]["info"] == results["current"]["info"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# !/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+对比 ResultSubmission 轮询和长轮询(wait=1)获取判题结果时, 服务端收到的请求数和客户端得知结果的延迟
+
+在本地启动一个模拟的结果接口, 使用项目配置的redis, 模拟一场考试中 N 名学生各提交 M 次,
+每次判题耗时在 [judge-min, judge-max] 之间随机, 需要在能连接到redis的环境中运行(如容器内):
+
+    python benchmark/verdict_polling.py --students 300 --submissions 3 --interval 1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oj.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from judge.notifier import verdict_notifier  # noqa: E402
+from submission.models import JudgeStatus  # noqa: E402
+
+# sub_id -> 判题结果, 代替 CacheKey.submit_prefix 和 submission 表
+RESULTS = {}
+
+
+class StubResultHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    requests = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubResultHandler.lock:
+            StubResultHandler.requests += 1
+        query = parse_qs(urlparse(self.path).query)
+        sub_id = query["id"][0]
+        if "wait" not in query:
+            result = RESULTS[sub_id]
+        else:
+            # 与 ResultSubmission.get 相同: 先订阅, 再查询状态
+            pubsub = verdict_notifier.subscribe(sub_id)
+            try:
+                result = RESULTS[sub_id]
+                if result == JudgeStatus.JUDGING and verdict_notifier.wait(pubsub, self.server.wait_timeout):
+                    result = RESULTS[sub_id]
+            finally:
+                pubsub.close()
+        body = json.dumps({"error": None, "data": {"sub_id": sub_id, "result": result}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def judge(sub_id, duration, finished_at):
+    time.sleep(duration)
+    RESULTS[sub_id] = JudgeStatus.ACCEPTED
+    finished_at[sub_id] = time.time()
+    verdict_notifier.publish(sub_id, JudgeStatus.ACCEPTED)
+
+
+def student(url, args, wait, finished_at, delays):
+    session = requests.Session()
+    for _ in range(args.submissions):
+        sub_id = uuid.uuid4().hex
+        RESULTS[sub_id] = JudgeStatus.JUDGING
+        threading.Thread(
+            target=judge, args=(sub_id, random.uniform(args.judge_min, args.judge_max), finished_at)).start()
+        params = {"id": sub_id}
+        if wait:
+            params["wait"] = 1
+        while True:
+            result = session.get(url, params=params).json()["data"]["result"]
+            if result != JudgeStatus.JUDGING:
+                break
+            if not wait:
+                time.sleep(args.interval)
+        delays.append(time.time() - finished_at[sub_id])
+        # 两次提交之间思考的时间
+        time.sleep(random.uniform(0, args.interval))
+
+
+def run(url, args, wait):
+    StubResultHandler.requests = 0
+    finished_at, delays = {}, []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.students) as pool:
+        for _ in range(args.students):
+            pool.submit(student, url, args, wait, finished_at, delays)
+    cost = time.time() - start
+    return StubResultHandler.requests, cost, sum(delays) / len(delays) * 1000, max(delays) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--submissions", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=1, help="前端轮询间隔(秒)")
+    parser.add_argument("--judge-min", type=float, default=1)
+    parser.add_argument("--judge-max", type=float, default=8)
+    parser.add_argument("--wait-timeout", type=float, default=25)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubResultHandler)
+    server.daemon_threads = True
+    server.wait_timeout = args.wait_timeout
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/result_submission"
+
+    total = args.students * args.submissions
+    print(f"{args.students} students x {args.submissions} submissions, judge {args.judge_min}-{args.judge_max}s")
+    for name, wait in (("polling", False), ("long-poll", True)):
+        count, cost, avg_delay, max_delay = run(url, args, wait)
+        print(f"{name:<10} requests: {count:>6} ({count / total:.2f}/submission, {count / cost * 60:.0f}/min)  "
+              f"notify delay avg: {avg_delay:.1f}ms max: {max_delay:.1f}ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from django.db import models
-from django.utils import timezone
+from judge.scheduler import scheduler
 from utils.models import MyCharField
 
 
@@ -18,10 +18,10 @@ class JudgeServer(models.Model):
 
     @property
     def status(self):
-        # 增加一秒延时，提高对网络环境的适应性
-        if (timezone.now() - self.last_heartbeat).total_seconds() > 6:
-            return "abnormal"
-        return "normal"
+        # 心跳只写redis, 超过 HEARTBEAT_TIMEOUT 没有心跳时redis中的标记过期
+        if scheduler.is_alive(self.id):
+            return "normal"
+        return "abnormal"
 
     class Meta:
         db_table = "judge_server"
@@ -62,6 +62,11 @@ class JudgeServerHeartbeatSerializer(serializers.Serializer):
     service_url = serializers.CharField(max_length=256)
 
 
+class JudgeServerTestCaseSerializer(serializers.Serializer):
+    hostname = serializers.CharField(max_length=128)
+    test_case_ids = serializers.ListField(child=serializers.CharField(max_length=32), allow_empty=True)
+
+
 class EditJudgeServerSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     is_disabled = serializers.BooleanField(required=False)
@@ -2,6 +2,8 @@ from django.conf.urls import url
 
 from ..views import (
     JudgeServerHeartbeatAPI,
+    JudgeServerTestCaseAPI,
+    JudgeServerTestCaseFileAPI,
     LanguagesAPI,
     WebsiteConfigAPI,
     BugSubmitAPI,
@@ -21,6 +23,12 @@ urlpatterns = [url(r"^website/?$",
                url(r"^judge_server_heartbeat/?$",
                    JudgeServerHeartbeatAPI.as_view(),
                    name="judge_server_heartbeat_api"),
+               url(r"^judge_server/test_cases/?$",
+                   JudgeServerTestCaseAPI.as_view(),
+                   name="judge_server_test_case_api"),
+               url(r"^judge_server/test_case_file/?$",
+                   JudgeServerTestCaseFileAPI.as_view(),
+                   name="judge_server_test_case_file_api"),
                url(r"^languages/?$",
                    LanguagesAPI.as_view(),
                    name="language_list_api"),
@@ -2,32 +2,36 @@ import hashlib
 import os
 import smtplib
 import time
-import zipfile
-from wsgiref.util import FileWrapper
 
-from django.http import StreamingHttpResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from django.conf import settings
 from account.models import User, AdminType
 from contest.models import Contest
+from judge.capacity import capacity_controller
 from judge.dispatcher import process_pending_task
 from judge.languages import languages, spj_languages
+from judge.scheduler import TASK_PER_CORE, scheduler
+from judge.waiting_queue import waiting_queue
 from options.models import SysOptions as SysOptionsModel
 from options.options import SysOptions, OptionKeys
 from problem.models import Problem
+from problem.test_case_store import test_case_store
 from submission.models import Submission, TestSubmission
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer
 from utils.cache import cache
 from utils.constants import CacheKey
 from utils.shortcuts import send_email
 from utils.xss_filter import XSSHtml
+from utils.zipstream import zip_stream
 from .models import JudgeServer, DailyInfoStatus, BugCollections, AdviceCollection
 from .serializers import (
     JudgeServerHeartbeatSerializer,
     CreateSMTPConfigSerializer,
     JudgeServerSerializer,
+    JudgeServerTestCaseSerializer,
     BugSubmitSerializer,
     AdviceSubmitSerializer,
     TestSMTPConfigSerializer,
@@ -147,14 +151,34 @@ class WebsiteConfigAPI(APIView):
 
 class JudgeServerAPI(APIView):
     def get(self, request):
-        servers = JudgeServer.objects.all().order_by("-last_heartbeat")
+        servers = list(JudgeServer.objects.all())
+        # 心跳时间, 使用率和 task_number 以redis中的实时状态为准, 数据库中的由定时任务同步
+        live_state = scheduler.live_state([server.id for server in servers])
+        for server in servers:
+            state = live_state.get(server.id, {})
+            for field in ("last_heartbeat", "cpu_usage", "memory_usage", "task_number"):
+                if state.get(field) is not None:
+                    setattr(server, field, state[field])
+        servers.sort(key=lambda server: server.last_heartbeat, reverse=True)
+        servers = JudgeServerSerializer(servers, many=True).data
+        # 当前的并发上限(自适应关闭时为 cpu_core * TASK_PER_CORE) 和判题耗时膨胀系数
+        capacities = capacity_controller.stats([server["id"] for server in servers])
+        for server in servers:
+            server.update(capacities[server["id"]])
+            if server["capacity"] is None:
+                server["capacity"] = server["cpu_core"] * TASK_PER_CORE
         return self.success({"token": SysOptions.judge_server_token,
-                             "servers": JudgeServerSerializer(servers, many=True).data})
+                             "servers": servers,
+                             "waiting_queue": waiting_queue.stats(),
+                             "slot_leases": scheduler.lease_stats()})
 
     def delete(self, request):
         hostname = request.GET.get("hostname")
         if hostname:
             if request.session.get("_u_type") == AdminType.SUPER_ADMIN:
+                for server_id in JudgeServer.objects.filter(
+                        hostname=hostname).values_list("id", flat=True):
+                    scheduler.remove_server(server_id, hostname)
                 JudgeServer.objects.filter(hostname=hostname).delete()
             else:
                 return self.error("你没有这个权限")
@@ -166,6 +190,7 @@ class JudgeServerAPI(APIView):
         JudgeServer.objects.filter(
             id=request.data["id"]).update(
             is_disabled=is_disabled)
+        scheduler.set_disabled(request.data["id"], is_disabled)
         if not is_disabled:
             process_pending_task()
         is_reload = request.data.get("is_reload")
@@ -173,51 +198,108 @@ class JudgeServerAPI(APIView):
             if request.session.get("_u_type") == AdminType.SUPER_ADMIN:
                 JudgeServer.objects.filter(
                     id=request.data["id"]).update(task_number=0)
+                scheduler.reset_task_number(request.data["id"])
         return self.success()
 
 
+def judge_server_token_valid(request):
+    client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
+    return hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() == client_token
+
+
 class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
     @validate_serializer(JudgeServerHeartbeatSerializer)
     def post(self, request):
         data = request.data
-        client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
-        if hashlib.sha256(SysOptions.judge_server_token.encode(
-                "utf-8")).hexdigest() != client_token:
+        if not judge_server_token_valid(request):
             return self.error("Invalid token")
-        try:
-            server = JudgeServer.objects.get(hostname=data["hostname"])
-            server.judger_version = data["judger_version"]
-            server.cpu_core = data["cpu_core"]
-            server.memory_usage = data["memory"]
-            server.cpu_usage = data["cpu"]
-            server.service_url = data["service_url"]
-            server.ip = request.META["REMOTE_ADDR"]
-            server.last_heartbeat = timezone.now()
-            server.save(
-                update_fields=[
-                    "judger_version",
-                    "cpu_core",
-                    "cpu_usage",
-                    "memory_usage",
-                    "service_url",
-                    "ip",
-                    "last_heartbeat"])
-        except JudgeServer.DoesNotExist:
-            JudgeServer.objects.create(hostname=data["hostname"],
-                                       judger_version=data["judger_version"],
-                                       cpu_core=data["cpu_core"],
-                                       memory_usage=data["memory"],
-                                       cpu_usage=data["cpu"],
-                                       ip=request.META["REMOTE_ADDR"],
-                                       service_url=data["service_url"],
-                                       last_heartbeat=timezone.now(),
-                                       )
+        config = {"judger_version": data["judger_version"],
+                  "cpu_core": data["cpu_core"],
+                  "service_url": data["service_url"],
+                  "ip": request.META["REMOTE_ADDR"]}
+        # 心跳只写redis, 配置没有变化时不访问数据库, 心跳时间和使用率由 sync_judge_server_state 定时写入数据库
+        server_id = scheduler.server_id(data["hostname"])
+        res = None
+        if server_id is not None:
+            res = scheduler.heartbeat(server_id, cpu_usage=data["cpu"], memory_usage=data["memory"], **config)
+        if res is None:
+            # 新判题机, 或者redis中没有这台判题机(redis重启等)
+            server, _ = JudgeServer.objects.update_or_create(
+                hostname=data["hostname"],
+                defaults=dict(config, cpu_usage=data["cpu"], memory_usage=data["memory"],
+                              last_heartbeat=timezone.now()))
+            server_id = server.id
+            scheduler.sync_server(server)
+            _, online = scheduler.heartbeat(server_id, cpu_usage=data["cpu"], memory_usage=data["memory"], **config)
+        else:
+            previous, online = res
+            if previous != {field: str(value) for field, value in config.items()}:
+                JudgeServer.objects.filter(pk=server_id).update(last_heartbeat=timezone.now(), **config)
+        capacity_controller.on_heartbeat(server_id, data["cpu_core"], data["cpu"], data["memory"])
+        if online:
             # 新server上线 处理队列中的，防止没有新的提交而导致一直waiting
-        process_pending_task()
+            process_pending_task()
 
         return self.success()
 
 
+class JudgeServerTestCaseAPI(CSRFExemptAPIView):
+    """
+    判题机上的同步客户端(deploy/test_case_rsync/sync_client.py)使用
+    """
+
+    def get(self, request):
+        """
+        所有测试用例的 {test_case_id: manifest摘要}, 带上 version 且没有变化时 test_cases 为null
+        """
+        if not judge_server_token_valid(request):
+            return self.error("Invalid token")
+        version, catalog = test_case_store.catalog(request.GET.get("version"))
+        if version is None:
+            return self.error("Test case catalog is rebuilding")
+        return self.success({"version": version, "test_cases": catalog})
+
+    @validate_serializer(JudgeServerTestCaseSerializer)
+    def post(self, request):
+        """
+        上报判题机已经同步完成的所有测试用例, 之后分配判题机时优先选择有对应测试用例的判题机
+        """
+        if not judge_server_token_valid(request):
+            return self.error("Invalid token")
+        server_id = JudgeServer.objects.filter(
+            hostname=request.data["hostname"]).values_list("id", flat=True).first()
+        if server_id is None:
+            return self.error("Judge server does not exist")
+        scheduler.set_test_cases(server_id, request.data["test_case_ids"])
+        # 排队的提交可能在等待这台判题机同步测试用例
+        process_pending_task()
+        return self.success()
+
+
+class JudgeServerTestCaseFileAPI(CSRFExemptAPIView):
+    def get(self, request):
+        """
+        test_case_id: 返回这组测试用例的 manifest; sha256: 下载blob
+        """
+        if not judge_server_token_valid(request):
+            return self.error("Invalid token")
+        test_case_id = request.GET.get("test_case_id")
+        if test_case_id:
+            if not test_case_id.isalnum():
+                return self.error("Invalid test_case_id")
+            manifest = test_case_store.manifest(test_case_id)
+            if manifest is None:
+                return self.error("Test case does not exist")
+            return self.success(manifest)
+
+        path = test_case_store.blob_path(request.GET.get("sha256", ""))
+        if not path:
+            return self.error("Blob does not exist")
+        response = FileResponse(open(path, "rb"), content_type="application/octet-stream")
+        response["Content-Length"] = os.path.getsize(path)
+        return response
+
+
 class LanguagesAPI(APIView):
     def get(self, request):
         return self.success(
@@ -339,29 +421,27 @@ class TotalDataAPI(APIView):
 
 
 class TestCaseUnpackAPI(APIView):
-    def zip_test_cases(self, test_case_path):
-        start_dir = test_case_path  # 要压缩的文件夹路径
-        file_news = test_case_path + '.zip'  # 压缩后文件夹的名字
-
-        z = zipfile.ZipFile(file_news, 'w', zipfile.ZIP_DEFLATED)
-        for dir_path, dir_names, file_names in os.walk(start_dir):
-            f_path = dir_path.replace(start_dir, '')  # 这一句很重要，不replace的话，就从根目录开始复制
-            f_path = f_path and f_path + os.sep or ''  # 实现当前文件夹以及包含的所有文件的压缩
+    @staticmethod
+    def test_case_files(test_case_path):
+        """
+        TEST_CASE_DIR 下的所有文件, 压缩包中的路径相对于 TEST_CASE_DIR
+        """
+        for dir_path, dir_names, file_names in os.walk(test_case_path):
+            # 测试用例目录中的文件就是blob的硬链接, blob目录不重复导出
+            dir_names[:] = [name for name in dir_names
+                            if os.path.join(dir_path, name) != settings.TEST_CASE_BLOB_DIR]
             for filename in file_names:
-                z.write(os.path.join(dir_path, filename), f_path + filename)
-        z.close()
-        return file_news
+                # 以前下载测试用例时生成在测试用例目录中的zip, 不需要导出
+                if filename.endswith(".zip"):
+                    continue
+                path = os.path.join(dir_path, filename)
+                yield path, os.path.relpath(path, test_case_path)
 
     def get(self, request):
-        test_case_path = settings.TEST_CASE_DIR
-        zip_path = self.zip_test_cases(test_case_path)
+        # 边压缩边返回, 不再先在请求中生成整个压缩包
         response = StreamingHttpResponse(
-            FileWrapper(
-                open(
-                    zip_path,
-                    "rb")),
+            zip_stream(self.test_case_files(settings.TEST_CASE_DIR)),
             content_type="application/octet-stream")
 
         response["Content-Disposition"] = f"attachment; filename=test_cases.zip"
-        response["Content-Length"] = os.path.getsize(zip_path)
         return response
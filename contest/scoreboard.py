@@ -0,0 +1,118 @@
+import json
+
+from account.models import User
+from utils.cache import cache
+from utils.constants import CacheKey
+from .models import ACMContestRank
+from .serializers import ACMContestRankSerializer
+
+# 排名分数 = 通过数 * TIME_BASE - 罚时, 罚时(秒)远小于 TIME_BASE, 分数越大排名越靠前
+TIME_BASE = 10 ** 10
+# 榜单在redis中保留的时间(秒), 过期后下次访问时从数据库重建
+SCOREBOARD_TTL = 3 * 24 * 3600
+
+
+class ContestScoreboard(object):
+    """
+    ACM竞赛榜单, 每个竞赛在redis中保存:
+    有序集合 <key>: 成员为 rank.user_id, 分数见 TIME_BASE
+    hash <key>:rows: rank.user_id -> 序列化后的 acm_contest_rank 行
+    hash <key>:uids: 用户主键 -> rank.user_id, 用于查询"我的排名"
+    每次判题后 O(log n) 更新一名用户, 查询排名页不再访问数据库
+    """
+
+    @staticmethod
+    def _keys(contest_id):
+        key = f"{CacheKey.contest_scoreboard}:{contest_id}"
+        return key, f"{key}:rows", f"{key}:uids", f"{key}:built"
+
+    @staticmethod
+    def score(accepted_number, total_time):
+        return accepted_number * TIME_BASE - int(total_time)
+
+    def _write(self, p, rank, uid=None, only_new=False):
+        key, rows_key, uids_key, _ = self._keys(rank.contest_id)
+        row = json.dumps(ACMContestRankSerializer(rank).data)
+        p.zadd(key, {rank.user_id: self.score(rank.accepted_number, rank.total_time)}, nx=only_new)
+        if only_new:
+            p.hsetnx(rows_key, rank.user_id, row)
+        else:
+            p.hset(rows_key, rank.user_id, row)
+        if uid:
+            p.hset(uids_key, uid, rank.user_id)
+
+    def _expire(self, p, contest_id):
+        for key in self._keys(contest_id):
+            p.expire(key, SCOREBOARD_TTL)
+
+    def update(self, rank, uid=None):
+        """
+        判题事务提交后调用, 榜单尚未建立时只写入这一行, 其余行在重建时补齐
+        :param uid: 提交者的用户主键
+        """
+        p = cache.pipeline()
+        self._write(p, rank, uid)
+        self._expire(p, rank.contest_id)
+        p.execute()
+
+    def rebuild(self, contest_id):
+        """
+        从 acm_contest_rank 表加载整个榜单, 已经存在的行是判题后写入的, 比数据库读到的更新, 不覆盖
+        """
+        ranks = list(ACMContestRank.objects.filter(contest_id=contest_id))
+        uids = dict(User.objects.filter(
+            user_id__in=[rank.user_id for rank in ranks]).values_list("user_id", "id"))
+        _, _, uids_key, built_key = self._keys(contest_id)
+        p = cache.pipeline()
+        for rank in ranks:
+            self._write(p, rank, only_new=True)
+            if rank.user_id in uids:
+                p.hsetnx(uids_key, uids[rank.user_id], rank.user_id)
+        p.set(built_key, 1)
+        self._expire(p, contest_id)
+        p.execute()
+
+    def _ensure_built(self, contest_id):
+        if not cache.exists(self._keys(contest_id)[3]):
+            self.rebuild(contest_id)
+
+    def invalidate(self, contest_id):
+        cache.delete(*self._keys(contest_id))
+
+    def remove(self, contest_id, rank_user_id):
+        key, rows_key, uids_key, _ = self._keys(contest_id)
+        p = cache.pipeline()
+        p.zrem(key, rank_user_id)
+        p.hdel(rows_key, rank_user_id)
+        p.execute()
+
+    def page(self, contest_id, offset, limit):
+        """
+        :return: 与 paginate_data 相同的格式 {"results": [...], "total": n}
+        """
+        self._ensure_built(contest_id)
+        key, rows_key, _, _ = self._keys(contest_id)
+        p = cache.pipeline()
+        p.zcard(key)
+        p.zrevrange(key, offset, offset + limit - 1)
+        total, members = p.execute()
+        rows = cache.hmget(rows_key, members) if members else []
+        return {
+            "results": [json.loads(row.decode("utf-8")) for row in rows if row],
+            "total": total,
+            "total_exact": True}
+
+    def rank_of(self, contest_id, uid):
+        """
+        :return: 用户的名次(从1开始), 没有提交过返回None
+        """
+        self._ensure_built(contest_id)
+        key, _, uids_key, _ = self._keys(contest_id)
+        member = cache.hget(uids_key, uid)
+        if member is None:
+            return None
+        rank = cache.zrevrank(key, member)
+        return None if rank is None else rank + 1
+
+
+contest_scoreboard = ContestScoreboard()
@@ -10,9 +10,9 @@ from django.utils.timezone import now
 
 from account.models import Grade
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
-from utils.constants import CacheKey, ContestStatus
+from utils.constants import ContestStatus
 from ..models import Contest, ContestAnnouncement, ContestPartner, ACMContestRank, ContestOfGrade
+from ..scoreboard import contest_scoreboard
 from ..serializers import (
     ContestAdminSerializer,
     CreateConetestSeriaizer,
@@ -75,8 +75,7 @@ class ContestAPI(APIView):
             except ValueError:
                 return self.error(f"{ip_range} 不是一个合格的IP格式")
         if not data.get("real_time_rank"):
-            cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-            cache.delete(cache_key)
+            contest_scoreboard.invalidate(contest.id)
         [setattr(contest, k, v) for k, v in data.items()]
         contest.save()
         return self.success(ContestAdminSerializer(contest).data)
@@ -229,6 +228,7 @@ class ContestOfUsers(APIView):
             user_id=uid, contest_id=con_id).delete()
 
         ACMContestRank.objects.filter(user_id=user_id).delete()
+        contest_scoreboard.remove(con_id, user_id)
         Contest.objects.filter(pk=con_id).update(s_number=F("s_number") - 1)
 
         if rows > 0:
@@ -1,13 +1,13 @@
-from django.core.cache import cache
 from django.db.models import Q
 from django.utils.timezone import now
 
 from account.decorators import login_required, check_contest_permission
 from contest.models import ContestPartner
 from utils.api import APIView
-from utils.constants import CacheKey, ContestStatus
+from utils.constants import ContestStatus
 from utils.shortcuts import m_decrypt
 from ..models import ContestAnnouncement, Contest, ACMContestRank, EventFreshHistory
+from ..scoreboard import contest_scoreboard
 from ..serializers import (
     ACMContestRankSerializer,
     ContestSerializer,
@@ -129,7 +129,8 @@ class ContestRankAPI(APIView):
         if real_name:
             filter_query["real_name__contains"] = real_name
 
-        return ACMContestRank.objects.filter(**filter_query).values().order_by(
+        # 与榜单缓存中的行一样用 ACMContestRankSerializer 序列化模型对象
+        return ACMContestRank.objects.filter(**filter_query).order_by(
             "-accepted_number",
             "total_time")
 
@@ -137,20 +138,17 @@ class ContestRankAPI(APIView):
     def get(self, request):
 
         real_name = request.GET.get("real_name")
-        refresh = request.GET.get("force_refresh")
-        cache_key = f"{CacheKey.contest_rank_cache}:{self.contest_id}"
-
-        if refresh or self.is_contest_admin or real_name:
-            # 如果用户时创建者并且要求刷新
-            page_qs = self.paginate_data(request, self.get_rank(real_name), ACMContestRankSerializer)
-            cache.delete(cache_key)
+        if real_name:
+            # 按姓名搜索时直接查询数据库
+            data = self.paginate_data(request, self.get_rank(real_name), ACMContestRankSerializer)
         else:
-            page_qs = cache.get(cache_key)
-            if not page_qs:
-                page_qs = self.get_rank()
-                cache.set(cache_key, page_qs, timeout=300)
-            page_qs = self.paginate_data(request, page_qs, ACMContestRankSerializer)
-        return self.success(page_qs)
+            if request.GET.get("force_refresh") and self.is_contest_admin:
+                # 创建者要求刷新时从数据库重建榜单
+                contest_scoreboard.invalidate(self.contest_id)
+            limit, offset = self.get_limit_offset(request)
+            data = contest_scoreboard.page(self.contest_id, offset, limit)
+        data["my_rank"] = contest_scoreboard.rank_of(self.contest_id, self.uid)
+        return self.success(data)
 
 
 class ContestTime(APIView):
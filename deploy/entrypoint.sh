@@ -3,7 +3,7 @@
 APP=/app
 DATA=/data
 # -p, --parents 需要时创建上层目录，如目录早已存在则不当作错误
-mkdir -p $DATA/log $DATA/config $DATA/ssl $DATA/test_case $DATA/public/upload $DATA/public/avatar $DATA/public/website $DATA/model_file $DATA/contest_rank_file
+mkdir -p $DATA/log $DATA/config $DATA/ssl $DATA/test_case $DATA/public/upload $DATA/public/avatar $DATA/public/website $DATA/model_file $DATA/contest_rank_file $DATA/test_case_zip
 
 # -f filename 判断是否为常规文件
 
@@ -69,6 +69,12 @@ if [ -z "$MAX_WORKER_NUM" ]; then
     fi
 fi
 
+# 各判题通道的worker并发数
+export JUDGE_CONTEST_CONCURRENCY=${JUDGE_CONTEST_CONCURRENCY:-4}
+export JUDGE_PRACTICE_CONCURRENCY=${JUDGE_PRACTICE_CONCURRENCY:-2}
+export JUDGE_TEST_CONCURRENCY=${JUDGE_TEST_CONCURRENCY:-1}
+export JUDGE_REJUDGE_CONCURRENCY=${JUDGE_REJUDGE_CONCURRENCY:-1}
+
 cd $APP
 
 n=0
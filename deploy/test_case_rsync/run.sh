@@ -4,11 +4,17 @@ slave_runner()
 {
     while true
     do
-        rsync -avzP --delete --progress --password-file=/etc/rsync_slave.passwd $RSYNC_USER@$RSYNC_MASTER_ADDR::testcase /test_case >> /log/rsync_slave.log
+        rsync -avzPH --delete --progress --password-file=/etc/rsync_slave.passwd $RSYNC_USER@$RSYNC_MASTER_ADDR::testcase /test_case >> /log/rsync_slave.log
         sleep 5
     done
 }
 
+client_runner()
+{
+    # 按 manifest 增量同步, 并把已有的测试用例上报给后端
+    python3 /tmp/sync_client.py >> /log/test_case_sync.log 2>&1
+}
+
 master_runner()
 {
     rsync --daemon --config=/etc/rsyncd.conf
@@ -24,6 +30,8 @@ if [ "$RSYNC_MODE" = "master" ]; then
     fi
     chmod 600 /etc/rsyncd.passwd
     master_runner
+elif [ "$RSYNC_MODE" = "client" ]; then
+    client_runner
 else
     if [ ! -f "/etc/rsync_slave.passwd" ]; then
         echo "$RSYNC_PASSWORD" > /etc/rsync_slave.passwd
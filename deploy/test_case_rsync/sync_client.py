@@ -0,0 +1,206 @@
+"""
+判题机上的测试用例同步客户端, 代替 rsync 全量遍历目录:
+1. 拉取后端的测试用例目录 {test_case_id: manifest摘要}, 版本没有变化时后端不返回目录
+2. 只下载新增或摘要变化的测试用例的 manifest, 以及本地还没有的blob, 测试用例目录中的文件是blob的硬链接
+3. 删除后端已经没有的测试用例, 没有其他目录引用的blob一并删除
+4. 把本地已经有的 test_case_id 上报给后端, 后端分配判题机时优先选择已经同步了测试用例的判题机
+
+环境变量: SYNC_MASTER_URL(后端地址, 如 http://oj-backend:8000), JUDGE_SERVER_TOKEN,
+JUDGE_SERVER_HOSTNAME(与判题机心跳中的hostname一致), SYNC_INTERVAL(秒), TEST_CASE_DIR
+"""
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+MASTER_URL = os.environ.get("SYNC_MASTER_URL", "").rstrip("/")
+TOKEN = hashlib.sha256(os.environ.get("JUDGE_SERVER_TOKEN", "").encode("utf-8")).hexdigest()
+HOSTNAME = os.environ.get("JUDGE_SERVER_HOSTNAME") or socket.gethostname()
+INTERVAL = float(os.environ.get("SYNC_INTERVAL", 5))
+TEST_CASE_DIR = os.environ.get("TEST_CASE_DIR", "/test_case")
+BLOB_DIR = os.path.join(TEST_CASE_DIR, "_blobs")
+MANIFEST_NAME = "manifest"
+# 没有变化时也定期上报, 后端的redis重启后可以恢复
+REPORT_INTERVAL = 60
+CHUNK_SIZE = 1024 * 1024
+
+
+def log(message):
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+
+def request(path, params=None, data=None, raw=False):
+    url = f"{MASTER_URL}/api/{path}"
+    if params:
+        url = f"{url}?{urllib.parse.urlencode(params)}"
+    headers = {"X-Judge-Server-Token": TOKEN}
+    body = None
+    if data is not None:
+        body = json.dumps(data).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    resp = urllib.request.urlopen(urllib.request.Request(url, data=body, headers=headers), timeout=60)
+    if raw:
+        return resp
+    with resp:
+        result = json.loads(resp.read().decode("utf-8"))
+    if result.get("result") != "successful":
+        raise RuntimeError(f"{path}: {result.get('data')}")
+    return result["data"]
+
+
+def digest(manifest):
+    # 与 problem.test_case_store.TestCaseStore.digest 相同
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def blob_path(sha256):
+    return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+
+def read_manifest(test_case_id):
+    try:
+        with open(os.path.join(TEST_CASE_DIR, test_case_id, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def local_catalog():
+    catalog = {}
+    for test_case_id in os.listdir(TEST_CASE_DIR):
+        if test_case_id.isalnum() and os.path.isdir(os.path.join(TEST_CASE_DIR, test_case_id)):
+            manifest = read_manifest(test_case_id)
+            if manifest is not None:
+                catalog[test_case_id] = digest(manifest)
+    return catalog
+
+
+def fetch_blob(sha256):
+    path = blob_path(sha256)
+    if os.path.exists(path):
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    size, hasher = 0, hashlib.sha256()
+    try:
+        with request("judge_server/test_case_file", {"sha256": sha256}, raw=True) as resp, \
+                open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: resp.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        if hasher.hexdigest() != sha256:
+            raise RuntimeError(f"blob {sha256} checksum mismatch")
+        os.chmod(tmp_path, 0o640)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size
+
+
+def pull(test_case_id):
+    """
+    :return: 下载的字节数
+    """
+    manifest = request("judge_server/test_case_file", {"test_case_id": test_case_id})
+    if any(os.path.basename(name) != name or name == MANIFEST_NAME for name in manifest):
+        raise RuntimeError(f"invalid manifest of {test_case_id}")
+    size = sum(fetch_blob(sha256) for sha256 in set(manifest.values()))
+
+    # 先在临时目录中建好再改名, 判题机不会读到不完整的目录
+    tmp_dir = os.path.join(TEST_CASE_DIR, f".{test_case_id}.{uuid.uuid4().hex}")
+    os.mkdir(tmp_dir)
+    try:
+        for name, sha256 in manifest.items():
+            os.link(blob_path(sha256), os.path.join(tmp_dir, name))
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            f.write(json.dumps(manifest, indent=4))
+        os.chmod(os.path.join(tmp_dir, MANIFEST_NAME), 0o640)
+        os.chmod(tmp_dir, 0o710)
+        # 旧目录先改名移开, 新目录改名到位后再删除, 中间没有目录的时间只有两次改名之间
+        old_dir = f".{test_case_id}.{uuid.uuid4().hex}.old"
+        try:
+            os.rename(os.path.join(TEST_CASE_DIR, test_case_id), os.path.join(TEST_CASE_DIR, old_dir))
+        except FileNotFoundError:
+            old_dir = None
+        try:
+            os.rename(tmp_dir, os.path.join(TEST_CASE_DIR, test_case_id))
+        except OSError:
+            if old_dir:
+                os.rename(os.path.join(TEST_CASE_DIR, old_dir), os.path.join(TEST_CASE_DIR, test_case_id))
+            raise
+        if old_dir:
+            remove(old_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return size
+
+
+def remove(test_case_id):
+    manifest = read_manifest(test_case_id) or {}
+    shutil.rmtree(os.path.join(TEST_CASE_DIR, test_case_id), ignore_errors=True)
+    for sha256 in set(manifest.values()):
+        try:
+            if os.stat(blob_path(sha256)).st_nlink == 1:
+                os.remove(blob_path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+def sync(local, version):
+    """
+    :return: 后端目录的版本, 本地目录是否有变化; 有测试用例下载失败时版本为None, 下一轮重新对比整个目录
+    """
+    data = request("judge_server/test_cases", {"version": version} if version is not None else None)
+    remote = data["test_cases"]
+    if remote is None:
+        return data["version"], False
+
+    changed, failed, size = 0, 0, 0
+    for test_case_id, remote_digest in remote.items():
+        if local.get(test_case_id) == remote_digest or not test_case_id.isalnum():
+            continue
+        try:
+            size += pull(test_case_id)
+        except Exception as e:
+            # 下载期间后端删除了这组测试用例等, 下一轮再试
+            log(f"pull {test_case_id} failed: {e}")
+            failed += 1
+            continue
+        local[test_case_id] = remote_digest
+        changed += 1
+    for test_case_id in set(local) - set(remote):
+        remove(test_case_id)
+        local.pop(test_case_id)
+        changed += 1
+    if changed:
+        log(f"version {data['version']}: {changed} test cases changed, {size / 1024 / 1024:.1f}MB downloaded")
+    return None if failed else data["version"], bool(changed)
+
+
+def main():
+    if not MASTER_URL:
+        sys.exit("SYNC_MASTER_URL is required")
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    local, version, last_report = local_catalog(), None, 0
+    while True:
+        try:
+            new_version, changed = sync(local, version)
+            if changed or new_version != version or time.time() - last_report > REPORT_INTERVAL:
+                request("judge_server/test_cases", data={"hostname": HOSTNAME, "test_case_ids": list(local)})
+                last_report = time.time()
+            version = new_version
+        except Exception as e:
+            log(f"sync failed: {e}")
+        time.sleep(INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
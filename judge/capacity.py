@@ -0,0 +1,105 @@
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from .scheduler import TASK_PER_CORE
+
+# cpu/内存使用率(%)超过此值时减小容量
+CPU_HIGH = 90
+MEMORY_HIGH = 90
+# cpu使用率低于此值且容量用满时增加容量
+CPU_LOW = 75
+# 判题耗时膨胀到基线的多少倍时认为过载
+SLOWDOWN = 1.5
+# 乘性减小 / 加性增加
+DECREASE_FACTOR = 0.75
+INCREASE_STEP = 1
+# 每个cpu核心的容量范围
+MIN_PER_CORE = 1
+MAX_PER_CORE = 8
+# 判题耗时的EWMA系数, 基线只缓慢上升
+EWMA_ALPHA = 0.3
+BASELINE_ALPHA = 0.01
+
+
+class CapacityController(object):
+    """
+    根据心跳上报的cpu/内存使用率和判题耗时调整每台判题机同时判题的数量上限(AIMD), 代替固定的 cpu_core * 5:
+    每次心跳时, cpu/内存使用率过高或判题耗时相对基线膨胀时容量乘以 DECREASE_FACTOR,
+    容量已经用满且负载不高时加 INCREASE_STEP, 否则不变; 新判题机的初始容量为 cpu_core * TASK_PER_CORE.
+    判题耗时用 墙上时间 / 所有测试点的cpu时间 衡量, 与题目本身的耗时无关, 超额分配时cpu时间不变而墙上时间变长.
+    状态保存在判题机的redis hash中(capacity, stretch, stretch_baseline),
+    _CLAIM_SCRIPT 中有 capacity 时用它作为上限
+    """
+
+    @staticmethod
+    def _server_key(server_id):
+        return f"{CacheKey.judge_server}:{server_id}"
+
+    @staticmethod
+    def _decode(values):
+        return [float(value) if value is not None else None for value in values]
+
+    def observe(self, server_id, duration, test_cases):
+        """
+        判题结束后调用
+        :param duration: 请求判题机的耗时(秒)
+        :param test_cases: 判题机返回的每个测试点的结果
+        """
+        if not settings.JUDGE_CAPACITY_ADAPTIVE or not test_cases:
+            return
+        cpu_time = sum(item.get("cpu_time", 0) for item in test_cases) + len(test_cases)
+        stretch = duration * 1000 / cpu_time
+        key = self._server_key(server_id)
+        current, baseline = self._decode(cache.hmget(key, "stretch", "stretch_baseline"))
+        current = stretch if current is None else current + EWMA_ALPHA * (stretch - current)
+        if baseline is None or current < baseline:
+            baseline = current
+        else:
+            baseline += BASELINE_ALPHA * (current - baseline)
+        cache.hmset(key, {"stretch": current, "stretch_baseline": baseline})
+
+    def on_heartbeat(self, server_id, cpu_core, cpu_usage, memory_usage):
+        """
+        心跳时调用, 在 scheduler.heartbeat 之后
+        """
+        key = self._server_key(server_id)
+        if not settings.JUDGE_CAPACITY_ADAPTIVE:
+            cache.hdel(key, "capacity")
+            return
+        capacity, task_number, stretch, baseline = self._decode(
+            cache.hmget(key, "capacity", "task_number", "stretch", "stretch_baseline"))
+        low, high = cpu_core * MIN_PER_CORE, cpu_core * MAX_PER_CORE
+        if capacity is None:
+            capacity = cpu_core * TASK_PER_CORE
+
+        state = {}
+        slow = stretch is not None and baseline and stretch > baseline * SLOWDOWN
+        if cpu_usage > CPU_HIGH or memory_usage > MEMORY_HIGH or slow:
+            capacity *= DECREASE_FACTOR
+            if slow:
+                # 这次膨胀已经处理过, 之后的判题耗时仍然膨胀时才继续减小
+                state["stretch"] = baseline
+        elif (task_number or 0) >= int(capacity) and cpu_usage < CPU_LOW:
+            capacity += INCREASE_STEP
+        state["capacity"] = min(max(capacity, low), high)
+        cache.hmset(key, state)
+
+    def stats(self, server_ids):
+        """
+        :return: {server_id: {capacity, stretch, stretch_baseline}}, 用于后台展示
+        """
+        p = cache.pipeline(transaction=False)
+        for server_id in server_ids:
+            p.hmget(self._server_key(server_id), "capacity", "stretch", "stretch_baseline")
+        ret = {}
+        for server_id, values in zip(server_ids, p.execute()):
+            capacity, stretch, baseline = self._decode(values)
+            ret[server_id] = {
+                "capacity": int(capacity) if capacity is not None else None,
+                "stretch": round(stretch, 3) if stretch is not None else None,
+                "stretch_baseline": round(baseline, 3) if baseline is not None else None}
+        return ret
+
+
+capacity_controller = CapacityController()
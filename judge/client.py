@@ -0,0 +1,63 @@
+import gzip
+import json
+import os
+import threading
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class JudgeServerClient(object):
+    """
+    与判题机通信的http客户端
+     - 每个进程中按 service_url 复用同一个 requests.Session, 保持长连接, 不再每次判题都新建tcp连接
+     - 连接超时和读取超时分开设置, 防止某台判题机卡死时一直占用celery worker
+     - 请求体超过 gzip_threshold 字节时使用gzip压缩, 0 表示不压缩
+    """
+
+    def __init__(self, connect_timeout=3, read_timeout=60, gzip_threshold=0, pool_maxsize=10):
+        self.timeout = (connect_timeout, read_timeout)
+        self.gzip_threshold = gzip_threshold
+        self.pool_maxsize = pool_maxsize
+        self._sessions = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _session(self, service_url):
+        with self._lock:
+            if self._pid != os.getpid():
+                # celery fork出的子进程不能共用父进程的连接
+                self._sessions, self._pid = {}, os.getpid()
+            session = self._sessions.get(service_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[service_url] = session
+            return session
+
+    def _encode(self, data, headers):
+        body = json.dumps(data).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+        if self.gzip_threshold and len(body) >= self.gzip_threshold:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        return body
+
+    def post(self, service_url, path, data=None, headers=None):
+        """
+        网络错误或超时时抛出 requests.RequestException, 由调用者决定是否换一台判题机重试
+        """
+        headers = dict(headers or {})
+        body = self._encode(data, headers) if data else None
+        resp = self._session(service_url).post(
+            urljoin(service_url, path), data=body, headers=headers, timeout=self.timeout)
+        return resp.json()
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
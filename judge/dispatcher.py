@@ -1,35 +1,88 @@
 import hashlib
-import json
 import logging
-from urllib.parse import urljoin
+import time
 
 import requests
+from django.conf import settings
 from django.db import transaction
-from django.db.models import F
 
-from account.models import UserProfile
-from conf.models import JudgeServer
+from account.models import UserProfile, UserProblemStatus
+from account.status_bitmap import problem_status_bitmap
 from contest.models import ACMContestRank, ContestStatus, Contest
+from contest.scoreboard import contest_scoreboard
+from judge.capacity import capacity_controller
+from judge.client import JudgeServerClient
 from judge.languages import languages, spj_languages
+from judge.notifier import verdict_notifier
+from judge.rejudge import rejudge_jobs
+from judge.scheduler import JudgeServerSlot, scheduler
+from judge.statistics import verdict_events
+from judge.verdict_cache import verdict_cache
+from judge.waiting_queue import QueueLane, waiting_queue
 from options.options import SysOptions
-from problem.models import Problem, ProblemRuleType, ContestProblem
+from problem.models import Problem, ContestProblem
 from submission.models import JudgeStatus, Submission, TestSubmission
+from submission.solutions import accepted_solutions
 from utils.cache import cache
 from utils.constants import CacheKey
 
 logger = logging.getLogger(__name__)
 
+judge_client = JudgeServerClient(
+    connect_timeout=settings.JUDGE_SERVER_CONNECT_TIMEOUT,
+    read_timeout=settings.JUDGE_SERVER_READ_TIMEOUT,
+    gzip_threshold=settings.JUDGE_SERVER_GZIP_THRESHOLD)
+
 
 # 继续处理在队列中的问题
 def process_pending_task():
-    if cache.llen(CacheKey.waiting_queue):
-        # 防止循环引入
-        from judge.tasks import judge_task
-
-        tmp_data = cache.rpop(CacheKey.waiting_queue)
-        if tmp_data:
-            data = json.loads(tmp_data.decode("utf-8"))
-            judge_task.delay(**data)
+    """
+    按空闲判题机的数量取出排队的提交, 逐个分配已经同步了其测试用例的判题机,
+    判题机在这里就已经被占用, 直接交给判题任务使用;
+    没有这样的判题机时提交放回队列最早入队的一端, 不投递判题任务, 后面的提交继续使用空闲的判题机
+    """
+    depth = sum(waiting_queue.depth().values())
+    if not depth:
+        return
+    # 防止循环引入
+    from judge.tasks import dispatch_judge_task
+
+    slots = scheduler.claim_many(depth)
+    warm = {}
+    dispatched, requeued = [], []
+    # 放回的提交在最后才放回队列, 这里最多取出 depth 个, 不会重复取到
+    while slots and depth > 0:
+        items = waiting_queue.pop_many(len(slots))
+        if not items:
+            break
+        depth -= len(items)
+        for data in items:
+            test_case_id = data.get("test_case_id")
+            slot = None
+            for candidate in slots:
+                if (candidate.id, test_case_id) not in warm:
+                    warm[(candidate.id, test_case_id)] = scheduler.has_test_case(candidate.id, test_case_id)
+                if warm[(candidate.id, test_case_id)]:
+                    slot = candidate
+                    break
+            if slot:
+                slots.remove(slot)
+            else:
+                # 占用的判题机都没有这组测试用例, 再试一下没有占用到的判题机
+                slot = scheduler.claim(test_case_id)
+            if slot:
+                dispatched.append((slot, data))
+            else:
+                requeued.append(data)
+    for slot in slots:
+        # 其他进程已经取走了部分排队的提交, 或者剩下的判题机都没有所需的测试用例
+        scheduler.release(slot)
+    if requeued:
+        waiting_queue.requeue(requeued)
+    waiting_queue.record_dispatched([data for _, data in dispatched])
+    for slot, data in dispatched:
+        data.pop("test_case_id", None)
+        dispatch_judge_task(judge_server=list(slot), **data)
 
 
 class DispatcherBase(object):
@@ -37,35 +90,42 @@ class DispatcherBase(object):
         self.token = hashlib.sha256(
             SysOptions.judge_server_token.encode("utf-8")).hexdigest()
 
-    def _request(self, url, data=None):
-        kwargs = {"headers": {"X-Judge-Server-Token": self.token}}
-        if data:
-            kwargs["json"] = data
-        try:
-            return requests.post(url, **kwargs).json()
-        except Exception as e:
-            logger.exception(e)
-            return dict()
+    def _request(self, server, path, data=None):
+        """
+        向判题机发送请求, 连接失败(包括连接超时)时释放当前判题机, 换一台重试;
+        读取超时等其他错误时判题机可能还在判这次提交, 不重试, 否则同一个提交会被判两次
+        :return: (当前占用的判题机, 判题机返回的数据), 失败时数据为 {}, 没有可用判题机时为 (None, {})
+        """
+        headers = {"X-Judge-Server-Token": self.token}
+        for retry in range(settings.JUDGE_SERVER_RETRY, -1, -1):
+            try:
+                return server, judge_client.post(server.service_url, path, data=data, headers=headers)
+            except requests.ConnectionError as e:
+                logger.warning(f"judge server {server.service_url} connect failed: {e}")
+                if not retry:
+                    # 最后一次失败不再占用新的判题机, 由调用者释放当前的
+                    break
+                self.release_judge_server(server)
+                server = self.choose_judge_server()
+                if not server:
+                    break
+            except requests.RequestException as e:
+                logger.warning(f"judge server {server.service_url} request failed: {e}")
+                break
+            except Exception as e:
+                logger.exception(e)
+                break
+        return server, dict()
 
     @staticmethod
     def choose_judge_server():
-        with transaction.atomic():
-            servers = JudgeServer.objects.select_for_update().filter(
-                is_disabled=False).order_by("task_number")
-
-            for server in [s for s in servers if s.status == "normal"]:
-                if server.task_number <= server.cpu_core * 5:
-                    server.task_number = F("task_number") + 1
-                    server.save(update_fields=["task_number"])  # todo updata
-                    return server
+        # 在redis中原子地选出负载最小的判题机并占用, 不再对 judge_server 表加锁
+        return scheduler.claim()
 
     @staticmethod
-    def release_judge_server(judge_server_id):
-        # with transaction.atomic():
-        # 使用原子操作, 同时因为use和release中间间隔了判题过程,需要重新查询一下
-        JudgeServer.objects.filter(
-            pk=judge_server_id).update(
-            task_number=F("task_number") - 1)
+    def release_judge_server(judge_server):
+        # 数据库中的 task_number 由 sync_judge_server_state 定时同步
+        scheduler.release(judge_server)
 
 
 class SPJCompiler(DispatcherBase):
@@ -85,22 +145,28 @@ class SPJCompiler(DispatcherBase):
         server = self.choose_judge_server()
         if not server:
             return "No available judge_server"
-        result = self._request(
-            urljoin(
-                server.service_url,
-                "compile_spj"),
-            data=self.data)
-        self.release_judge_server(server.id)
+        server, result = self._request(server, "compile_spj", data=self.data)
+        if not server:
+            return "No available judge_server"
+        self.release_judge_server(server)
+        if not result:
+            return "Judge server request failed"
         if result["err"]:
             return result["data"]
 
 
 class JudgeDispatcher(DispatcherBase):
-    def __init__(self, submission_id, problem_id, custom_test, test_sub=False):
+    def __init__(self, submission_id, problem_id, custom_test, test_sub=False, rejudge_job=None, rejudge=False):
+        """
+        :param rejudge_job: 批量重新判题的任务id, 判题结束后只计数, 统计信息由 judge.rejudge 统一重新计算
+        :param rejudge: 后台单个提交的重新判题
+        """
         super().__init__()
 
         self.test_sub = test_sub
         self.custom_test = custom_test
+        self.rejudge_job = rejudge_job
+        self.rejudge = rejudge
 
         submission_model = Submission
         if self.test_sub:
@@ -110,6 +176,7 @@ class JudgeDispatcher(DispatcherBase):
                 "_id",
                 "rule_type",
                 "time_limit",
+                "spj",
                 "memory_limit",)
         else:
             __val_list = (
@@ -119,6 +186,7 @@ class JudgeDispatcher(DispatcherBase):
                 "rule_type",
                 "time_limit",
                 "test_cases",
+                "spj",
                 "memory_limit",)
 
         self.submission = submission_model.objects.get(sub_id=submission_id)
@@ -140,6 +208,13 @@ class JudgeDispatcher(DispatcherBase):
                 pk=problem_id).values(*__val_list)[0]
 
         self.problem_id = problem_id
+        # 重新判题和自测不使用缓存的结果, 重新判题前 info 已经被清空, 不能据此判断是否第一次判题
+        self.use_verdict_cache = not self.test_sub and not self.rejudge_job and not self.rejudge and \
+            verdict_cache.enabled(self.contest_id)
+
+    def choose_judge_server(self):
+        # 优先分配已经同步了这组测试用例的判题机, 自测没有 test_case_id
+        return scheduler.claim(self.problem.get("test_case_id"))
 
     def _compute_statistic_info(self, resp_data):
         # 用时和内存占用保存为多个测试点中最长的那个
@@ -148,109 +223,164 @@ class JudgeDispatcher(DispatcherBase):
         memory_list = [x["memory"] for x in resp_data]
         self.submission.statistic_info["memory_cost"] = max(memory_list) if memory_list else 0
 
-    def judge(self):
-        server = self.choose_judge_server()
+    def judge(self, judge_server=None):
+        """
+        :param judge_server: 排队的提交出队时已经占用的判题机 [id, service_url, lease]
+        """
+        if self.use_verdict_cache:
+            verdict = verdict_cache.get(self.submission.language, self.submission.code, self.problem)
+            if verdict is not None:
+                self._save_cached_verdict(verdict)
+                if judge_server:
+                    # 出队时占用的判题机没有用到
+                    self.release_judge_server(JudgeServerSlot(*judge_server))
+                    process_pending_task()
+                return
+
+        if judge_server:
+            server = JudgeServerSlot(*judge_server)
+            if not scheduler.renew(server):
+                # 判题任务在celery中等待太久, 租约已经过期被回收
+                server = self.choose_judge_server()
+            elif not scheduler.has_test_case(server.id, self.problem.get("test_case_id")):
+                # 出队时不区分测试用例, 占用的判题机还没有同步这组测试用例, 换一台
+                self.release_judge_server(server)
+                server = self.choose_judge_server()
+        else:
+            server = self.choose_judge_server()
         if not server:
             # 如果没有判题机可用,就先把信息存入消息队列,返回
             data = {
                 "submission_id": self.submission.sub_id,
                 "problem_id": self.problem_id,
-                "test_sub": self.test_sub}
-            cache.lpush(CacheKey.waiting_queue, json.dumps(data))
+                "custom_test": self.custom_test,
+                "test_sub": self.test_sub,
+                "contest_id": self.contest_id,
+                # 出队时按测试用例分配判题机
+                "test_case_id": self.problem.get("test_case_id")}
+            if self.rejudge_job:
+                data["rejudge_job"] = self.rejudge_job
+            if self.rejudge:
+                data["rejudge"] = True
+            if judge_server:
+                # 出队后没有分配到判题机, 放回最早入队的一端
+                waiting_queue.requeue([data])
+            else:
+                waiting_queue.push(data, QueueLane.of(self.contest_id, self.test_sub, self.rejudge_job))
             return
-        language = self.submission.language
-        sub_config = list(
-            filter(
-                lambda item: language == item["name"],
-                languages))[0]
-
-        data = {
-            "language_config": sub_config["config"],
-            "src": self.submission.code,
-            "max_cpu_time": self.problem.get("time_limit"),
-            "max_memory": self.problem.get("memory_limit") << 20,
-            "test_case_id": None,
-            "test_case": None,
-            "output": True,
-            "spj_version": self.problem.get("spj_version"),
-            "spj_config": None,
-            "spj_compile_config": None,
-            "spj_src": None
+        try:
+            language = self.submission.language
+            sub_config = list(
+                filter(
+                    lambda item: language == item["name"],
+                    languages))[0]
 
-        }
-        if self.test_sub:
-            data['test_case'] = self.custom_test
-        else:
-            data['test_case_id'] = self.problem.get("test_case_id")
+            data = {
+                "language_config": sub_config["config"],
+                "src": self.submission.code,
+                "max_cpu_time": self.problem.get("time_limit"),
+                "max_memory": self.problem.get("memory_limit") << 20,
+                "test_case_id": None,
+                "test_case": None,
+                "output": True,
+                "spj_version": self.problem.get("spj_version"),
+                "spj_config": None,
+                "spj_compile_config": None,
+                "spj_src": None
+
+            }
+            if self.test_sub:
+                data['test_case'] = self.custom_test
+            else:
+                data['test_case_id'] = self.problem.get("test_case_id")
 
-        # 更新提交状态为判题中
-        self.submission.result = JudgeStatus.JUDGING
-        self.submission.save(update_fields=("result",))
+            # 更新提交状态为判题中
+            self.submission.result = JudgeStatus.JUDGING
+            self.submission.save(update_fields=("result",))
 
-        cache.hset(CacheKey.submit_prefix, self.submission.sub_id, JudgeStatus.JUDGING)
+            cache.hset(CacheKey.submit_prefix, self.submission.sub_id, JudgeStatus.JUDGING)
 
-        # 发送提交到判题机
-        resp = self._request(urljoin(server.service_url, "/judge"), data=data)
-        if not resp:
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
-            return
+            # 发送提交到判题机
+            start_time = time.time()
+            server, resp = self._request(server, "/judge", data=data)
+            if not resp:
+                Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
+                self._notify_result(JudgeStatus.SYSTEM_ERROR)
+                return
 
-        if resp.get("err"):
-            # 判题结果,编译错误
-            self.submission.result = JudgeStatus.COMPILE_ERROR
-            self.submission.statistic_info["err_info"] = resp["data"]
-            self.submission.statistic_info["score"] = 0
-        else:
-            resp["data"].sort(key=lambda x: int(x["test_case"]))
-            self.submission.info = resp
-            # 计算运行的最大时间和消耗的最大内存
-            self._compute_statistic_info(resp["data"])
-            error_test_case = list(
-                filter(
-                    lambda case: case["result"] != 0,
-                    resp["data"]))
-            # ACM模式下,多个测试点全部正确则AC，否则取第一个错误的测试点的状态
-            # OI模式下, 若多个测试点全部正确则AC， 若全部错误则取第一个错误测试点状态，否则为部分正确
-
-            error_test_case_num, pass_num, list_result = len(error_test_case), len(resp["data"]), []
-
-            if not error_test_case:
-                self.submission.result = JudgeStatus.ACCEPTED
-            elif error_test_case_num == pass_num:
-                self.submission.result = error_test_case[0]["result"]
-                if not self.test_sub:
+            if resp.get("err"):
+                # 判题结果,编译错误
+                self.submission.result = JudgeStatus.COMPILE_ERROR
+                self.submission.statistic_info["err_info"] = resp["data"]
+                self.submission.statistic_info["score"] = 0
+            else:
+                capacity_controller.observe(server.id, time.time() - start_time, resp["data"])
+                resp["data"].sort(key=lambda x: int(x["test_case"]))
+                self.submission.info = resp
+                # 计算运行的最大时间和消耗的最大内存
+                self._compute_statistic_info(resp["data"])
+                error_test_case = list(
+                    filter(
+                        lambda case: case["result"] != 0,
+                        resp["data"]))
+                # ACM模式下,多个测试点全部正确则AC，否则取第一个错误的测试点的状态
+                # OI模式下, 若多个测试点全部正确则AC， 若全部错误则取第一个错误测试点状态，否则为部分正确
+
+                error_test_case_num, pass_num, list_result = len(error_test_case), len(resp["data"]), []
+
+                if not error_test_case:
+                    self.submission.result = JudgeStatus.ACCEPTED
+                elif error_test_case_num == pass_num:
+                    self.submission.result = error_test_case[0]["result"]
+                    if not self.test_sub:
+                        test_cases = self.problem.get("test_cases")
+                        list_result = [
+                            {"error": res.get("output"), "right": test_cases[int(res.get("test_case")) - 1].get("output")}
+                            for res in error_test_case]
+                else:
+                    self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
                     test_cases = self.problem.get("test_cases")
                     list_result = [
-                        {"error": res.get("output"), "right": test_cases[int(res.get("test_case")) - 1].get("output")}
-                        for res in error_test_case]
-            else:
-                self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
-                test_cases = self.problem.get("test_cases")
-                list_result = [
-                        {"error": res.get("output"), "right": test_cases[int(res.get("test_case"))].get("output")}
-                        for res in error_test_case]
-
-            self.submission.statistic_info["total_case_number"] = pass_num
-            self.submission.statistic_info["failed_case_number"] = error_test_case_num
-            self.submission.list_result = list_result
-        fields = ('result', 'statistic_info', 'info', "list_result",)
-        if self.test_sub:
-            fields = ('result', 'statistic_info', 'info',)
-        self.submission.save(update_fields=fields)
-
-        cache.hdel(CacheKey.submit_prefix, self.submission.sub_id)
-
-        # 重置判题机状态
-        self.release_judge_server(server.id)
+                            {"error": res.get("output"), "right": test_cases[int(res.get("test_case"))].get("output")}
+                            for res in error_test_case]
+
+                self.submission.statistic_info["total_case_number"] = pass_num
+                self.submission.statistic_info["failed_case_number"] = error_test_case_num
+                self.submission.list_result = list_result
+            fields = ('result', 'statistic_info', 'info', "list_result",)
+            if self.test_sub:
+                fields = ('result', 'statistic_info', 'info',)
+            self.submission.save(update_fields=fields)
+            if self.use_verdict_cache:
+                verdict_cache.set(self.submission.language, self.submission.code, self.problem, self.submission)
+
+            self._notify_result(self.submission.result)
+        finally:
+            # 重置判题机状态, 提前返回或出错时也要释放, 判题进程崩溃时由租约过期回收
+            if server:
+                self.release_judge_server(server)
+            # 出错时也要计数, 否则批量重新判题的任务一直停在判题中, 不会结算
+            if self.rejudge_job:
+                rejudge_jobs.judged(self.rejudge_job)
+            # 判题机已经释放, 系统错误提前返回时也要处理任务队列中剩余的任务
+            process_pending_task()
 
         # 如果是测试，不需要更新任何信息
         if not self.test_sub:
             self._update_some_status()
 
-        # 至此判题结束，尝试处理任务队列中剩余的任务
-        process_pending_task()
+    def _save_cached_verdict(self, verdict):
+        for field, value in verdict.items():
+            setattr(self.submission, field, value)
+        self.submission.save(update_fields=verdict_cache.fields)
+        self._notify_result(self.submission.result)
+        self._update_some_status()
 
     def _update_some_status(self):
+        if self.rejudge_job:
+            # 已经在 judge 中计数, 统计信息由 judge.rejudge 结算时统一重新计算
+            return
+
         if self.contest_id:
             # 竞赛试题
             if self.contest.status != ContestStatus.CONTEST_UNDERWAY:
@@ -265,157 +395,46 @@ class JudgeDispatcher(DispatcherBase):
 
         else:
             # 非竞赛试题
-            if self.last_result:
-                self.update_problem_status_rejudge()
-            else:
-                self.update_problem_status()
-
-    def update_problem_status_rejudge(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem_id)
-        with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().only(
-                ["accepted_number", "statistic_info"]).get(pk=self.problem_id)
-            if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[self.last_result] = problem_info.get(
-                self.last_result, 1) - 1
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=("accepted_number", "statistic_info",))
-
-            profile = UserProfile.objects.select_for_update().only(
-                *["accepted_number", "acm_problems_status"]).get(user_id=self.submission.user_id)
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get(
-                    "problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(
-                    update_fields=[
-                        "accepted_number",
-                        "acm_problems_status"])
-
-            else:
-                oi_problems_status = profile.oi_problems_status.get(
-                    "problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this tim score
-                    profile.add_score(
-                        this_time_score=score,
-                        last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(
-                    update_fields=[
-                        "accepted_number",
-                        "oi_problems_status"])
-
-    def update_problem_status(self):
-        result = str(self.submission.result)
-        problem_id = str(self.problem_id)
-        with transaction.atomic():
-            # update problem status
-            problem = Problem.objects.select_for_update().only(*[
-                "accepted_number",
-                "submission_number",
-                "statistic_info"]).get(pk=self.problem_id)
-            problem.submission_number += 1
+            self.push_verdict_event()
+            problem_status_bitmap.mark(self.submission.user_id, 0, self.problem_id, self.submission.result)
             if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(
-                update_fields=(
-                    "accepted_number",
-                    "submission_number",
-                    "statistic_info",))
-
-            # update_userprofile
-            user_profile = UserProfile.objects.select_for_update().get(
-                user_id=self.submission.user_id)
-            user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get(
-                    "problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {
-                        "status": self.submission.result, "_id": self.problem.get("_id")}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(
-                    update_fields=(
-                        "submission_number",
-                        "accepted_number",
-                        "acm_problems_status",))
+                accepted_solutions.add(self.submission)
+            elif self.last_result == JudgeStatus.ACCEPTED:
+                accepted_solutions.remove(self.problem_id, self.submission.id)
 
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get(
-                    "problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {
-                        "status": self.submission.result,
-                        "_id": self.problem.get("_id"),
-                        "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this time score
-                    user_profile.add_score(
-                        this_time_score=score,
-                        last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(
-                    update_fields=(
-                        "submission_number",
-                        "accepted_number",
-                        "oi_problems_status",))
+    def _notify_result(self, result):
+        cache.hdel(CacheKey.submit_prefix, self.submission.sub_id)
+        if not self.test_sub:
+            verdict_notifier.publish(self.submission.sub_id, result)
+
+    def push_verdict_event(self):
+        # 试题和用户的统计信息由 judge.statistics.VerdictAggregator 异步批量更新
+        verdict_events.push(
+            problem_id=int(self.problem_id),
+            display_id=self.problem.get("_id"),
+            user_id=self.submission.user_id,
+            result=self.submission.result,
+            score=self.submission.statistic_info.get("score", 0),
+            last_result=self.last_result if self.last_result else None)
 
     def update_contest_problem_status(self):
         with transaction.atomic():
-            # 返回一个锁住行直到事务结束的查询集
-            user_profile = UserProfile.objects.select_for_update().only(
-                "acm_problems_status").get(user_id=self.submission.user_id)
-
-            problem_id = str(self.problem_id)
-
-            # if self.contest.rule_type == ContestRuleType.ACM:
-            contest_problems_status = user_profile.acm_problems_status.get(
-                "contest_problems", {})
-
-            if problem_id not in contest_problems_status:
-                contest_problems_status[problem_id] = {
-                    "status": self.submission.result, "_id": self.problem.get("_id")}
-
-            elif contest_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
+            # 只锁住此用户在这道竞赛题上的状态行
+            status, created = UserProblemStatus.objects.select_for_update().get_or_create(
+                user_id=self.submission.user_id,
+                problem_id=self.problem_id,
+                contest_id=self.contest_id,
+                defaults={"status": self.submission.result, "display_id": self.problem.get("_id")})
+
+            if not created:
+                if status.status == JudgeStatus.ACCEPTED:
+                    # 如果已AC， 直接跳过 不计入任何计数器
+                    return
                 # 如果此试题养的结果时未通过，则需要重新更新结果
-                contest_problems_status[problem_id]["status"] = self.submission.result
-            else:
-                # 如果已AC， 直接跳过 不计入任何计数器
-                return
-
-            # 更新用户的竞赛提交记录信息
-            user_profile.acm_problems_status["contest_problems"] = contest_problems_status
-            user_profile.save(update_fields=("acm_problems_status",))
+                status.status = self.submission.result
+                status.save(update_fields=("status",))
+            transaction.on_commit(lambda: problem_status_bitmap.mark(
+                self.submission.user_id, self.contest_id, self.problem_id, self.submission.result))
 
             # elif self.contest.rule_type == ContestRuleType.OI:
             #     contest_problems_status = user_profile.oi_problems_status.get(
@@ -525,14 +544,7 @@ class JudgeDispatcher(DispatcherBase):
                 "submission_number",
                 "submission_info",))
 
-        change_count = cache.m_incr(
-            f"{CacheKey.contest_rank_change_count}:{self.contest_id}", 1)
-
-        if change_count % 6 < 1:
-            # 竞赛Rank每被修改了6次，就更新一次缓存
-            cache.expire(
-                f"{CacheKey.contest_rank_change_count}:{self.contest_id}", 3600)
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest_id}")
+        transaction.on_commit(lambda: contest_scoreboard.update(rank, self.submission.user_id))
 
     def _update_oi_contest_rank(self, rank):
         problem_id = str(self.submission.problem_id)
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from judge.rejudge import RejudgeStatus, rejudge_jobs
+from judge.tasks import start_rejudge
+
+
+class Command(BaseCommand):
+    help = "批量重新判题, 如: python manage.py rejudge --problem 12 --wait"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--problem", type=int, help="试题id")
+        parser.add_argument("--contest", type=int, help="竞赛id")
+        parser.add_argument("--start", type=str, help="开始时间, 如 2019-06-01T00:00:00+08:00")
+        parser.add_argument("--end", type=str, help="结束时间")
+        parser.add_argument("--job", type=str, help="只查询已有任务的进度")
+        parser.add_argument("--wait", action="store_true", help="等待任务完成, 每隔几秒输出进度")
+
+    def handle(self, *args, **options):
+        job_id = options["job"]
+        if not job_id:
+            try:
+                job_id = rejudge_jobs.create(
+                    problem_id=options["problem"],
+                    contest_id=options["contest"],
+                    start_time=options["start"],
+                    end_time=options["end"])
+            except ValueError:
+                self.stdout.write(self.style.ERROR("--problem, --contest, --start or --end is required"))
+                exit(1)
+            start_rejudge.delay(job_id)
+            self.stdout.write(self.style.SUCCESS(f"rejudge job {job_id} created"))
+
+        while True:
+            job = rejudge_jobs.progress(job_id)
+            if job is None:
+                self.stdout.write(self.style.ERROR(f"rejudge job {job_id} does not exist"))
+                exit(1)
+            self.stdout.write(f"{job['status']}: dispatched {job['dispatched']}, judged {job['judged']}/{job['total']}")
+            if not options["wait"] or job["status"] == RejudgeStatus.DONE:
+                break
+            time.sleep(5)
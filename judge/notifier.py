@@ -0,0 +1,47 @@
+import time
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 长轮询最多等待的时间(秒), 小于nginx默认的 proxy_read_timeout(60s)
+LONG_POLL_TIMEOUT = 25
+
+
+class VerdictNotifier(object):
+    """
+    判题结束后在 <submit:result>:<sub_id> 频道发布结果,
+    等待结果的请求订阅该频道(长轮询), 不再反复请求 ResultSubmission
+    """
+
+    @staticmethod
+    def _channel(sub_id):
+        return f"{CacheKey.submit_result_channel}:{sub_id}"
+
+    def publish(self, sub_id, result):
+        cache.publish(self._channel(sub_id), result)
+
+    def subscribe(self, sub_id):
+        """
+        需要在查询提交状态之前订阅, 否则在查询和订阅之间判题结束会丢失通知
+        """
+        pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(sub_id))
+        return pubsub
+
+    @staticmethod
+    def wait(pubsub, timeout=LONG_POLL_TIMEOUT):
+        """
+        gunicorn使用gevent worker, 等待期间只挂起当前协程
+        :return: 是否收到了判题结束的通知
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            # 订阅确认消息会被忽略并返回None, 继续等待
+            if pubsub.get_message(timeout=remaining):
+                return True
+
+
+verdict_notifier = VerdictNotifier()
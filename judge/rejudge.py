@@ -0,0 +1,326 @@
+import time
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils.dateparse import parse_datetime
+
+from account.models import UserProfile, UserProblemStatus
+from account.status_bitmap import problem_status_bitmap
+from contest.models import ACMContestRank, Contest
+from contest.scoreboard import contest_scoreboard
+from problem.caches import contest_problem_cache, contest_problem_list_cache
+from problem.index import problem_index
+from problem.models import Problem, ContestProblem, ProblemRuleType
+from submission.models import JudgeStatus, Submission
+from submission.solutions import accepted_solutions
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 每批读取并投递的提交数
+REJUDGE_CHUNK_SIZE = 500
+# 任务进度在redis中保留的时间(秒)
+REJUDGE_JOB_TTL = 7 * 24 * 3600
+# 还没有判题结果的提交不计入统计
+UNFINISHED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING)
+
+
+class RejudgeStatus(object):
+    DISPATCHING = "dispatching"
+    JUDGING = "judging"
+    FINALIZING = "finalizing"
+    DONE = "done"
+
+
+class RejudgeJobs(object):
+    """
+    按试题/竞赛/时间范围批量重新判题, 任务信息和进度保存在redis hash <key>:<job_id> 中:
+    1. dispatch: 按主键分批读取提交, 重置判题信息后投递到低优先级的 judge_rejudge 队列, 再投递下一批
+    2. judged: 每个提交判题结束后只计数, 不逐个更新统计信息
+    3. finalize: 全部判完后按最终结果一次性重新计算试题/用户/竞赛的统计信息, 并清除相关缓存
+    """
+    int_fields = ("total", "dispatched", "judged",)
+
+    @staticmethod
+    def _key(job_id):
+        return f"{CacheKey.rejudge_job}:{job_id}"
+
+    def create(self, problem_id=None, contest_id=None, start_time=None, end_time=None):
+        """
+        :return: job_id, 需要再调用 judge.tasks.start_rejudge 开始投递
+        """
+        if not any((problem_id, contest_id, start_time, end_time)):
+            raise ValueError("problem_id, contest_id or time range is required")
+        job_id = uuid.uuid4().hex
+        key = self._key(job_id)
+        p = cache.pipeline()
+        p.hmset(key, {
+            "problem_id": problem_id or "",
+            "contest_id": contest_id or "",
+            "start_time": str(start_time or ""),
+            "end_time": str(end_time or ""),
+            "status": RejudgeStatus.DISPATCHING,
+            "total": 0,
+            "dispatched": 0,
+            "judged": 0,
+            "create_time": time.time()})
+        p.expire(key, REJUDGE_JOB_TTL)
+        p.execute()
+        return job_id
+
+    def progress(self, job_id):
+        """
+        :return: 任务信息, 任务不存在时为None
+        """
+        job = {k.decode("utf-8"): v.decode("utf-8") for k, v in cache.hgetall(self._key(job_id)).items()}
+        if not job:
+            return None
+        for field in self.int_fields:
+            job[field] = int(job[field])
+        job["job_id"] = job_id
+        return job
+
+    @staticmethod
+    def submissions(job):
+        submissions = Submission.objects.all()
+        if job["problem_id"]:
+            submissions = submissions.filter(problem_id=job["problem_id"])
+        if job["contest_id"]:
+            submissions = submissions.filter(contest_id=job["contest_id"])
+        if job["start_time"]:
+            submissions = submissions.filter(create_time__gte=parse_datetime(job["start_time"]))
+        if job["end_time"]:
+            submissions = submissions.filter(create_time__lte=parse_datetime(job["end_time"]))
+        return submissions
+
+    def dispatch(self, job_id, last_id=0):
+        """
+        投递主键大于 last_id 的一批提交, 还有剩余时投递下一批的任务
+        """
+        # 防止循环引入
+        from judge.tasks import dispatch_judge_task, start_rejudge
+
+        job = self.progress(job_id)
+        if job is None:
+            return
+        key = self._key(job_id)
+        chunk = list(self.submissions(job).filter(id__gt=last_id).order_by("id").values_list(
+            "id", "sub_id", "problem_id", "contest_id")[:REJUDGE_CHUNK_SIZE])
+        if chunk:
+            Submission.objects.filter(id__in=[row[0] for row in chunk]).update(
+                result=JudgeStatus.PENDING, info={}, statistic_info={})
+            for _, sub_id, problem_id, contest_id in chunk:
+                dispatch_judge_task(sub_id, problem_id, contest_id=contest_id, rejudge_job=job_id)
+            cache.hincrby(key, "dispatched", len(chunk))
+        if len(chunk) == REJUDGE_CHUNK_SIZE:
+            start_rejudge.delay(job_id, chunk[-1][0])
+            return
+
+        p = cache.pipeline()
+        p.hset(key, "total", int(cache.hget(key, "dispatched")))
+        p.hset(key, "status", RejudgeStatus.JUDGING)
+        p.execute()
+        self._check_done(job_id)
+
+    def judged(self, job_id):
+        """
+        重新判题的提交判题结束(包括系统错误和判题过程中出错)后调用
+        """
+        cache.hincrby(self._key(job_id), "judged", 1)
+        self._check_done(job_id)
+
+    def _check_done(self, job_id):
+        from judge.tasks import finish_rejudge
+
+        key = self._key(job_id)
+        status, total, judged = cache.hmget(key, "status", "total", "judged")
+        if status is None or status.decode("utf-8") != RejudgeStatus.JUDGING or int(judged) < int(total):
+            return
+        # 投递完成和最后一个判题结果可能同时走到这里, 只结算一次
+        if cache.hsetnx(key, "finalize_queued", 1):
+            finish_rejudge.delay(job_id)
+
+    def finalize(self, job_id):
+        job = self.progress(job_id)
+        if job is None:
+            return
+        key = self._key(job_id)
+        cache.hset(key, "status", RejudgeStatus.FINALIZING)
+
+        submissions = self.submissions(job).order_by()
+        problem_ids = set(submissions.filter(contest__isnull=True).values_list("problem_id", flat=True).distinct())
+        if problem_ids:
+            self._rebuild_problems(problem_ids)
+            self._rebuild_user_status(submissions.filter(contest__isnull=True))
+        for contest_id in submissions.filter(contest__isnull=False).values_list("contest_id", flat=True).distinct():
+            self._rebuild_contest(contest_id)
+
+        p = cache.pipeline()
+        p.hset(key, "status", RejudgeStatus.DONE)
+        p.hset(key, "finish_time", time.time())
+        p.execute()
+
+    @staticmethod
+    def _result_counts(submissions):
+        return dict(submissions.exclude(result__in=UNFINISHED_RESULTS).order_by().values_list(
+            "result").annotate(count=Count("id")))
+
+    def _rebuild_problems(self, problem_ids):
+        """
+        公有试题的提交数/通过数/各结果数量按全部提交重新统计
+        """
+        counters = {}
+        for problem_id in problem_ids:
+            counts = self._result_counts(Submission.objects.filter(problem_id=problem_id, contest__isnull=True))
+            counters[problem_id] = (sum(counts.values()), counts.get(JudgeStatus.ACCEPTED, 0))
+            Problem.objects.filter(pk=problem_id).update(
+                submission_number=counters[problem_id][0],
+                accepted_number=counters[problem_id][1],
+                statistic_info={str(result): count for result, count in counts.items()})
+            accepted_solutions.invalidate(problem_id)
+        problem_index.set_counters(counters)
+
+    @staticmethod
+    def _replay(submissions):
+        """
+        按提交顺序计算做题状态: 通过后不再改变, 否则为最后一次提交的结果
+        :return: {user_id: submission}
+        """
+        statuses = {}
+        for submission in submissions.exclude(result__in=UNFINISHED_RESULTS).order_by("create_time", "id").values(
+                "user_id", "display_id", "result", "statistic_info"):
+            status = statuses.get(submission["user_id"])
+            if status is None or status["result"] != JudgeStatus.ACCEPTED:
+                statuses[submission["user_id"]] = submission
+        return statuses
+
+    def _rebuild_user_status(self, submissions):
+        """
+        重新计算涉及到的用户在公有试题上的做题状态, 用户的通过数和总分按前后差值更新
+        """
+        users = defaultdict(set)
+        for user_id, problem_id in submissions.values_list("user_id", "problem_id").distinct():
+            users[problem_id].add(user_id)
+        rule_types = dict(Problem.objects.filter(pk__in=list(users.keys())).values_list("id", "rule_type"))
+        deltas = defaultdict(lambda: {"accepted": 0, "score": 0})
+
+        with transaction.atomic():
+            for problem_id, user_ids in users.items():
+                latest = self._replay(Submission.objects.filter(
+                    problem_id=problem_id, contest__isnull=True, user_id__in=list(user_ids)))
+                statuses = {status.user_id: status for status in UserProblemStatus.objects.filter(
+                    problem_id=problem_id, contest_id=0, user_id__in=list(user_ids))}
+                for user_id, submission in latest.items():
+                    score = submission["statistic_info"].get("score", 0) \
+                        if rule_types.get(problem_id) == ProblemRuleType.OI else 0
+                    status = statuses.get(user_id)
+                    if status is None:
+                        status = UserProblemStatus(
+                            user_id=user_id, problem_id=problem_id, contest_id=0,
+                            display_id=submission["display_id"], status=submission["result"], score=score)
+                        old_accepted, old_score = False, 0
+                    else:
+                        old_accepted, old_score = status.status == JudgeStatus.ACCEPTED, status.score
+                        status.status, status.score = submission["result"], score
+                    status.save()
+                    delta = deltas[user_id]
+                    delta["accepted"] += int(submission["result"] == JudgeStatus.ACCEPTED) - int(old_accepted)
+                    delta["score"] += score - old_score
+
+            for user_id, delta in deltas.items():
+                if delta["accepted"] or delta["score"]:
+                    UserProfile.objects.filter(user_id=user_id).update(
+                        accepted_number=F("accepted_number") + delta["accepted"],
+                        total_score=F("total_score") + delta["score"])
+
+        for user_id in deltas.keys():
+            problem_status_bitmap.invalidate(user_id)
+
+    def _rebuild_contest(self, contest_id):
+        """
+        按提交顺序重放整场竞赛(与 JudgeDispatcher.update_contest_problem_status / update_contest_rank 相同的规则),
+        重新计算竞赛试题的统计, 用户的做题状态和ACM排名
+        """
+        contest = Contest.objects.only("id", "start_time", "end_time").get(pk=contest_id)
+        submissions = Submission.objects.filter(
+            contest_id=contest_id,
+            create_time__gte=contest.start_time,
+            create_time__lte=contest.end_time).exclude(result__in=UNFINISHED_RESULTS).order_by(
+            "create_time", "id").values("user_id", "problem_id", "display_id", "result", "create_time")
+
+        problems = defaultdict(lambda: {"submission": 0, "accepted": 0, "statistic": defaultdict(int)})
+        statuses = {}
+        ranks = defaultdict(lambda: {"submission_number": 0, "accepted_number": 0, "total_time": 0,
+                                     "submission_info": {}})
+        for submission in submissions.iterator():
+            key = (submission["user_id"], submission["problem_id"])
+            if key in statuses and statuses[key]["result"] == JudgeStatus.ACCEPTED:
+                # 已经通过的试题不再计数
+                continue
+            statuses[key] = submission
+            problem, rank = problems[submission["problem_id"]], ranks[submission["user_id"]]
+            problem["submission"] += 1
+            problem["statistic"][str(submission["result"])] += 1
+            rank["submission_number"] += 1
+            info = rank["submission_info"].setdefault(str(submission["display_id"]), {
+                "is_ac": False,
+                "ac_time": 0,
+                "error_number": 0,
+                "is_first_ac": False})
+            if submission["result"] == JudgeStatus.ACCEPTED:
+                problem["accepted"] += 1
+                rank["accepted_number"] += 1
+                info["is_ac"] = True
+                info["ac_time"] = (submission["create_time"] - contest.start_time).total_seconds()
+                info["is_first_ac"] = problem["accepted"] == 1
+                rank["total_time"] += info["ac_time"] + info["error_number"] * 20 * 60
+            else:
+                info["error_number"] += 1
+
+        problem_ids = list(ContestProblem.objects.filter(contest_id=contest_id).values_list("id", flat=True))
+        profiles = {profile["user_id"]: profile for profile in UserProfile.objects.filter(
+            user_id__in=list(ranks.keys())).values("user_id", "real_name", "user__user_id")}
+        with transaction.atomic():
+            for problem_id in problem_ids:
+                problem = problems[problem_id]
+                ContestProblem.objects.filter(pk=problem_id).update(
+                    submission_number=problem["submission"],
+                    accepted_number=problem["accepted"],
+                    statistic_info=dict(problem["statistic"]))
+
+            old_statuses = {(status.user_id, status.problem_id): status
+                            for status in UserProblemStatus.objects.filter(contest_id=contest_id)}
+            for (user_id, problem_id), submission in statuses.items():
+                status = old_statuses.get((user_id, problem_id))
+                if status is None:
+                    UserProblemStatus.objects.create(
+                        user_id=user_id, problem_id=problem_id, contest_id=contest_id,
+                        display_id=submission["display_id"], status=submission["result"])
+                elif status.status != submission["result"]:
+                    status.status = submission["result"]
+                    status.save(update_fields=("status",))
+
+            acm_ranks = {rank.user_id: rank for rank in ACMContestRank.objects.filter(contest_id=contest_id)}
+            for user_id, profile in profiles.items():
+                rank = acm_ranks.pop(profile["user__user_id"], None) or ACMContestRank(
+                    user_id=profile["user__user_id"], contest_id=contest_id)
+                rank.real_name = profile["real_name"]
+                for field, value in ranks[user_id].items():
+                    setattr(rank, field, value)
+                rank.save()
+            # 没有已判完的提交的用户
+            for rank in acm_ranks.values():
+                rank.submission_number = rank.accepted_number = rank.total_time = 0
+                rank.submission_info = {}
+                rank.save()
+
+        contest_scoreboard.invalidate(contest_id)
+        contest_problem_list_cache.invalidate(contest_id)
+        for problem_id in problem_ids:
+            contest_problem_cache.invalidate(problem_id)
+        for user_id in {user_id for user_id, _ in statuses.keys()}:
+            problem_status_bitmap.invalidate(user_id, contest_id)
+
+
+rejudge_jobs = RejudgeJobs()
@@ -0,0 +1,390 @@
+import datetime
+import logging
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+# 心跳超时时间(秒), 包含一秒延时, 提高对网络环境的适应性
+HEARTBEAT_TIMEOUT = 6
+# 每个cpu核心允许同时判题的数量
+TASK_PER_CORE = 5
+
+# lease: 占用位置时生成的租约, 以前投递的判题任务中没有, 释放时直接减少 task_number
+JudgeServerSlot = namedtuple("JudgeServerSlot", ("id", "service_url", "lease"))
+JudgeServerSlot.__new__.__defaults__ = ("",)
+
+# 在所有可用判题机中依次选出负载最小的一台并占用一个位置, 最多占用 ARGV[3] 个, 整个过程在redis中原子完成
+# 指定了测试用例时, 优先选择已经同步了这组测试用例的判题机; 运行了同步客户端但还没有同步完的判题机不参与分配,
+# 没有运行同步客户端(rsync同步)的判题机和以前一样都可以分配
+# affinity 策略: 按 sha1(test_case_id:判题机id) 排序(rendezvous hashing, 增减判题机时只有少量测试用例换判题机),
+# 同一组测试用例尽量分配给同一台判题机, 复用page cache中的测试数据和编译好的spj; 占用数量超过cpu核数且超过
+# 平均负载的 ARGV[6] 倍时顺延到排序中的下一台(bounded load), 都超过时退回负载最小
+# 判题机hash中有 capacity (judge.capacity 根据负载计算)时用它作为占用数量的上限, 否则为 cpu_core * ARGV[2]
+# 心跳超时由 <判题机hash>:alive 的过期时间判断, 见 JudgeServerScheduler.heartbeat
+# KEYS[1]: 判题机id集合  ARGV[1]: 判题机hash的key前缀  ARGV[2]: 每核任务数  ARGV[3]: 需要占用的数量
+# ARGV[4]: test_case_id, 可以为空
+# ARGV[5]: 分配策略 least_loaded / affinity  ARGV[6]: affinity 策略的负载系数
+# 每占用一个位置在 <判题机hash>:leases 中加入一个租约 ARGV[7]:序号, 分数为过期时间 ARGV[8],
+# 判题进程崩溃等没有释放的位置在租约过期后由 _RECLAIM_SCRIPT 回收
+# 返回 [id1, service_url1, lease1, id2, service_url2, lease2, ...]
+_CLAIM_SCRIPT = """
+local affinity = ARGV[5] == "affinity" and ARGV[4] ~= ""
+local servers = {}
+for _, sid in ipairs(redis.call("SMEMBERS", KEYS[1])) do
+    local key = ARGV[1] .. ":" .. sid
+    local s = redis.call("HMGET", key, "is_disabled", "cpu_core", "task_number", "service_url", "test_case_sync",
+                         "capacity")
+    if s[1] == "0" and redis.call("EXISTS", key .. ":alive") == 1 then
+        local warm = 0
+        if ARGV[4] ~= "" then
+            if redis.call("SISMEMBER", key .. ":testCases", ARGV[4]) == 1 then
+                warm = 1
+            elseif s[5] == "1" then
+                warm = -1
+            end
+        end
+        if warm >= 0 then
+            table.insert(servers, {key = key, id = sid, url = s[4], task = tonumber(s[3] or 0), warm = warm,
+                                   cores = tonumber(s[2] or 0),
+                                   limit = s[6] and math.floor(tonumber(s[6])) or tonumber(s[2] or 0) * tonumber(ARGV[2]),
+                                   rank = affinity and redis.sha1hex(ARGV[4] .. ":" .. sid) or ""})
+        end
+    end
+end
+local claimed = {}
+for _ = 1, tonumber(ARGV[3]) do
+    local best
+    if affinity then
+        local total = 0
+        for _, s in ipairs(servers) do
+            total = total + s.task
+        end
+        local bound = math.ceil((total + 1) / #servers * tonumber(ARGV[6]))
+        for _, s in ipairs(servers) do
+            if s.task < s.limit and s.task + 1 <= math.max(bound, s.cores) and
+                    (best == nil or s.warm > best.warm or (s.warm == best.warm and s.rank > best.rank)) then
+                best = s
+            end
+        end
+    end
+    if best == nil then
+        for _, s in ipairs(servers) do
+            if s.task < s.limit and (best == nil or s.warm > best.warm or
+                                      (s.warm == best.warm and s.task < best.task)) then
+                best = s
+            end
+        end
+    end
+    if best == nil then
+        break
+    end
+    best.task = best.task + 1
+    local lease = ARGV[7] .. ":" .. (#claimed / 3 + 1)
+    redis.call("HINCRBY", best.key, "task_number", 1)
+    redis.call("ZADD", best.key .. ":leases", ARGV[8], lease)
+    table.insert(claimed, best.id)
+    table.insert(claimed, best.url)
+    table.insert(claimed, lease)
+end
+return claimed
+"""
+
+# 判题机心跳, 判题机hash不存在(新判题机或redis重启)时不写入, 返回nil, 由调用方从数据库同步后重试
+# 写入实时状态, <判题机hash>:alive 的过期时间重置为心跳超时, 过期后 _CLAIM_SCRIPT 不再分配这台判题机
+# KEYS[1]: 判题机hash  KEYS[2]: <判题机hash>:alive  ARGV[1]: 心跳超时  ARGV[2..]: 字段, 值, 字段, 值...
+# 返回 [更新前的 judger_version, cpu_core, service_url, ip, 是否刚刚上线(1/0)]
+_HEARTBEAT_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return nil
+end
+local old = redis.call("HMGET", KEYS[1], "judger_version", "cpu_core", "service_url", "ip")
+redis.call("HMSET", KEYS[1], unpack(ARGV, 2))
+local online = 0
+if redis.call("SET", KEYS[2], 1, "EX", ARGV[1], "NX") then
+    online = 1
+else
+    redis.call("EXPIRE", KEYS[2], ARGV[1])
+end
+return {old[1] or "", old[2] or "", old[3] or "", old[4] or "", online}
+"""
+
+# 释放一个位置, task_number 不会小于0
+# 租约已经过期被回收时 task_number 已经减过, 只记录一次过期后释放(租约时间太短)
+# KEYS[1]: 判题机hash  KEYS[2]: <判题机hash>:leases  KEYS[3]: 统计hash  ARGV[1]: 租约, 可以为空
+_RELEASE_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[1] ~= "" and redis.call("ZREM", KEYS[2], ARGV[1]) == 0 then
+    redis.call("HINCRBY", KEYS[3], "late_release", 1)
+    return -1
+end
+local task = redis.call("HINCRBY", KEYS[1], "task_number", -1)
+if task < 0 then
+    redis.call("HSET", KEYS[1], "task_number", 0)
+    task = 0
+end
+return task
+"""
+
+# 回收所有判题机上过期的租约, task_number 重置为未过期的租约数量,
+# 同时修正没有租约的占用(以前版本投递的判题任务没有释放等)造成的偏差
+# KEYS[1]: 判题机id集合  KEYS[2]: 统计hash  ARGV[1]: 判题机hash的key前缀  ARGV[2]: 当前时间戳
+# 返回 [过期的租约数量, 回收的位置数量]
+_RECLAIM_SCRIPT = """
+local expired, reclaimed = 0, 0
+for _, sid in ipairs(redis.call("SMEMBERS", KEYS[1])) do
+    local key = ARGV[1] .. ":" .. sid
+    if redis.call("EXISTS", key) == 1 then
+        expired = expired + redis.call("ZREMRANGEBYSCORE", key .. ":leases", "-inf", ARGV[2])
+        local held = redis.call("ZCARD", key .. ":leases")
+        local task = tonumber(redis.call("HGET", key, "task_number") or 0)
+        if task ~= held then
+            redis.call("HSET", key, "task_number", held)
+            if task > held then
+                reclaimed = reclaimed + task - held
+            end
+        end
+    end
+end
+if expired > 0 then
+    redis.call("HINCRBY", KEYS[2], "expired", expired)
+end
+if reclaimed > 0 then
+    redis.call("HINCRBY", KEYS[2], "reclaimed", reclaimed)
+end
+return {expired, reclaimed}
+"""
+
+
+class JudgeServerScheduler(object):
+    """
+    判题机的实时状态(cpu_core, task_number, 心跳, cpu/内存使用率, 是否禁用)保存在redis中,
+    分配判题机时只执行一次lua脚本, 不再对 judge_server 表加行锁;
+    心跳只写redis, 配置(judger_version, cpu_core, service_url, ip)变化时才写数据库,
+    数据库中的 task_number, 心跳时间和使用率由定时任务异步同步;
+    占用的位置都有租约, 判题进程没有释放的位置在租约过期后由定时任务回收
+    """
+
+    def __init__(self):
+        self._claim_script = None
+        self._release_script = None
+        self._heartbeat_script = None
+        self._reclaim_script = None
+
+    @staticmethod
+    def _server_key(server_id):
+        return f"{CacheKey.judge_server}:{server_id}"
+
+    def _scripts(self):
+        if self._claim_script is None:
+            self._claim_script = cache.register_script(_CLAIM_SCRIPT)
+            self._release_script = cache.register_script(_RELEASE_SCRIPT)
+            self._heartbeat_script = cache.register_script(_HEARTBEAT_SCRIPT)
+            self._reclaim_script = cache.register_script(_RECLAIM_SCRIPT)
+        return self._claim_script, self._release_script
+
+    def sync_server(self, server):
+        """
+        把数据库中判题机的配置写入redis, 不会覆盖正在计数的 task_number
+        """
+        key = self._server_key(server.id)
+        p = cache.pipeline()
+        p.hmset(key, {
+            "service_url": server.service_url,
+            "cpu_core": server.cpu_core,
+            "judger_version": server.judger_version,
+            "ip": server.ip,
+            "is_disabled": int(server.is_disabled),
+            "last_heartbeat": server.last_heartbeat.timestamp(),
+        })
+        p.hsetnx(key, "task_number", server.task_number)
+        p.sadd(CacheKey.judge_server_ids, server.id)
+        p.hset(CacheKey.judge_server_hostnames, server.hostname, server.id)
+        p.execute()
+
+    def server_id(self, hostname):
+        """
+        :return: 心跳中的hostname对应的判题机id, 没有记录时为None
+        """
+        server_id = cache.hget(CacheKey.judge_server_hostnames, hostname)
+        return int(server_id) if server_id is not None else None
+
+    def heartbeat(self, server_id, **state):
+        """
+        :param state: judger_version, cpu_core, service_url, ip, cpu_usage, memory_usage
+        :return: (更新前的配置 {judger_version, cpu_core, service_url, ip}, 是否刚刚上线),
+                 判题机不在redis中时为None, 需要先 sync_server
+        """
+        self._scripts()
+        state["last_heartbeat"] = time.time()
+        args = [HEARTBEAT_TIMEOUT]
+        for field, value in state.items():
+            args.extend((field, value))
+        key = self._server_key(server_id)
+        res = self._heartbeat_script(keys=[key, f"{key}:alive"], args=args)
+        if res is None:
+            return None
+        previous = dict(zip(("judger_version", "cpu_core", "service_url", "ip"),
+                            (value.decode("utf-8") for value in res[:4])))
+        return previous, bool(res[4])
+
+    def is_alive(self, server_id):
+        return bool(cache.exists(f"{self._server_key(server_id)}:alive"))
+
+    def live_state(self, server_ids=None):
+        """
+        :param server_ids: 默认为redis中的所有判题机
+        :return: {server_id: {last_heartbeat, cpu_usage, memory_usage, task_number}}, 不在redis中的判题机不返回
+        """
+        if server_ids is None:
+            server_ids = [int(sid) for sid in cache.smembers(CacheKey.judge_server_ids)]
+        if not server_ids:
+            return {}
+        p = cache.pipeline(transaction=False)
+        for server_id in server_ids:
+            p.hmget(self._server_key(server_id), "last_heartbeat", "cpu_usage", "memory_usage", "task_number")
+        ret = {}
+        for server_id, values in zip(server_ids, p.execute()):
+            last_heartbeat, cpu_usage, memory_usage, task_number = values
+            if last_heartbeat is None:
+                continue
+            ret[server_id] = {
+                "last_heartbeat": datetime.datetime.fromtimestamp(float(last_heartbeat), datetime.timezone.utc),
+                "cpu_usage": float(cpu_usage) if cpu_usage is not None else None,
+                "memory_usage": float(memory_usage) if memory_usage is not None else None,
+                "task_number": int(task_number or 0)}
+        return ret
+
+    def set_disabled(self, server_id, is_disabled):
+        key = self._server_key(server_id)
+        if cache.exists(key):
+            cache.hset(key, "is_disabled", int(is_disabled))
+
+    def reset_task_number(self, server_id):
+        key = self._server_key(server_id)
+        if cache.exists(key):
+            p = cache.pipeline()
+            p.hset(key, "task_number", 0)
+            p.delete(f"{key}:leases")
+            p.execute()
+
+    def remove_server(self, server_id, hostname=None):
+        p = cache.pipeline()
+        if hostname:
+            p.hdel(CacheKey.judge_server_hostnames, hostname)
+        p.delete(self._server_key(server_id))
+        p.delete(f"{self._server_key(server_id)}:testCases")
+        p.delete(f"{self._server_key(server_id)}:alive")
+        p.delete(f"{self._server_key(server_id)}:leases")
+        p.srem(CacheKey.judge_server_ids, server_id)
+        p.execute()
+
+    def set_test_cases(self, server_id, test_case_ids):
+        """
+        判题机上的同步客户端上报它已经同步完成的全部 test_case_id
+        """
+        key = f"{self._server_key(server_id)}:testCases"
+        p = cache.pipeline()
+        p.delete(f"{key}:tmp")
+        for i in range(0, len(test_case_ids), 1000):
+            p.sadd(f"{key}:tmp", *test_case_ids[i:i + 1000])
+        if test_case_ids:
+            p.rename(f"{key}:tmp", key)
+        else:
+            p.delete(key)
+        p.hset(self._server_key(server_id), "test_case_sync", 1)
+        p.execute()
+
+    def has_test_case(self, server_id, test_case_id):
+        """
+        与 _CLAIM_SCRIPT 的规则相同, 没有运行同步客户端的判题机认为已经有了所有测试用例
+        """
+        if not test_case_id:
+            return True
+        key = self._server_key(server_id)
+        p = cache.pipeline(transaction=False)
+        p.sismember(f"{key}:testCases", test_case_id)
+        p.hget(key, "test_case_sync")
+        warm, test_case_sync = p.execute()
+        return bool(warm) or test_case_sync != b"1"
+
+    def claim_many(self, count, test_case_id=""):
+        """
+        一次占用最多 count 个位置, 每个位置都分配给当时负载最小的判题机
+        :param test_case_id: 只分配给已经同步了这组测试用例的判题机, affinity 策略下按它选择判题机
+        :return: [JudgeServerSlot], 可能少于 count 个
+        """
+        if count < 1:
+            return []
+        claim_script, _ = self._scripts()
+        res = claim_script(
+            keys=[CacheKey.judge_server_ids],
+            args=[CacheKey.judge_server, TASK_PER_CORE, count, test_case_id or "",
+                  settings.JUDGE_SCHEDULER_POLICY, settings.JUDGE_AFFINITY_LOAD_FACTOR,
+                  uuid.uuid4().hex, time.time() + settings.JUDGE_SLOT_LEASE_TIMEOUT])
+        return [JudgeServerSlot(id=int(res[i]), service_url=res[i + 1].decode("utf-8"),
+                                lease=res[i + 2].decode("utf-8"))
+                for i in range(0, len(res), 3)]
+
+    def claim(self, test_case_id=""):
+        slots = self.claim_many(1, test_case_id)
+        return slots[0] if slots else None
+
+    def release(self, slot):
+        """
+        :param slot: claim 返回的 JudgeServerSlot
+        """
+        _, release_script = self._scripts()
+        key = self._server_key(slot.id)
+        return release_script(keys=[key, f"{key}:leases", CacheKey.judge_slot_lease_stats], args=[slot.lease])
+
+    def renew(self, slot):
+        """
+        延长租约, 排队的提交出队时占用的位置要等判题任务开始执行才用到
+        :return: 租约是否还有效, 已经过期被回收时返回False, 这个位置不能再使用
+        """
+        if not slot.lease:
+            return True
+        key = f"{self._server_key(slot.id)}:leases"
+        expire_time = time.time() + settings.JUDGE_SLOT_LEASE_TIMEOUT
+        return bool(cache.zadd(key, {slot.lease: expire_time}, xx=True, ch=True))
+
+    def reclaim(self):
+        """
+        回收过期的租约
+        :return: 回收的位置数量
+        """
+        self._scripts()
+        expired, reclaimed = self._reclaim_script(
+            keys=[CacheKey.judge_server_ids, CacheKey.judge_slot_lease_stats],
+            args=[CacheKey.judge_server, time.time()])
+        if expired or reclaimed:
+            logger.warning(f"judge server slots leaked: {expired} leases expired, {reclaimed} slots reclaimed")
+        return reclaimed
+
+    def lease_stats(self):
+        """
+        :return: {active: 当前有效的租约数量, expired: 累计过期的租约, reclaimed: 累计回收的位置,
+                  late_release: 累计过期后才释放的租约}, 用于后台展示
+        """
+        server_ids = list(cache.smembers(CacheKey.judge_server_ids))
+        p = cache.pipeline(transaction=False)
+        p.hgetall(CacheKey.judge_slot_lease_stats)
+        for server_id in server_ids:
+            p.zcard(f"{self._server_key(server_id.decode('utf-8'))}:leases")
+        res = p.execute()
+        stats = {"expired": 0, "reclaimed": 0, "late_release": 0}
+        stats.update({k.decode("utf-8"): int(v) for k, v in res[0].items()})
+        stats["active"] = sum(res[1:])
+        return stats
+
+
+scheduler = JudgeServerScheduler()
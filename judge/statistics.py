@@ -0,0 +1,266 @@
+import json
+import logging
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from redis.exceptions import LockError
+
+from account.models import UserProfile, UserProblemStatus
+from options.models import SysOptions as SysOptionsModel
+from problem.index import problem_index
+from problem.models import Problem, ProblemRuleType
+from submission.models import JudgeStatus
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+# 每次最多合并处理的判题结果数量
+BATCH_SIZE = 500
+# 每次运行最多处理的批数, 需要在锁的过期时间内处理完
+MAX_BATCHES = 10
+LOCK_TIMEOUT = 60
+# sys_options 表中记录最后一个已经写入数据库的批次id, 与计数器在同一个事务中更新
+APPLIED_BATCH_KEY = "verdict_events_applied_batch"
+
+# 取出一批事件: 已经有取出但还没有确认的批次时原样返回, 否则从队列头部取出最多 ARGV[1] 个事件作为新批次
+# KEYS[1]: 事件队列  KEYS[2]: 当前批次hash {id, events}  ARGV[1]: 数量  ARGV[2]: 新批次的id
+# 返回 [批次id, 事件的json数组], 没有事件时为nil
+_TAKE_BATCH_SCRIPT = """
+local id = redis.call("HGET", KEYS[2], "id")
+if id then
+    return {id, redis.call("HGET", KEYS[2], "events")}
+end
+local items = redis.call("LRANGE", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items == 0 then
+    return nil
+end
+local events = "[" .. table.concat(items, ",") .. "]"
+redis.call("LTRIM", KEYS[1], #items, -1)
+redis.call("HMSET", KEYS[2], "id", ARGV[2], "events", events)
+return {ARGV[2], events}
+"""
+
+# 确认批次, 只删除id相同的批次
+# KEYS[1]: 当前批次hash  ARGV[1]: 批次id
+_ACK_BATCH_SCRIPT = """
+if redis.call("HGET", KEYS[1], "id") == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class VerdictEventLog(object):
+    """
+    非竞赛提交的判题结果先追加到redis list中, 判题进程不再对 problem 和 user_profile 加行锁,
+    由 VerdictAggregator 批量合并后写入数据库;
+    一批事件从队列移到 <key>:batch 中并分配批次id, 写库成功后再删除, 中途失败时下次取出的还是同一批
+    """
+
+    def __init__(self):
+        self._take_script = None
+        self._ack_script = None
+
+    def _scripts(self):
+        if self._take_script is None:
+            self._take_script = cache.register_script(_TAKE_BATCH_SCRIPT)
+            self._ack_script = cache.register_script(_ACK_BATCH_SCRIPT)
+        return self._take_script, self._ack_script
+
+    def push(self, problem_id, display_id, user_id, result, score=0, last_result=None):
+        """
+        :param last_result: 重新判题时上一次的结果, 首次判题为None
+        """
+        event = {
+            "problem_id": problem_id,
+            "_id": display_id,
+            "user_id": user_id,
+            "result": result,
+            "score": score,
+            "last_result": last_result}
+        cache.rpush(CacheKey.verdict_events, json.dumps(event))
+
+    def take(self, count):
+        """
+        :return: (批次id, 事件列表), 没有事件时为 (None, [])
+        """
+        take_script, _ = self._scripts()
+        res = take_script(keys=[CacheKey.verdict_events, f"{CacheKey.verdict_events}:batch"],
+                          args=[count, uuid.uuid4().hex])
+        if not res:
+            return None, []
+        return res[0].decode("utf-8"), json.loads(res[1].decode("utf-8"))
+
+    def ack(self, batch_id):
+        _, ack_script = self._scripts()
+        ack_script(keys=[f"{CacheKey.verdict_events}:batch"], args=[batch_id])
+
+    def depth(self):
+        return cache.llen(CacheKey.verdict_events)
+
+
+class VerdictAggregator(object):
+    """
+    单消费者: 持有redis锁时才处理, 每次最多处理 max_batches 批, 剩余的由下一次定时任务处理;
+    批次id和计数器在同一个事务中写入数据库, 并对这一行加锁, 写库后确认前崩溃或锁过期后
+    另一个进程取到同一批时不会重复计数
+    """
+
+    def __init__(self, event_log, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES):
+        self.event_log = event_log
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+
+    def run(self):
+        lock = cache.lock(CacheKey.verdict_events_lock, timeout=LOCK_TIMEOUT, blocking_timeout=0)
+        if not lock.acquire(blocking=False):
+            return 0
+        applied = 0
+        try:
+            for _ in range(self.max_batches):
+                batch_id, events = self.event_log.take(self.batch_size)
+                if not events:
+                    break
+                rule_types = self._apply_batch(batch_id, events)
+                if rule_types is None:
+                    # 上次写库后没有确认, 只需要确认
+                    self.event_log.ack(batch_id)
+                    continue
+                self._sync_problem_index(rule_types.keys())
+                self.event_log.ack(batch_id)
+                applied += len(events)
+                if len(events) < self.batch_size:
+                    break
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning("verdict events lock expired before release")
+        return applied
+
+    def _apply_batch(self, batch_id, events):
+        """
+        :return: {problem_id: rule_type}, 这一批已经写入过数据库时为None
+        """
+        with transaction.atomic():
+            applied_batch, _ = SysOptionsModel.objects.select_for_update().get_or_create(
+                key=APPLIED_BATCH_KEY, defaults={"value": ""})
+            if applied_batch.value == batch_id:
+                return None
+            rule_types = self._apply_problems(events)
+            self._apply_users(events, rule_types)
+            applied_batch.value = batch_id
+            applied_batch.save(update_fields=("value",))
+        return rule_types
+
+    @staticmethod
+    def _apply_problems(events):
+        """
+        按试题合并计数器增量, 每道题每批只更新一次
+        :return: {problem_id: rule_type}
+        """
+        deltas = defaultdict(lambda: {"submission": 0, "accepted": 0, "statistic": defaultdict(int)})
+        for event in events:
+            delta = deltas[event["problem_id"]]
+            result, last_result = event["result"], event["last_result"]
+            delta["statistic"][str(result)] += 1
+            if last_result is None:
+                delta["submission"] += 1
+                if result == JudgeStatus.ACCEPTED:
+                    delta["accepted"] += 1
+            else:
+                delta["statistic"][str(last_result)] -= 1
+                if last_result != JudgeStatus.ACCEPTED and result == JudgeStatus.ACCEPTED:
+                    delta["accepted"] += 1
+
+        rule_types = {}
+        # statistic_info 在这里读出合并后整体写回, 锁住这些试题, 不覆盖重新判题和后台同时写入的计数;
+        # 按id顺序加锁, 避免与其他批量更新试题的事务死锁
+        with transaction.atomic():
+            problems = Problem.objects.select_for_update().filter(pk__in=list(deltas.keys())).order_by(
+                "id").only("rule_type", "statistic_info")
+            for problem in problems:
+                delta = deltas[problem.id]
+                rule_types[problem.id] = problem.rule_type
+                statistic_info = problem.statistic_info
+                for result, count in delta["statistic"].items():
+                    statistic_info[result] = max(statistic_info.get(result, 0) + count, 0)
+                Problem.objects.filter(pk=problem.id).update(
+                    submission_number=F("submission_number") + delta["submission"],
+                    accepted_number=F("accepted_number") + delta["accepted"],
+                    statistic_info=statistic_info)
+        return rule_types
+
+    @staticmethod
+    def _sync_problem_index(problem_ids):
+        """
+        事务提交后把最新的提交数/通过数写入公有题库索引
+        """
+        counters = Problem.objects.filter(pk__in=list(problem_ids)).values_list(
+            "id", "submission_number", "accepted_number")
+        problem_index.set_counters({pid: (submission, accepted) for pid, submission, accepted in counters})
+
+    @staticmethod
+    def _apply_users(events, rule_types):
+        """
+        按顺序处理事件, 判断是否为第一次通过, 用户的做题状态写入 user_problem_status 表,
+        用户的计数器每批只更新一次
+        """
+        statuses = {
+            (status.user_id, status.problem_id): status
+            for status in UserProblemStatus.objects.filter(
+                user_id__in=list({event["user_id"] for event in events}),
+                problem_id__in=list(rule_types.keys()),
+                contest_id=0)}
+        counters = defaultdict(lambda: {"submission": 0, "accepted": 0, "score": 0})
+        created, changed = {}, {}
+
+        for event in events:
+            rule_type = rule_types.get(event["problem_id"])
+            if rule_type is None:
+                continue
+            key = (event["user_id"], event["problem_id"])
+            counter = counters[event["user_id"]]
+            if event["last_result"] is None:
+                counter["submission"] += 1
+
+            result = event["result"]
+            score = event["score"] if rule_type == ProblemRuleType.OI else 0
+            status = statuses.get(key)
+            if status is None:
+                status = UserProblemStatus(
+                    user_id=event["user_id"],
+                    problem_id=event["problem_id"],
+                    contest_id=0,
+                    display_id=event["_id"],
+                    status=result,
+                    score=score)
+                statuses[key] = created[key] = status
+                counter["score"] += score
+            elif status.status != JudgeStatus.ACCEPTED:
+                # 减去上次的得分, 加上本次的得分
+                counter["score"] += score - status.score
+                status.status, status.score = result, score
+                if key not in created:
+                    changed[key] = status
+            else:
+                # 已经通过的试题不再更新状态
+                continue
+            if result == JudgeStatus.ACCEPTED:
+                counter["accepted"] += 1
+
+        UserProblemStatus.objects.bulk_create(created.values())
+        for status in changed.values():
+            status.save(update_fields=("status", "score",))
+        for user_id, counter in counters.items():
+            UserProfile.objects.filter(user_id=user_id).update(
+                submission_number=F("submission_number") + counter["submission"],
+                accepted_number=F("accepted_number") + counter["accepted"],
+                total_score=F("total_score") + counter["score"])
+
+
+verdict_events = VerdictEventLog()
+verdict_aggregator = VerdictAggregator(verdict_events)
@@ -1,9 +1,99 @@
 from __future__ import absolute_import, unicode_literals
 from celery import shared_task
+from django.conf import settings
 
-from judge.dispatcher import JudgeDispatcher
+from conf.models import JudgeServer
+from judge.dispatcher import JudgeDispatcher, process_pending_task
+from judge.rejudge import rejudge_jobs
+from judge.scheduler import scheduler
+from judge.statistics import verdict_aggregator
+from judge.waiting_queue import QueueLane
+from problem.test_case_store import test_case_store
 
 
 @shared_task
-def judge_task(submission_id, problem_id, custom_test=None, test_sub=False):
-    JudgeDispatcher(submission_id, problem_id, custom_test, test_sub).judge()
+def judge_task(submission_id, problem_id, custom_test=None, test_sub=False, judge_server=None, rejudge=False):
+    JudgeDispatcher(submission_id, problem_id, custom_test, test_sub, rejudge=rejudge).judge(judge_server)
+
+
+@shared_task(rate_limit=settings.REJUDGE_RATE_LIMIT)
+def rejudge_task(submission_id, problem_id, rejudge_job, judge_server=None):
+    JudgeDispatcher(submission_id, problem_id, None, rejudge_job=rejudge_job).judge(judge_server)
+
+
+def dispatch_judge_task(submission_id, problem_id, custom_test=None, test_sub=False, contest_id=None,
+                        judge_server=None, rejudge_job=None, rejudge=False):
+    """
+    按竞赛/练习/自测把判题任务投递到不同的celery队列, 自测和练习的积压不会影响竞赛提交,
+    批量重新判题使用单独限速的任务和队列
+    :param rejudge: 后台单个提交的重新判题, 不使用缓存的判题结果
+    """
+    lane = QueueLane.of(contest_id, test_sub, rejudge_job)
+    if rejudge_job:
+        rejudge_task.apply_async(
+            args=(submission_id, problem_id, rejudge_job, judge_server),
+            queue=QueueLane.celery_queue(lane))
+        return
+    judge_task.apply_async(
+        args=(submission_id, problem_id, custom_test, test_sub, judge_server, rejudge),
+        queue=QueueLane.celery_queue(lane))
+
+
+@shared_task
+def start_rejudge(job_id, last_id=0):
+    """
+    分批投递批量重新判题的提交, 每个任务投递一批
+    """
+    rejudge_jobs.dispatch(job_id, last_id)
+
+
+@shared_task
+def finish_rejudge(job_id):
+    """
+    批量重新判题全部完成后重新计算统计信息
+    """
+    rejudge_jobs.finalize(job_id)
+
+
+@shared_task
+def sync_judge_server_state():
+    """
+    判题机的实时状态(task_number, 心跳时间, cpu/内存使用率)保存在redis中, 这里定时同步到数据库
+    """
+    live_state = scheduler.live_state()
+    exist_ids = set(JudgeServer.objects.filter(
+        pk__in=list(live_state.keys())).values_list("id", flat=True))
+    for server_id, state in live_state.items():
+        if server_id not in exist_ids:
+            # 判题机已经被删除
+            scheduler.remove_server(server_id)
+            continue
+        fields = {field: state[field] for field in ("last_heartbeat", "cpu_usage", "memory_usage", "task_number")
+                  if state[field] is not None}
+        JudgeServer.objects.filter(pk=server_id).update(**fields)
+
+
+@shared_task
+def reclaim_judge_server_slots():
+    """
+    回收租约过期的判题机位置(判题进程崩溃或超时被杀死等没有释放), 回收后处理排队的提交
+    """
+    if scheduler.reclaim():
+        process_pending_task()
+
+
+@shared_task(soft_time_limit=600, time_limit=660)
+def rebuild_test_case_catalog():
+    """
+    测试用例目录还没有建立(第一次部署, redis被清空等)时扫描 TEST_CASE_DIR 重建, 不在同步客户端的请求中扫描
+    """
+    if not test_case_store.catalog_built():
+        test_case_store.rebuild_catalog()
+
+
+@shared_task
+def apply_verdict_events():
+    """
+    批量合并判题结果, 更新试题和用户的统计信息
+    """
+    return verdict_aggregator.run()
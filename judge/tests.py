@@ -0,0 +1,380 @@
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import fakeredis
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.utils import timezone
+
+from account.models import User, UserProfile, UserProblemStatus
+from conf.models import JudgeServer
+from contest.models import ACMContestRank, Contest
+from judge.dispatcher import JudgeDispatcher, process_pending_task
+from judge.rejudge import rejudge_jobs
+from judge.scheduler import JudgeServerScheduler, JudgeServerSlot, TASK_PER_CORE
+from judge.statistics import VerdictAggregator, VerdictEventLog
+from judge.verdict_cache import verdict_cache
+from judge.waiting_queue import waiting_queue
+from options.models import SysOptions as SysOptionsModel
+from problem.models import ContestProblem, Problem
+from submission.models import JudgeStatus, Submission
+from utils.constants import CacheKey
+
+
+class JudgeServerSchedulerTest(TestCase):
+    """
+    redis用fakeredis代替, lua脚本需要安装lupa
+    """
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("judge.scheduler.cache", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = JudgeServerScheduler()
+
+    def add_server(self, server_id, cpu_core=1, is_disabled=False, alive=True):
+        server = JudgeServer(id=server_id, hostname=f"judge{server_id}", ip="127.0.0.1", judger_version="2.0",
+                             cpu_core=cpu_core, cpu_usage=0, memory_usage=0, last_heartbeat=timezone.now(),
+                             service_url=f"http://judge{server_id}:8080", is_disabled=is_disabled)
+        self.scheduler.sync_server(server)
+        if alive:
+            self.scheduler.heartbeat(server_id, judger_version=server.judger_version, cpu_core=cpu_core,
+                                     service_url=server.service_url, ip=server.ip, cpu_usage=0, memory_usage=0)
+        return server
+
+    def task_number(self, server_id):
+        return int(self.redis.hget(f"judge:server:{server_id}", "task_number"))
+
+    def test_claim_many_limit(self):
+        self.add_server(1, cpu_core=1)
+        self.add_server(2, cpu_core=2)
+        slots = self.scheduler.claim_many(100)
+        self.assertEqual(len(slots), 3 * TASK_PER_CORE)
+        self.assertEqual(self.task_number(1), TASK_PER_CORE)
+        self.assertEqual(self.task_number(2), 2 * TASK_PER_CORE)
+        self.assertIsNone(self.scheduler.claim())
+
+    def test_claim_least_loaded(self):
+        self.add_server(1)
+        self.add_server(2)
+        slots = self.scheduler.claim_many(2)
+        self.assertEqual(sorted(slot.id for slot in slots), [1, 2])
+
+    def test_claim_capacity(self):
+        self.add_server(1, cpu_core=2)
+        self.redis.hset("judge:server:1", "capacity", 3)
+        self.assertEqual(len(self.scheduler.claim_many(100)), 3)
+
+    def test_skip_disabled_and_dead(self):
+        self.add_server(1, is_disabled=True)
+        self.add_server(2, alive=False)
+        self.add_server(3)
+        slots = self.scheduler.claim_many(100)
+        self.assertEqual({slot.id for slot in slots}, {3})
+
+        self.scheduler.set_disabled(1, False)
+        self.redis.delete("judge:server:3:alive")
+        self.assertEqual(self.scheduler.claim().id, 1)
+
+    def test_claim_test_case(self):
+        self.add_server(1)
+        self.add_server(2)
+        self.add_server(3)
+        self.scheduler.set_test_cases(2, ["a"])
+        self.scheduler.set_test_cases(3, ["b"])
+        for _ in range(TASK_PER_CORE):
+            self.assertEqual(self.scheduler.claim("a").id, 2)
+        # 同步客户端还没有同步这组测试用例的判题机不参与分配, 没有运行同步客户端的判题机可以分配
+        self.assertEqual(self.scheduler.claim("a").id, 1)
+        self.assertTrue(self.scheduler.has_test_case(1, "a"))
+        self.assertFalse(self.scheduler.has_test_case(3, "a"))
+
+    def test_release_not_below_zero(self):
+        self.add_server(1)
+        slot = self.scheduler.claim()
+        self.scheduler.release(slot)
+        self.assertEqual(self.task_number(1), 0)
+        self.scheduler.release(slot)
+        self.scheduler.release(JudgeServerSlot(1, slot.service_url))
+        self.assertEqual(self.task_number(1), 0)
+
+    def test_reclaim(self):
+        self.add_server(1, cpu_core=2)
+        with override_settings(JUDGE_SLOT_LEASE_TIMEOUT=-1):
+            self.scheduler.claim_many(3)
+        self.scheduler.claim_many(2)
+        # 没有租约的占用
+        self.redis.hincrby("judge:server:1", "task_number", 1)
+
+        self.assertEqual(self.scheduler.reclaim(), 4)
+        self.assertEqual(self.task_number(1), 2)
+        self.assertEqual(self.redis.zcard("judge:server:1:leases"), 2)
+        self.assertEqual(self.scheduler.reclaim(), 0)
+        stats = self.scheduler.lease_stats()
+        self.assertEqual((stats["active"], stats["expired"], stats["reclaimed"]), (2, 3, 4))
+
+    def test_renew_after_expired(self):
+        self.add_server(1)
+        slot = self.scheduler.claim()
+        self.assertTrue(self.scheduler.renew(slot))
+        with override_settings(JUDGE_SLOT_LEASE_TIMEOUT=-1):
+            expired_slot = self.scheduler.claim()
+        self.scheduler.reclaim()
+        self.assertFalse(self.scheduler.renew(expired_slot))
+
+        # 已经回收的位置释放时不会再减少 task_number
+        self.scheduler.release(expired_slot)
+        self.assertEqual(self.task_number(1), 1)
+        self.assertEqual(self.scheduler.lease_stats()["late_release"], 1)
+
+
+class ProcessPendingTaskTest(TestCase):
+    add_server = JudgeServerSchedulerTest.add_server
+    task_number = JudgeServerSchedulerTest.task_number
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for target in ("judge.scheduler.cache", "judge.waiting_queue.cache"):
+            patcher = mock.patch(target, self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.scheduler = JudgeServerScheduler()
+        patcher = mock.patch("judge.dispatcher.scheduler", self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("judge.tasks.dispatch_judge_task")
+        self.dispatch_judge_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queued(self):
+        return [json.loads(item)["submission_id"] for item in reversed(self.redis.lrange("waitingQueue:practice", 0, -1))]
+
+    def dispatched(self):
+        return [call[1]["submission_id"] for call in self.dispatch_judge_task.call_args_list]
+
+    def test_skip_cold_items(self):
+        self.add_server(1)
+        self.scheduler.set_test_cases(1, ["warm"])
+        for i in range(3):
+            waiting_queue.push({"submission_id": f"cold{i}", "problem_id": 1, "test_case_id": "cold"})
+        for i in range(3):
+            waiting_queue.push({"submission_id": f"warm{i}", "problem_id": 2, "test_case_id": "warm"})
+        process_pending_task()
+
+        self.assertEqual(self.dispatched(), ["warm0", "warm1", "warm2"])
+        self.assertFalse(any("test_case_id" in call[1] or "enqueue_time" in call[1]
+                             for call in self.dispatch_judge_task.call_args_list))
+        # 没有判题机可以分配的提交放回队列, 出队顺序不变
+        self.assertEqual(self.queued(), ["cold0", "cold1", "cold2"])
+        self.assertEqual(self.task_number(1), 3)
+        self.assertEqual(waiting_queue.stats()["dispatched"], 3)
+
+        # 同步完成后按原来的顺序分发
+        self.scheduler.set_test_cases(1, ["warm", "cold"])
+        process_pending_task()
+        self.assertEqual(self.dispatched()[3:], ["cold0", "cold1"])
+        self.assertEqual(self.queued(), ["cold2"])
+        self.assertEqual(self.task_number(1), TASK_PER_CORE)
+
+
+class WaitingQueueTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("judge.waiting_queue.cache", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def push_legacy(self, submission_id, test_sub=False):
+        self.redis.lpush(CacheKey.waiting_queue, json.dumps({"submission_id": submission_id, "test_sub": test_sub}))
+
+    def test_migrate_legacy(self):
+        for i in range(3):
+            self.push_legacy(f"old{i}", test_sub=i == 1)
+        waiting_queue.push({"submission_id": "new"})
+        # 上次迁移改名后进程退出, 之后旧版本的进程又放入了提交
+        self.redis.rename(CacheKey.waiting_queue, f"{CacheKey.waiting_queue}:migrating")
+        self.push_legacy("old3")
+
+        self.assertEqual(waiting_queue.depth(), {"contest": 0, "practice": 3, "test": 1, "rejudge": 0})
+        self.assertEqual(waiting_queue.depth()["practice"], 4)
+        self.assertFalse(self.redis.exists(CacheKey.waiting_queue, f"{CacheKey.waiting_queue}:migrating"))
+        self.assertEqual([data["submission_id"] for data in waiting_queue.pop_many(10)],
+                         ["old3", "old0", "old2", "new", "old1"])
+
+
+class VerdictAggregatorTest(TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch("judge.statistics.cache", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for name in ("_apply_problems", "_apply_users", "_sync_problem_index"):
+            patcher = mock.patch.object(VerdictAggregator, name, return_value={})
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.event_log = VerdictEventLog()
+        self.aggregator = VerdictAggregator(self.event_log, batch_size=10, max_batches=2)
+
+    def push(self, count):
+        for i in range(count):
+            self.event_log.push(problem_id=1, display_id="1", user_id=i, result=JudgeStatus.ACCEPTED)
+
+    def applied_events(self):
+        return [event["user_id"] for call in self._apply_problems.call_args_list for event in call[0][0]]
+
+    def test_run_batches(self):
+        self.push(25)
+        self.assertEqual(self.aggregator.run(), 20)
+        self.assertEqual(self.event_log.depth(), 5)
+        self.assertEqual(self.aggregator.run(), 5)
+        self.assertEqual(self.event_log.depth(), 0)
+        self.assertEqual(self.applied_events(), list(range(25)))
+
+    def test_replay_after_crash(self):
+        self.push(5)
+        # 写库成功后确认前崩溃
+        with mock.patch.object(self.event_log, "ack", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.aggregator.run()
+        self.assertEqual(self._apply_problems.call_count, 1)
+
+        self.push(3)
+        self.assertEqual(self.aggregator.run(), 3)
+        self.assertEqual(self.applied_events(), [0, 1, 2, 3, 4, 0, 1, 2])
+        self.assertEqual(self.event_log.depth(), 0)
+        self.assertFalse(self.redis.exists(f"{CacheKey.verdict_events}:batch"))
+
+    def test_retry_after_rollback(self):
+        self.push(5)
+        self._apply_users.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self.aggregator.run()
+        self.assertFalse(SysOptionsModel.objects.filter(key="verdict_events_applied_batch").exclude(value="").exists())
+
+        self._apply_users.side_effect = None
+        self.assertEqual(self.aggregator.run(), 5)
+        self.assertEqual(self.applied_events(), [0, 1, 2, 3, 4] * 2)
+
+    def test_lock(self):
+        self.push(5)
+        lock = self.redis.lock(CacheKey.verdict_events_lock, timeout=60)
+        lock.acquire()
+        self.assertEqual(self.aggregator.run(), 0)
+        lock.release()
+
+        # 锁在处理过程中过期
+        self._apply_users.side_effect = lambda *args: self.redis.delete(CacheKey.verdict_events_lock)
+        self.assertEqual(self.aggregator.run(), 5)
+
+
+class RejudgeContestTest(TestCase):
+    """
+    重新判题结算时重放整场竞赛, 结果要与判题时逐个提交更新的竞赛统计和ACM排名相同
+    """
+
+    def setUp(self):
+        start_time = timezone.now() - timedelta(hours=1)
+        self.admin = User.objects.create(username="admin", email="admin")
+        self.contest = Contest.objects.create(title="contest", start_time=start_time,
+                                              end_time=start_time + timedelta(hours=2), created_by=self.admin)
+        self.problems = [self.create_problem(_id) for _id in (1, 2)]
+        self.users = [self.create_user(f"user{i}") for i in range(3)]
+
+    def create_problem(self, _id):
+        return ContestProblem.objects.create(
+            contest_id=self.contest.id, _id=_id, title=f"problem{_id}", description="", input_description="",
+            output_description="", samples=[], test_case_score=[], languages=["C"], time_limit=1000,
+            memory_limit=256, source=self.admin)
+
+    @staticmethod
+    def create_user(username):
+        user = User.objects.create(username=username, email=username)
+        UserProfile.objects.create(user=user, real_name=username)
+        return user
+
+    def judge(self, submissions):
+        """
+        按顺序创建已判完的提交, 并按判题结束时的流程更新竞赛统计
+        """
+        for minutes, (user, problem, result) in enumerate(submissions):
+            submission = Submission.objects.create(
+                contest=self.contest, problem_id=problem.id, display_id=problem._id, result=result,
+                user_id=user.id, language="C", code="")
+            Submission.objects.filter(pk=submission.pk).update(
+                create_time=self.contest.start_time + timedelta(minutes=minutes + 1))
+            with mock.patch("judge.dispatcher.SysOptions", judge_server_token="token"):
+                dispatcher = JudgeDispatcher(submission.sub_id, problem.id, None)
+            dispatcher._update_some_status()
+
+    def snapshot(self):
+        ranks = {rank.user_id: (rank.real_name, rank.submission_number, rank.accepted_number, rank.total_time,
+                                rank.submission_info)
+                 for rank in ACMContestRank.objects.filter(contest_id=self.contest.id)}
+        statuses = set(UserProblemStatus.objects.filter(contest_id=self.contest.id).values_list(
+            "user_id", "problem_id", "status"))
+        problems = list(ContestProblem.objects.filter(contest_id=self.contest.id).order_by("id").values_list(
+            "submission_number", "accepted_number", "statistic_info"))
+        return ranks, statuses, problems
+
+    def test_rebuild_contest(self):
+        (user0, user1, user2), (problem1, problem2) = self.users, self.problems
+        self.judge([
+            (user0, problem1, JudgeStatus.WRONG_ANSWER),
+            (user1, problem1, JudgeStatus.ACCEPTED),
+            (user0, problem1, JudgeStatus.ACCEPTED),
+            # 通过后的提交不再计数
+            (user0, problem1, JudgeStatus.WRONG_ANSWER),
+            (user1, problem2, JudgeStatus.COMPILE_ERROR),
+            (user2, problem2, JudgeStatus.CPU_TIME_LIMIT_EXCEEDED),
+            (user1, problem2, JudgeStatus.ACCEPTED),
+            (user2, problem1, JudgeStatus.RUNTIME_ERROR),
+        ])
+        expected = self.snapshot()
+        self.assertEqual(expected[0][user1.user_id][1:3], (3, 2))
+        self.assertTrue(expected[0][user1.user_id][4]["1"]["is_first_ac"])
+        self.assertFalse(expected[0][user0.user_id][4]["1"]["is_first_ac"])
+
+        ACMContestRank.objects.filter(contest_id=self.contest.id).update(
+            submission_number=0, accepted_number=0, total_time=0, submission_info={})
+        ContestProblem.objects.filter(contest_id=self.contest.id).update(
+            submission_number=0, accepted_number=0, statistic_info={})
+        UserProblemStatus.objects.filter(contest_id=self.contest.id, user_id=user2.id).delete()
+
+        rejudge_jobs._rebuild_contest(self.contest.id)
+        self.assertEqual(self.snapshot(), expected)
+
+
+class VerdictCacheTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch("judge.verdict_cache.cache", fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.problem = {"test_case_id": "tc", "time_limit": 1000, "memory_limit": 256, "spj": False,
+                        "spj_version": None}
+        submission = SimpleNamespace(result=JudgeStatus.ACCEPTED, info={}, statistic_info={}, list_result=[])
+        verdict_cache.set("C", "code", self.problem, submission)
+
+    def test_key(self):
+        self.assertEqual(verdict_cache.get("C", "code", self.problem)["result"], JudgeStatus.ACCEPTED)
+        self.assertIsNone(verdict_cache.get("C", "code2", self.problem))
+        for field, value in (("time_limit", 2000), ("spj", True), ("spj_version", "v2")):
+            self.assertIsNone(verdict_cache.get("C", "code", dict(self.problem, **{field: value})))
+
+    @override_settings(VERDICT_CACHE_ENABLED=True)
+    def test_rejudge_skips_cache(self):
+        user = User.objects.create(username="maxin", email="maxin")
+        problem = Problem.objects.create(
+            _id=1, title="problem", description="", input_description="", output_description="", samples=[],
+            test_case_id="tc", test_case_score=[], languages=["C"], time_limit=1000, memory_limit=256,
+            source=user)
+        submission = Submission.objects.create(problem_id=problem.id, display_id=1, user_id=user.id,
+                                               language="C", code="code")
+        with mock.patch("judge.dispatcher.SysOptions", judge_server_token="token"):
+            dispatcher = JudgeDispatcher(submission.sub_id, problem.id, None)
+            self.assertTrue(dispatcher.use_verdict_cache)
+            self.assertIn("spj", dispatcher.problem)
+            # 后台重新判题前已经清空了 info
+            self.assertFalse(JudgeDispatcher(submission.sub_id, problem.id, None, rejudge=True).use_verdict_cache)
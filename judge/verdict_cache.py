@@ -0,0 +1,63 @@
+import hashlib
+import json
+
+from django.conf import settings
+
+from submission.models import JudgeStatus
+from utils.cache import cache
+from utils.constants import CacheKey
+
+
+class VerdictCache(object):
+    """
+    相同的代码在相同的测试用例和限制下判题结果相同, 重复提交(网络重试, 连点提交)直接使用上次的结果
+    每组测试用例一个hash: <key>:<test_case_id>, field 为 (语言, 代码sha256, 时间/内存限制, 是否spj, spj版本) 的摘要,
+    修改测试用例时删除旧 test_case_id 的整个hash
+    """
+    fields = ("result", "info", "statistic_info", "list_result",)
+
+    @staticmethod
+    def enabled(contest_id):
+        if not settings.VERDICT_CACHE_ENABLED:
+            return False
+        return not contest_id or settings.VERDICT_CACHE_CONTEST
+
+    @staticmethod
+    def _key(test_case_id):
+        return f"{CacheKey.verdict_cache}:{test_case_id}"
+
+    @staticmethod
+    def _field(language, code, problem):
+        code_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        raw = f"{language}|{code_hash}|{problem.get('time_limit')}|{problem.get('memory_limit')}|" \
+              f"{problem.get('spj')}|{problem.get('spj_version')}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, language, code, problem):
+        """
+        :return: {result, info, statistic_info, list_result}, 没有缓存时为None
+        """
+        test_case_id = problem.get("test_case_id")
+        if not test_case_id:
+            return None
+        verdict = cache.hget(self._key(test_case_id), self._field(language, code, problem))
+        return json.loads(verdict.decode("utf-8")) if verdict else None
+
+    def set(self, language, code, problem, submission):
+        test_case_id = problem.get("test_case_id")
+        # 系统错误与判题机有关, 不缓存
+        if not test_case_id or submission.result == JudgeStatus.SYSTEM_ERROR:
+            return
+        verdict = {field: getattr(submission, field) for field in self.fields}
+        key = self._key(test_case_id)
+        p = cache.pipeline()
+        p.hset(key, self._field(language, code, problem), json.dumps(verdict))
+        p.expire(key, settings.VERDICT_CACHE_TIMEOUT)
+        p.execute()
+
+    def invalidate(self, test_case_id):
+        if test_case_id:
+            cache.delete(self._key(test_case_id))
+
+
+verdict_cache = VerdictCache()
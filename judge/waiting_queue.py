@@ -0,0 +1,175 @@
+import json
+import time
+
+import redis
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 迁移旧版本队列时每次移动的提交数
+MIGRATE_CHUNK_SIZE = 100
+
+# 旧队列最新的一端还是这几个提交时才移动, 多个进程同时迁移时不会重复或丢失
+# KEYS[1]: 迁移中的旧队列; ARGV: 通道key, 提交, ...
+_MIGRATE_SCRIPT = """
+local count = #ARGV / 2
+local items = redis.call("LRANGE", KEYS[1], 0, count - 1)
+if #items < count then
+    return 0
+end
+for i = 1, count do
+    if items[i] ~= ARGV[2 * i] then
+        return 0
+    end
+end
+for i = 1, count do
+    redis.call("RPUSH", ARGV[2 * i - 1], ARGV[2 * i])
+end
+redis.call("LTRIM", KEYS[1], count, -1)
+return count
+"""
+
+
+class QueueLane(object):
+    """
+    判题任务的优先级通道, 竞赛提交 > 练习提交 > 自测 > 批量重新判题,
+    每个通道对应一个celery队列(judge_<lane>), 由各自的worker消费
+    """
+    CONTEST = "contest"
+    PRACTICE = "practice"
+    TEST = "test"
+    REJUDGE = "rejudge"
+
+    # 按优先级从高到低排列, 出队时先取完高优先级的队列
+    ordered = (CONTEST, PRACTICE, TEST, REJUDGE)
+
+    @classmethod
+    def of(cls, contest_id=None, test_sub=False, rejudge_job=None):
+        if rejudge_job:
+            return cls.REJUDGE
+        if test_sub:
+            return cls.TEST
+        if contest_id:
+            return cls.CONTEST
+        return cls.PRACTICE
+
+    @staticmethod
+    def celery_queue(lane):
+        return f"judge_{lane}"
+
+
+class WaitingQueue(object):
+    """
+    没有可用判题机时提交在此排队, 每个优先级一个redis list, 同一优先级内先进先出,
+    出队时记录排队时间, 供后台查看队列积压情况
+    """
+
+    _migrating_key = f"{CacheKey.waiting_queue}:migrating"
+
+    @staticmethod
+    def _key(lane):
+        return f"{CacheKey.waiting_queue}:{lane}"
+
+    def push(self, data, lane=QueueLane.PRACTICE):
+        data = dict(data, enqueue_time=time.time())
+        cache.lpush(self._key(lane), json.dumps(data))
+
+    def depth(self):
+        p = cache.pipeline()
+        for lane in QueueLane.ordered:
+            p.llen(self._key(lane))
+        p.llen(CacheKey.waiting_queue)
+        p.llen(self._migrating_key)
+        depth = p.execute()
+        if depth.pop() + depth.pop():
+            self._migrate_legacy()
+            p = cache.pipeline()
+            for lane in QueueLane.ordered:
+                p.llen(self._key(lane))
+            depth = p.execute()
+        return dict(zip(QueueLane.ordered, depth))
+
+    def _migrate_legacy(self):
+        """
+        以前的版本所有提交都在同一个list CacheKey.waiting_queue 中, 升级时按是否自测移入对应的通道,
+        放在通道中最早入队的一端, 先于升级后入队的提交出队;
+        旧队列先改名为固定的key, 迁移中途进程退出时下次调用接着迁移
+        """
+        try:
+            # 上次的迁移还没有完成时不改名, 完成后再迁移新的
+            cache.renamenx(CacheKey.waiting_queue, self._migrating_key)
+        except redis.ResponseError:
+            # 旧队列已经被移走
+            pass
+        while True:
+            items = cache.lrange(self._migrating_key, 0, MIGRATE_CHUNK_SIZE - 1)
+            if not items:
+                return
+            args = []
+            # 左进右出, 从最新的开始依次放到最右侧, 最早入队的在最右侧
+            for item in items:
+                data = json.loads(item.decode("utf-8"))
+                args.extend((self._key(QueueLane.of(data.get("contest_id"), data.get("test_sub"))), item))
+            # 其他进程已经移走了这几个提交时不移动, 重新读取
+            cache.eval(_MIGRATE_SCRIPT, 1, self._migrating_key, *args)
+
+    def _pop_lane(self, lane, count):
+        key = self._key(lane)
+        # list左进右出, 最右侧是最早入队的
+        p = cache.pipeline()
+        p.lrange(key, -count, -1)
+        p.ltrim(key, 0, -count - 1)
+        items, _ = p.execute()
+        return [json.loads(item.decode("utf-8")) for item in reversed(items)]
+
+    def pop_many(self, count):
+        """
+        按优先级取出最多 count 个排队的提交, 分发后调用 record_dispatched 统计排队时间
+        """
+        ret = []
+        for lane in QueueLane.ordered:
+            if len(ret) >= count:
+                break
+            ret.extend(self._pop_lane(lane, count - len(ret)))
+        return ret
+
+    def requeue(self, items):
+        """
+        取出后没有分配到判题机的提交放回各自通道最早入队的一端, 保留原来的入队时间, 下次先于其他提交出队
+        :param items: 按出队顺序排列
+        """
+        p = cache.pipeline()
+        # 倒序依次放到最右侧, 放回后的出队顺序不变
+        for data in reversed(items):
+            data = dict(data)
+            data.setdefault("enqueue_time", time.time())
+            lane = QueueLane.of(data.get("contest_id"), data.get("test_sub"), data.get("rejudge_job"))
+            p.rpush(self._key(lane), json.dumps(data))
+        p.execute()
+
+    def record_dispatched(self, items):
+        """
+        统计分发出去的提交的排队时间, 同时去掉其中的入队时间
+        """
+        if not items:
+            return
+        now = time.time()
+        waits = [now - item.pop("enqueue_time", now) for item in items]
+        p = cache.pipeline()
+        p.hincrby(CacheKey.waiting_queue_stats, "dispatched", len(waits))
+        p.hincrbyfloat(CacheKey.waiting_queue_stats, "total_wait", sum(waits))
+        # 最近一批出队的提交中最长的排队时间
+        p.hset(CacheKey.waiting_queue_stats, "last_wait", max(waits))
+        p.execute()
+
+    def stats(self):
+        stats = {k.decode("utf-8"): float(v) for k, v in cache.hgetall(CacheKey.waiting_queue_stats).items()}
+        dispatched = int(stats.get("dispatched", 0))
+        return {
+            "depth": self.depth(),
+            "dispatched": dispatched,
+            "avg_wait": stats.get("total_wait", 0) / dispatched if dispatched else 0,
+            "last_wait": stats.get("last_wait", 0)}
+
+
+waiting_queue = WaitingQueue()
@@ -1,11 +1,25 @@
 # !/usr/bin/env python
 # -*- coding:utf-8 -*-
 from celery.schedules import crontab
+from kombu import Queue
 
 CELERY_TASK_SOFT_TIME_LIMIT = CELERY_TASK_TIME_LIMIT = 180
 
 CELERYD_MAX_TASKS_PER_CHILD = 20
 CELERY_ACKS_LATE = True
+# 判题任务耗时长, 每个worker进程只预取一个任务, 防止任务堆积在繁忙的进程上
+CELERYD_PREFETCH_MULTIPLIER = 1
+
+# 判题任务按 竞赛/练习/自测 分别进入不同的队列(见 judge.waiting_queue.QueueLane),
+# 每个队列由单独的worker消费, 并发数即为该通道的权重, 见 deploy/supervisord.conf
+CELERY_DEFAULT_QUEUE = "celery"
+CELERY_QUEUES = (
+    Queue("celery"),
+    Queue("judge_contest"),
+    Queue("judge_practice"),
+    Queue("judge_test"),
+    Queue("judge_rejudge"),
+)
 
 CELERY_IMPORTS = (
     'oj.tasks',
@@ -28,6 +42,22 @@ CELERYBEAT_SCHEDULE = {
     'daily_task_clean_submission': {
         'task': 'oj.tasks.clean_test_submission',
         'schedule': crontab(minute=30, hour=2)
+    },
+    'sync_judge_server_state': {
+        'task': 'judge.tasks.sync_judge_server_state',
+        'schedule': 30.0
+    },
+    'reclaim_judge_server_slots': {
+        'task': 'judge.tasks.reclaim_judge_server_slots',
+        'schedule': 30.0
+    },
+    'apply_verdict_events': {
+        'task': 'judge.tasks.apply_verdict_events',
+        'schedule': 2.0
+    },
+    'rebuild_test_case_catalog': {
+        'task': 'judge.tasks.rebuild_test_case_catalog',
+        'schedule': 60.0
     }
 
 }
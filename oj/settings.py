@@ -124,6 +124,10 @@ AUTH_PASSWORD_VALIDATORS = [
 
 STATIC_URL = '/public/'
 TEST_CASE_DIR = os.path.join(TEST_CASE_PREFIX, "test_case")
+# 测试用例的内容寻址存储, 测试用例目录中的文件是这里的硬链接, 必须和 TEST_CASE_DIR 在同一个文件系统中
+TEST_CASE_BLOB_DIR = os.path.join(TEST_CASE_DIR, "_blobs")
+# 测试用例下载的zip缓存, 不放在 TEST_CASE_DIR 中
+TEST_CASE_ZIP_CACHE_DIR = os.path.join(DATA_DIR, "test_case_zip")
 LOG_PATH = os.path.join(DATA_DIR, "log")
 USER_MODEL_DIR = os.path.join(DATA_DIR, "model_file")
 
@@ -208,6 +212,28 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 IP_HEADER = "HTTP_X_REAL_IP"
 
+# 与判题机通信的超时时间(秒), 读取超时需要小于 CELERY_TASK_TIME_LIMIT
+JUDGE_SERVER_CONNECT_TIMEOUT = float(get_env("JUDGE_SERVER_CONNECT_TIMEOUT", "3"))
+JUDGE_SERVER_READ_TIMEOUT = float(get_env("JUDGE_SERVER_READ_TIMEOUT", "60"))
+# 连接失败时换其他判题机重试的次数
+JUDGE_SERVER_RETRY = int(get_env("JUDGE_SERVER_RETRY", "2"))
+# 请求体超过此字节数时gzip压缩, 0 表示不压缩, 需要判题机支持 Content-Encoding: gzip
+JUDGE_SERVER_GZIP_THRESHOLD = int(get_env("JUDGE_SERVER_GZIP_THRESHOLD", "0"))
+# 分配判题机的策略: least_loaded 负载最小; affinity 相同测试用例尽量分配给同一台判题机, 负载超过平均负载的
+# JUDGE_AFFINITY_LOAD_FACTOR 倍时顺延给其他判题机, 见 judge/scheduler.py
+JUDGE_SCHEDULER_POLICY = get_env("JUDGE_SCHEDULER_POLICY", "least_loaded")
+JUDGE_AFFINITY_LOAD_FACTOR = float(get_env("JUDGE_AFFINITY_LOAD_FACTOR", "1.25"))
+# 根据判题机的负载和判题耗时自动调整每台判题机同时判题的数量(judge/capacity.py), 关闭时为 cpu_core * 5
+JUDGE_CAPACITY_ADAPTIVE = get_env("JUDGE_CAPACITY_ADAPTIVE", "1") == "1"
+# 占用判题机位置的租约时间(秒), 需要大于一次判题的最长耗时(包括重试), 判题进程崩溃等没有释放的位置在过期后回收
+JUDGE_SLOT_LEASE_TIMEOUT = int(get_env("JUDGE_SLOT_LEASE_TIMEOUT", "300"))
+# 相同代码重复提交时直接使用缓存的判题结果, 默认关闭; 竞赛中是否使用单独配置
+VERDICT_CACHE_ENABLED = get_env("VERDICT_CACHE_ENABLED", "0") == "1"
+VERDICT_CACHE_CONTEST = get_env("VERDICT_CACHE_CONTEST", "0") == "1"
+VERDICT_CACHE_TIMEOUT = int(get_env("VERDICT_CACHE_TIMEOUT", str(24 * 3600)))
+# 批量重新判题每个worker进程的速率限制(celery rate_limit 格式)
+REJUDGE_RATE_LIMIT = get_env("REJUDGE_RATE_LIMIT", "60/m")
+
 BROKER_URL = f"amqp://{RABBIT_MQ_CONF['USER']}:{RABBIT_MQ_CONF['PASSWORD']}@{RABBIT_MQ_CONF['HOST']}:{RABBIT_MQ_CONF['PORT']}/"
 CELERY_RESULT_BACKEND = f"{REDIS_URL}/2"
 
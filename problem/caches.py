@@ -0,0 +1,37 @@
+from utils.cache import RowCache
+from utils.constants import CacheKey
+
+# 竞赛试题详情, key: 试题id
+contest_problem_cache = RowCache(
+    CacheKey.contest_problemOne,
+    fields=(
+        "id",
+        "_id",
+        "title",
+        "hint",
+        "samples",
+        "template",
+        "rule_type",
+        "time_limit",
+        "description",
+        "memory_limit",
+        "accepted_number",
+        "submission_number",
+        "input_description",
+        "output_description",
+    ),
+    timeout=900)
+
+# 竞赛的试题列表, key: 竞赛id
+contest_problem_list_cache = RowCache(
+    CacheKey.contest_problem_list,
+    fields=(
+        "id",
+        "_id",
+        "title",
+        "rule_type",
+        "difficulty",
+        "submission_number",
+        "accepted_number",
+    ),
+    timeout=300)
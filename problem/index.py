@@ -0,0 +1,251 @@
+import json
+import logging
+
+from redis.exceptions import LockError
+
+from utils.cache import CacheNamespace, cache
+from utils.constants import CacheKey
+from .models import Problem, ProblemBankType
+from .serializers import ProblemSerializer
+
+logger = logging.getLogger(__name__)
+
+# 索引中所有key的过期时间(秒), 每次重建都会换一个新的版本号, 旧版本的key等待过期
+INDEX_TTL = 24 * 3600
+# 重建索引的锁, 拿不到锁的请求直接查询数据库
+REBUILD_LOCK_TIMEOUT = 60
+
+
+class PublicProblemIndex(object):
+    """
+    公有题库(bank=1, visible=True)的试题索引, 保存在redis中, 所有key都带有版本号:
+    rows: 试题id -> 试题列表中的一行(ProblemSerializer, 附加 tag_ids)
+    counters: "<id>:submission" / "<id>:accepted" -> 提交数/通过数, 由判题统计更新
+    all: 所有试题id的集合
+    display: _id -> 试题id
+    tag:<tag_id> / difficulty:<难度> / gram:<字>: 倒排索引, 集合中为试题id
+    tagIds: 标签名 -> 标签id
+    标题按单字和相邻两个字建立索引, 关键字的所有二元组取交集后再校验是否包含关键字
+    """
+
+    def __init__(self):
+        self.namespace = CacheNamespace(CacheKey.problem_index)
+
+    @staticmethod
+    def _grams(title):
+        title = title.lower()
+        return set(title) | {title[i:i + 2] for i in range(len(title) - 1)}
+
+    @staticmethod
+    def _keyword_grams(keyword):
+        keyword = keyword.lower()
+        if len(keyword) == 1:
+            return {keyword}
+        return {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+
+    @staticmethod
+    def _row(problem):
+        row = dict(ProblemSerializer(problem).data)
+        row["tag_ids"] = [tag.id for tag in problem.tags.all()]
+        submission_number, accepted_number = row.pop("submission_number"), row.pop("accepted_number")
+        return row, submission_number, accepted_number
+
+    @staticmethod
+    def _public_problems():
+        return Problem.objects.filter(
+            bank=ProblemBankType.Pub, visible=True).only(
+            "id", "_id", "title", "difficulty", "submission_number", "accepted_number", "rule_type").prefetch_related(
+            "tags")
+
+    def _set_keys(self, base, difficulty, tag_ids, title):
+        """
+        试题所在的所有倒排索引集合
+        """
+        return [f"{base}:difficulty:{difficulty}"] + \
+               [f"{base}:tag:{tag_id}" for tag_id in tag_ids] + \
+               [f"{base}:gram:{gram}" for gram in self._grams(title)]
+
+    def _add(self, p, base, problem):
+        """
+        :return: 写入的所有key
+        """
+        row, submission_number, accepted_number = self._row(problem)
+        p.hset(f"{base}:rows", problem.id, json.dumps(row))
+        p.hset(f"{base}:counters", f"{problem.id}:submission", submission_number)
+        p.hset(f"{base}:counters", f"{problem.id}:accepted", accepted_number)
+        p.sadd(f"{base}:all", problem.id)
+        p.hset(f"{base}:display", problem._id, problem.id)
+        for tag in problem.tags.all():
+            p.hset(f"{base}:tagIds", tag.name, tag.id)
+        set_keys = self._set_keys(base, problem.difficulty, row["tag_ids"], problem.title)
+        for key in set_keys:
+            p.sadd(key, problem.id)
+        return set_keys + [f"{base}:{name}" for name in ("rows", "counters", "all", "display", "tagIds")]
+
+    def _remove(self, p, base, problem_id, row):
+        p.hdel(f"{base}:rows", problem_id)
+        p.hdel(f"{base}:counters", f"{problem_id}:submission", f"{problem_id}:accepted")
+        p.srem(f"{base}:all", problem_id)
+        p.hdel(f"{base}:display", row["_id"])
+        for key in self._set_keys(base, row["difficulty"], row["tag_ids"], row["title"]):
+            p.srem(key, problem_id)
+
+    @staticmethod
+    def _client():
+        return cache.get_client(write=True)
+
+    def _built(self, base):
+        return self._client().exists(f"{base}:built")
+
+    def rebuild(self):
+        """
+        在新的版本号下从数据库重建整个索引, 完成前读取索引的请求直接查询数据库
+        """
+        return self._build(invalidate=True)
+
+    def _build(self, invalidate):
+        """
+        先拿到固定key上的锁再换版本号, 同一时间只有一个进程在重建
+        :param invalidate: 是否换一个新的版本号, 否则在当前版本号下建立
+        """
+        lock = cache.lock(CacheKey.problem_index_lock, timeout=REBUILD_LOCK_TIMEOUT, blocking_timeout=0)
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            if invalidate:
+                self.namespace.invalidate()
+            base = self.namespace.key()
+            # 等锁期间其他进程已经建好了当前版本
+            if not invalidate and self._built(base):
+                return base
+            p = self._client().pipeline(transaction=False)
+            keys = {f"{base}:built"}
+            for problem in self._public_problems():
+                keys.update(self._add(p, base, problem))
+            p.set(f"{base}:built", 1)
+            for key in keys:
+                p.expire(key, INDEX_TTL)
+            p.execute()
+            return base
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.warning("problem index lock expired before release")
+
+    def _ensure_built(self):
+        """
+        :return: 当前版本的key前缀, 索引不可用(正在重建)时返回None
+        """
+        base = self.namespace.key()
+        if self._built(base):
+            return base
+        if self._client().exists(CacheKey.problem_index_lock):
+            return None
+        return self._build(invalidate=False)
+
+    def update(self, problem_id):
+        """
+        试题修改/公开/隐藏后调用, 索引还没有建立时不需要处理
+        """
+        base = self.namespace.key()
+        if not self._built(base):
+            return
+        old_row = cache.hget(f"{base}:rows", problem_id)
+        problem = self._public_problems().filter(pk=problem_id).first()
+        p = cache.pipeline()
+        if old_row:
+            self._remove(p, base, problem_id, json.loads(old_row.decode("utf-8")))
+        if problem:
+            for key in self._add(p, base, problem):
+                p.expire(key, INDEX_TTL)
+        p.execute()
+
+    def remove(self, problem_ids):
+        base = self.namespace.key()
+        if not self._built(base):
+            return
+        rows = cache.hmget(f"{base}:rows", problem_ids)
+        p = cache.pipeline()
+        for problem_id, row in zip(problem_ids, rows):
+            if row:
+                self._remove(p, base, problem_id, json.loads(row.decode("utf-8")))
+        p.execute()
+
+    def invalidate(self):
+        """
+        标签改名/删除, 批量修改难度等影响大量试题的操作后调用, 下次查询时重建
+        """
+        self.namespace.invalidate()
+
+    def set_counters(self, counters):
+        """
+        :param counters: {problem_id: (submission_number, accepted_number)}
+        """
+        base = self.namespace.key()
+        if not counters or not self._built(base):
+            return
+        indexed = cache.hmget(f"{base}:rows", list(counters.keys()))
+        p = cache.pipeline()
+        for (problem_id, (submission_number, accepted_number)), row in zip(counters.items(), indexed):
+            if row:
+                p.hset(f"{base}:counters", f"{problem_id}:submission", submission_number)
+                p.hset(f"{base}:counters", f"{problem_id}:accepted", accepted_number)
+        p.execute()
+
+    def query(self, tag=None, keyword=None, difficulty=None):
+        """
+        :return: 按 _id 倒序排列的试题列表, 格式与 ProblemSerializer 相同; 索引不可用时返回None
+        """
+        base = self._ensure_built()
+        if base is None:
+            return None
+
+        sets, candidates = [], None
+        if tag:
+            tag_id = cache.hget(f"{base}:tagIds", tag)
+            if tag_id is None:
+                return []
+            sets.append(f"{base}:tag:{tag_id.decode('utf-8')}")
+        if difficulty:
+            sets.append(f"{base}:difficulty:{difficulty}")
+        if keyword:
+            if keyword.isdigit():
+                problem_id = cache.hget(f"{base}:display", keyword)
+                if problem_id is None:
+                    return []
+                candidates = {int(problem_id)}
+            else:
+                sets.extend(f"{base}:gram:{gram}" for gram in self._keyword_grams(keyword))
+
+        if sets:
+            ids = {int(problem_id) for problem_id in cache.sinter(sets)}
+            candidates = ids if candidates is None else candidates & ids
+        if candidates is None:
+            candidates = {int(problem_id) for problem_id in cache.smembers(f"{base}:all")}
+        if not candidates:
+            return []
+
+        candidates = list(candidates)
+        rows = cache.hmget(f"{base}:rows", candidates)
+        counter_fields = []
+        for problem_id in candidates:
+            counter_fields.extend((f"{problem_id}:submission", f"{problem_id}:accepted"))
+        counters = cache.hmget(f"{base}:counters", counter_fields)
+
+        result = []
+        for i, row in enumerate(rows):
+            if not row:
+                continue
+            row = json.loads(row.decode("utf-8"))
+            if keyword and not keyword.isdigit() and keyword.lower() not in row["title"].lower():
+                continue
+            row.pop("tag_ids")
+            row["submission_number"] = int(counters[2 * i] or 0)
+            row["accepted_number"] = int(counters[2 * i + 1] or 0)
+            result.append(row)
+        result.sort(key=lambda item: item["_id"], reverse=True)
+        return result
+
+
+problem_index = PublicProblemIndex()
@@ -0,0 +1,40 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from problem.test_case_store import test_case_store
+
+
+class Command(BaseCommand):
+    help = "把已有的测试用例目录存入 test_case_store, 相同内容的文件只保留一份, 并重建判题机同步用的目录, 如: python manage.py intern_test_cases"
+
+    def handle(self, *args, **options):
+        count, before, after = 0, 0, 0
+        blob_dir_name = os.path.basename(settings.TEST_CASE_BLOB_DIR)
+        for test_case_id in sorted(os.listdir(settings.TEST_CASE_DIR)):
+            test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+            if test_case_id == blob_dir_name or not os.path.isdir(test_case_dir):
+                continue
+            if test_case_store.manifest(test_case_id) is not None:
+                continue
+            for name in os.listdir(test_case_dir):
+                stat = os.stat(os.path.join(test_case_dir, name))
+                # 只统计之前没有硬链接的文件
+                if stat.st_nlink == 1:
+                    before += stat.st_size
+            test_case_store.intern(test_case_id)
+            count += 1
+
+        for dir_path, _, file_names in os.walk(settings.TEST_CASE_BLOB_DIR):
+            after += sum(os.path.getsize(os.path.join(dir_path, name)) for name in file_names)
+        self.stdout.write(self.style.SUCCESS(
+            f"interned {count} test cases, {before / 1024 / 1024:.1f}MB of files, "
+            f"blob store is {after / 1024 / 1024:.1f}MB"))
+
+        # 判题机同步客户端使用的目录
+        version = test_case_store.rebuild_catalog()
+        if version is None:
+            self.stdout.write(self.style.WARNING("test case catalog is being rebuilt by another process"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"test case catalog rebuilt, version {version}"))
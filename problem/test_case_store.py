@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+from .models import Problem, ContestProblem
+
+# 计算文件sha256时每次读取的字节数
+HASH_CHUNK_SIZE = 1024 * 1024
+# 重建目录时每次写入redis的测试用例数
+CATALOG_CHUNK_SIZE = 1000
+
+# 修改目录中的一组测试用例, 正在重建目录(持有重建的锁)时记下修改过的 test_case_id, 重建时不再覆盖
+# KEYS: 目录, 版本, 重建期间修改过的 test_case_id, 重建的锁; ARGV: test_case_id, 摘要(删除时为空)
+_CATALOG_UPDATE_SCRIPT = """
+if ARGV[2] ~= "" then
+    redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+else
+    redis.call("HDEL", KEYS[1], ARGV[1])
+end
+if redis.call("EXISTS", KEYS[4]) == 1 then
+    redis.call("SADD", KEYS[3], ARGV[1])
+end
+return redis.call("INCR", KEYS[2])
+"""
+
+# 把扫描的结果合并到目录中, 跳过扫描开始后修改过的 test_case_id
+# KEYS: 目录, 重建期间修改过的 test_case_id; ARGV: test_case_id, 摘要(删除时为空), ...
+_CATALOG_MERGE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    if redis.call("SISMEMBER", KEYS[2], ARGV[i]) == 0 then
+        if ARGV[i + 1] ~= "" then
+            redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+        else
+            redis.call("HDEL", KEYS[1], ARGV[i])
+        end
+    end
+end
+return 0
+"""
+
+
+class TestCaseStore(object):
+    """
+    内容寻址的测试用例存储: 文件内容只保存一份, 路径为 TEST_CASE_BLOB_DIR/<sha256前两位>/<sha256>,
+    测试用例目录 TEST_CASE_DIR/<test_case_id> 中的文件都是blob的硬链接, 另有 manifest 记录 {文件名: sha256},
+    判题服务器读取的目录结构不变; 复制试题只创建硬链接, rsync -H 同步时相同内容的文件只传输一次
+
+    redis中另有一份目录 <key>: {test_case_id: manifest的摘要}, 每次变化时 <key>:version 加一,
+    判题机上的同步客户端据此只下载新增或变化的测试用例和本地没有的blob
+    """
+    manifest_name = "manifest"
+
+    def __init__(self):
+        self._update_script = None
+        self._merge_script = None
+
+    def _scripts(self):
+        if self._update_script is None:
+            self._update_script = cache.register_script(_CATALOG_UPDATE_SCRIPT)
+            self._merge_script = cache.register_script(_CATALOG_MERGE_SCRIPT)
+        return self._update_script, self._merge_script
+
+    @staticmethod
+    def _catalog_keys():
+        key = CacheKey.test_case_catalog
+        return key, f"{key}:version", f"{key}:updated", f"{key}:lock"
+
+    @staticmethod
+    def _dir(test_case_id):
+        return os.path.join(settings.TEST_CASE_DIR, test_case_id)
+
+    @staticmethod
+    def _blob_path(sha256):
+        return os.path.join(settings.TEST_CASE_BLOB_DIR, sha256[:2], sha256)
+
+    @staticmethod
+    def file_sha256(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _link(self, path, sha256):
+        """
+        path 的内容保存为blob, 已经有相同内容的blob时 path 换成它的硬链接
+        """
+        blob = self._blob_path(sha256)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        while True:
+            try:
+                os.link(path, blob)
+                return
+            except FileExistsError:
+                pass
+            try:
+                if not os.path.samefile(path, blob):
+                    # 先链接到临时文件再改名, 替换过程中 path 一直可读
+                    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                    os.link(blob, tmp_path)
+                    os.replace(tmp_path, path)
+                return
+            except FileNotFoundError:
+                # blob 刚好被回收, 重新保存
+                continue
+
+    def manifest(self, test_case_id):
+        """
+        :return: {文件名: sha256}, 还没有存入blob的测试用例为None
+        """
+        try:
+            with open(os.path.join(self._dir(test_case_id), self.manifest_name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def digest(manifest):
+        return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def blob_path(self, sha256):
+        """
+        :return: blob的路径, 不存在时为None
+        """
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            return None
+        path = self._blob_path(sha256)
+        return path if os.path.isfile(path) else None
+
+    def _catalog_update(self, test_case_id, digest=None):
+        update_script, _ = self._scripts()
+        update_script(keys=self._catalog_keys(), args=[test_case_id, digest or ""])
+
+    @staticmethod
+    def catalog_built():
+        return bool(cache.exists(f"{CacheKey.test_case_catalog}:built"))
+
+    def rebuild_catalog(self):
+        """
+        扫描 TEST_CASE_DIR 重建目录, 以前的测试用例没有 manifest 的先存入blob,
+        耗时较长, 由 judge.tasks.rebuild_test_case_catalog 或 intern_test_cases 命令调用;
+        扫描期间上传/删除测试用例对目录的修改不会被扫描的结果覆盖
+        :return: 目录的版本, 其他进程正在重建时为None
+        """
+        catalog_key, version_key, updated_key, lock_key = self._catalog_keys()
+        lock = cache.lock(lock_key, timeout=600, blocking_timeout=0)
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            # 拿到锁之后的修改都会记下, 在此之前的修改已经写入了目录和测试用例目录, 扫描时能看到
+            cache.delete(updated_key)
+            catalog = {}
+            for test_case_id in sorted(os.listdir(settings.TEST_CASE_DIR)):
+                test_case_dir = self._dir(test_case_id)
+                if test_case_dir == settings.TEST_CASE_BLOB_DIR or not os.path.isdir(test_case_dir):
+                    continue
+                manifest = self.manifest(test_case_id)
+                if manifest is None:
+                    try:
+                        manifest = self.intern(test_case_id)
+                    except FileNotFoundError:
+                        # 扫描期间被删除
+                        continue
+                catalog[test_case_id] = self.digest(manifest)
+            # 目录中有, 但已经不存在的测试用例
+            for test_case_id in cache.hkeys(catalog_key):
+                catalog.setdefault(test_case_id.decode("utf-8"), "")
+
+            _, merge_script = self._scripts()
+            items = list(catalog.items())
+            for i in range(0, len(items), CATALOG_CHUNK_SIZE):
+                merge_script(keys=[catalog_key, updated_key],
+                             args=[value for item in items[i:i + CATALOG_CHUNK_SIZE] for value in item])
+            p = cache.pipeline()
+            p.delete(updated_key)
+            p.set(f"{catalog_key}:built", 1)
+            p.incr(version_key)
+            return p.execute()[-1]
+        finally:
+            lock.release()
+
+    def catalog(self, version=None):
+        """
+        :param version: 客户端上次拿到的版本, 没有变化时不返回目录
+        :return: (版本, {test_case_id: 摘要}), 没有变化时目录为None, 还没有建立(等待定时任务重建)时为 (None, None)
+        """
+        p = cache.pipeline(transaction=False)
+        p.exists(f"{CacheKey.test_case_catalog}:built")
+        p.get(f"{CacheKey.test_case_catalog}:version")
+        built, current = p.execute()
+        if not built:
+            return None, None
+        current = int(current or 0)
+        if version is not None and str(version) == str(current):
+            return current, None
+        catalog = cache.hgetall(CacheKey.test_case_catalog)
+        return current, {k.decode("utf-8"): v.decode("utf-8") for k, v in catalog.items()}
+
+    def intern(self, test_case_id, hashes=None):
+        """
+        写完测试用例目录后调用, 目录中的文件换成blob的硬链接并写入 manifest
+        :param hashes: 写文件时已经算好的 {文件名: sha256}, 没有的重新计算
+        """
+        test_case_dir = self._dir(test_case_id)
+        hashes = hashes or {}
+        manifest = {}
+        for name in sorted(os.listdir(test_case_dir)):
+            path = os.path.join(test_case_dir, name)
+            # 以前下载测试用例时生成在测试用例目录中的zip不存入blob
+            if name == self.manifest_name or name.endswith((".zip", ".tmp")) or not os.path.isfile(path):
+                continue
+            sha256 = hashes.get(name) or self.file_sha256(path)
+            self._link(path, sha256)
+            manifest[name] = sha256
+
+        manifest_path = os.path.join(test_case_dir, self.manifest_name)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(manifest, indent=4))
+        os.chmod(manifest_path, 0o640)
+        self._catalog_update(test_case_id, self.digest(manifest))
+        return manifest
+
+    def copy(self, test_case_id):
+        """
+        复制试题时使用, 新目录中只有硬链接, 不复制文件内容
+        :return: 新的 test_case_id, 原目录不存在时返回原来的 test_case_id
+        """
+        src_dir = self._dir(test_case_id)
+        if not test_case_id or not os.path.isdir(src_dir):
+            return test_case_id
+        manifest = self.manifest(test_case_id)
+        if manifest is None:
+            manifest = self.intern(test_case_id)
+
+        new_test_case_id = rand_str()
+        dst_dir = self._dir(new_test_case_id)
+        os.mkdir(dst_dir)
+        os.chmod(dst_dir, os.stat(src_dir).st_mode & 0o777)
+        for name in manifest:
+            os.link(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+        shutil.copy2(os.path.join(src_dir, self.manifest_name), os.path.join(dst_dir, self.manifest_name))
+        self._catalog_update(new_test_case_id, self.digest(manifest))
+        return new_test_case_id
+
+    def remove(self, test_case_id):
+        """
+        删除测试用例目录, 没有其他目录引用的blob一并删除
+        """
+        if not test_case_id:
+            return
+        manifest = self.manifest(test_case_id) or {}
+        shutil.rmtree(self._dir(test_case_id), ignore_errors=True)
+        self._catalog_update(test_case_id)
+        for sha256 in set(manifest.values()):
+            blob = self._blob_path(sha256)
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+            except FileNotFoundError:
+                pass
+
+    def release(self, test_case_id):
+        """
+        试题修改测试用例或被删除时调用(在更新/删除数据库记录之前), 以前复制试题时多道题共用同一个 test_case_id,
+        还有其他试题引用时不删除
+        """
+        if not test_case_id:
+            return
+        references = Problem.objects.filter(test_case_id=test_case_id).count() + \
+            ContestProblem.objects.filter(test_case_id=test_case_id).count()
+        if references <= 1:
+            self.remove(test_case_id)
+
+
+test_case_store = TestCaseStore()
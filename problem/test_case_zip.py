@@ -0,0 +1,70 @@
+import glob
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+
+from utils.zipstream import zip_stream
+
+
+class TestCaseZipCache(object):
+    """
+    测试用例下载的zip缓存, 保存在 TEST_CASE_ZIP_CACHE_DIR 中, 不再写入测试用例目录,
+    文件名为 <test_case_id>-<指纹>.zip, 指纹由打包的文件名/大小/修改时间计算, 文件有变化时自然不会命中;
+    没有缓存时边生成边返回, 同时写入缓存, 修改或删除测试用例时删除 test_case_id 的所有缓存
+    """
+
+    @staticmethod
+    def _directory():
+        os.makedirs(settings.TEST_CASE_ZIP_CACHE_DIR, exist_ok=True)
+        return settings.TEST_CASE_ZIP_CACHE_DIR
+
+    @staticmethod
+    def fingerprint(files):
+        digest = hashlib.sha256()
+        for path, arcname in files:
+            stat = os.stat(path)
+            digest.update(f"{arcname}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, test_case_id, files):
+        return os.path.join(self._directory(), f"{test_case_id}-{self.fingerprint(files)}.zip")
+
+    @staticmethod
+    def _tee(chunks, path):
+        # 并发下载同一组测试用例时各自写临时文件, 完整写完后再原子地改名
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        finally:
+            # 客户端中途断开时生成器被关闭, 删除不完整的文件
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def open(self, test_case_id, files):
+        """
+        :param files: [(文件路径, 压缩包中的文件名)]
+        :return: (zip内容的可迭代对象, 大小), 没有缓存时大小为None
+        """
+        path = self.path(test_case_id, files)
+        try:
+            return open(path, "rb"), os.path.getsize(path)
+        except FileNotFoundError:
+            return self._tee(zip_stream(files), path), None
+
+    def invalidate(self, test_case_id):
+        if not test_case_id:
+            return
+        for path in glob.glob(os.path.join(settings.TEST_CASE_ZIP_CACHE_DIR, f"{test_case_id}-*.zip")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+test_case_zip_cache = TestCaseZipCache()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import fakeredis
+from django.test import override_settings
+from django.test.testcases import TestCase
+
+from account.models import User
+from problem.index import problem_index
+from problem.models import Problem, ProblemBankType, ProblemDifficulty, ProblemTag
+from problem.test_case_store import TestCaseStore
+from utils.cache import cache
+from utils.constants import CacheKey
+
+
+class ProblemIndexTest(TestCase):
+
+    def setUp(self):
+        problem_index.invalidate()
+        self.user = User.objects.create(username="maxin", email="maxin")
+        self.tag = ProblemTag.objects.create(name="动态规划")
+        self.create_problem(1001, "两数之和", ProblemDifficulty.Low, tags=[self.tag])
+        self.create_problem(1002, "两数相乘", ProblemDifficulty.Low)
+        self.create_problem(1003, "数之和的最大值", ProblemDifficulty.High, tags=[self.tag])
+        # 包含关键字的所有二元组, 但不包含关键字本身
+        self.create_problem(1004, "两数x数之和", ProblemDifficulty.Mid)
+        self.create_problem(1005, "两数之和(隐藏)", ProblemDifficulty.Low, visible=False)
+        self.create_problem(1006, "两数之和(私有)", ProblemDifficulty.Low, bank=ProblemBankType.Pri)
+
+    def tearDown(self):
+        problem_index.invalidate()
+
+    def create_problem(self, _id, title, difficulty, tags=(), visible=True, bank=ProblemBankType.Pub):
+        problem = Problem.objects.create(_id=_id, title=title, difficulty=difficulty, visible=visible, bank=bank,
+                                         description="", input_description="", output_description="", samples=[],
+                                         test_case_score=[], languages=["C"], time_limit=1000, memory_limit=256,
+                                         source=self.user)
+        problem.tags.set(tags)
+        return problem
+
+    def query_ids(self, **kwargs):
+        return [row["_id"] for row in problem_index.query(**kwargs)]
+
+    def test_query_all(self):
+        self.assertEqual(self.query_ids(), [1004, 1003, 1002, 1001])
+
+    def test_query_tag_and_difficulty(self):
+        self.assertEqual(self.query_ids(tag="动态规划"), [1003, 1001])
+        self.assertEqual(self.query_ids(difficulty=ProblemDifficulty.Low), [1002, 1001])
+        self.assertEqual(self.query_ids(tag="动态规划", difficulty=ProblemDifficulty.Low), [1001])
+        self.assertEqual(self.query_ids(tag="不存在"), [])
+
+    def test_query_keyword(self):
+        self.assertEqual(self.query_ids(keyword="两数之和"), [1001])
+        self.assertEqual(self.query_ids(keyword="之和"), [1004, 1003, 1001])
+        self.assertEqual(self.query_ids(keyword="和"), [1004, 1003, 1001])
+        self.assertEqual(self.query_ids(keyword="之和", tag="动态规划", difficulty=ProblemDifficulty.High), [1003])
+        self.assertEqual(self.query_ids(keyword="三数之和"), [])
+
+    def test_query_display_id(self):
+        self.assertEqual(self.query_ids(keyword="1002"), [1002])
+        self.assertEqual(self.query_ids(keyword="1002", difficulty=ProblemDifficulty.High), [])
+        self.assertEqual(self.query_ids(keyword="1005"), [])
+
+    def test_query_while_rebuilding(self):
+        lock = cache.lock(CacheKey.problem_index_lock, timeout=60)
+        lock.acquire()
+        try:
+            # 索引还没有建立, 查询数据库
+            self.assertIsNone(problem_index.query())
+            generation = problem_index.namespace.key()
+            self.assertIsNone(problem_index.rebuild())
+            self.assertEqual(problem_index.namespace.key(), generation)
+        finally:
+            lock.release()
+        self.assertEqual(self.query_ids(keyword="1001"), [1001])
+        self.assertEqual(problem_index.namespace.key(), generation)
+
+
+class TestCaseCatalogTest(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(TEST_CASE_DIR=root, TEST_CASE_BLOB_DIR=os.path.join(root, "_blobs"))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch("problem.test_case_store.cache", fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = TestCaseStore()
+        for test_case_id in ("aa", "bb"):
+            self.write(test_case_id)
+
+    def write(self, test_case_id):
+        os.mkdir(self.store._dir(test_case_id))
+        with open(os.path.join(self.store._dir(test_case_id), "1.in"), "w") as f:
+            f.write(test_case_id)
+
+    def test_update_during_rebuild(self):
+        self.assertEqual(self.store.catalog(), (None, None))
+        manifest = self.store.manifest
+
+        def update_during_scan(test_case_id):
+            # 扫描到最后一组时, 上传了新的测试用例, 已经扫描过的一组被删除
+            if test_case_id == "bb" and not os.path.isdir(self.store._dir("cc")):
+                self.write("cc")
+                self.store.intern("cc")
+                self.store.remove("aa")
+            return manifest(test_case_id)
+
+        with mock.patch.object(self.store, "manifest", side_effect=update_during_scan):
+            version = self.store.rebuild_catalog()
+        self.assertEqual(self.store.catalog(), (version, {
+            "bb": self.store.digest(self.store.manifest("bb")),
+            "cc": self.store.digest(self.store.manifest("cc"))}))
+
+        self.store.remove("bb")
+        self.assertEqual(list(self.store.catalog()[1].keys()), ["cc"])
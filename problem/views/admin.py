@@ -1,9 +1,9 @@
 import hashlib
 import json
 import os
-import shutil
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from wsgiref.util import FileWrapper
 
 from django.conf import settings
@@ -16,13 +16,18 @@ from contest.models import Contest, ContestStatus
 from fps.parser import FPSHelper, FPSParser
 from judge.dispatcher import SPJCompiler
 from judge.languages import language_names
+from judge.verdict_cache import verdict_cache
 from problem.models import Problem, ProblemRuleType, ProblemDifficulty, ProblemTag, ContestProblem, ProblemBankType, \
     ContestProblemBasketModel
 from submission.models import Submission
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
-from utils.cache import cache, _redis
+from utils.cache import cache, problem_list_namespace
 from utils.constants import Difficulty, CacheKey
 from utils.shortcuts import rand_str, natural_sort_key
+from ..caches import contest_problem_cache, contest_problem_list_cache
+from ..index import problem_index
+from ..test_case_store import test_case_store
+from ..test_case_zip import test_case_zip_cache
 from ..serializers import (
     AdminProblemListSerializer,
     CreateProblemSerializer,
@@ -37,8 +42,52 @@ from ..serializers import (
     FPSProblemSerializer)
 from ..utils import build_problem_template
 
+# 解压测试用例时每次读取的字节数
+TEST_CASE_CHUNK_SIZE = 1024 * 1024
+# 并行解压测试用例的线程数
+TEST_CASE_WORKERS = min(8, os.cpu_count() or 1)
+
 
 class TestCaseZipProcessor(object):
+    @staticmethod
+    def _extract(zip_file, name, path, need_md5):
+        """
+        分块解压一个测试用例文件, 换行符 CRLF 替换为 LF 后写入 path, 同时计算大小, 去掉末尾空白后的md5
+        和存入 test_case_store 用的sha256, 内存占用与文件大小无关
+        :return: (大小, md5, sha256), 不需要md5时md5为None
+        """
+        size, md5, pending, whitespace = 0, hashlib.md5() if need_md5 else None, b"", b""
+        sha256 = hashlib.sha256()
+        with zip_file.open(name) as src, open(path, "wb") as dst:
+            while True:
+                chunk = src.read(TEST_CASE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                # \r\n 可能被分在相邻的两块中
+                chunk = pending + chunk
+                if chunk.endswith(b"\r"):
+                    chunk, pending = chunk[:-1], b"\r"
+                else:
+                    pending = b""
+                chunk = chunk.replace(b"\r\n", b"\n")
+                dst.write(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+                if md5:
+                    # 末尾的空白先不计入md5, 后面还有非空白内容时再补上
+                    stripped = chunk.rstrip()
+                    if stripped:
+                        md5.update(whitespace)
+                        md5.update(stripped)
+                        whitespace = chunk[len(stripped):]
+                    else:
+                        whitespace += chunk
+            if pending:
+                dst.write(pending)
+                sha256.update(pending)
+                size += len(pending)
+        return size, md5.hexdigest() if md5 else None, sha256.hexdigest()
+
     def process_zip(self, uploaded_zip_file, spj, dir=""):
         try:
             zip_file = zipfile.ZipFile(uploaded_zip_file, "r")
@@ -56,14 +105,20 @@ class TestCaseZipProcessor(object):
 
         size_cache = {}
         md5_cache = {}
-
-        for item in test_case_list:
-            with open(os.path.join(test_case_dir, item), "wb") as f:
-                content = zip_file.read(f"{dir}{item}").replace(b"\r\n", b"\n")
-                size_cache[item] = len(content)
-                if item.endswith(".out"):
-                    md5_cache[item] = hashlib.md5(content.rstrip()).hexdigest()
-                f.write(content)
+        sha256_cache = {}
+
+        # 解压, zlib, md5 和写文件都会释放GIL, 多个文件并行处理
+        with ThreadPoolExecutor(max_workers=TEST_CASE_WORKERS) as pool:
+            results = pool.map(
+                lambda item: self._extract(
+                    zip_file, f"{dir}{item}", os.path.join(test_case_dir, item), item.endswith(".out")),
+                test_case_list)
+            for item, (size, md5, sha256) in zip(test_case_list, results):
+                size_cache[item] = size
+                sha256_cache[item] = sha256
+                if md5:
+                    md5_cache[item] = md5
+        zip_file.close()
         test_case_info = {"spj": spj, "test_cases": {}}
 
         info = []
@@ -90,12 +145,14 @@ class TestCaseZipProcessor(object):
 
         for item in os.listdir(test_case_dir):
             os.chmod(os.path.join(test_case_dir, item), 0o640)
+        test_case_store.intern(test_case_id, sha256_cache)
 
         return info, test_case_id
 
     def filter_name_list(self, name_list, spj, dir=""):
         ret = []
         prefix = 1
+        name_list = set(name_list)
         if spj:
             while True:
                 in_name = f"{prefix}.in"
@@ -139,21 +196,16 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
             os.listdir(test_case_dir), problem.spj)
 
         name_list.append("info")
-        file_name = os.path.join(test_case_dir, problem.test_case_id + ".zip")
-
-        with zipfile.ZipFile(file_name, "w") as file:
-            for test_case in name_list:
-                file.write(f"{test_case_dir}/{test_case}", test_case)
+        files = [(os.path.join(test_case_dir, name), name) for name in name_list]
+        content, size = test_case_zip_cache.open(problem.test_case_id, files)
 
         response = StreamingHttpResponse(
-            FileWrapper(
-                open(
-                    file_name,
-                    "rb")),
+            FileWrapper(content) if size is not None else content,
             content_type="application/octet-stream")
 
         response["Content-Disposition"] = f"attachment; filename=problem_{problem.id}_test_cases.zip"
-        response["Content-Length"] = os.path.getsize(file_name)
+        if size is not None:
+            response["Content-Length"] = size
         return response
 
     def post(self, request):
@@ -163,12 +215,10 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
             file = form.cleaned_data["file"]
         else:
             return self.error("上传失败")
-        zip_file = f"/tmp/{rand_str()}.zip"
-        with open(zip_file, "wb") as f:
-            for chunk in file:
-                f.write(chunk)
-        info, test_case_id = self.process_zip(zip_file, spj=spj)
-        os.remove(zip_file)
+        # 较大的上传文件django已经保存在临时文件中, 直接读取, 不再复制一份
+        if hasattr(file, "temporary_file_path"):
+            file = file.temporary_file_path()
+        info, test_case_id = self.process_zip(file, spj=spj)
         return self.success({"id": test_case_id, "info": info, "spj": spj})
 
 
@@ -247,11 +297,12 @@ class ProblemAPI(APIView):
         }
         with open(os.path.join(base_dir, "info"), "w", encoding="utf-8") as f:
             f.write(json.dumps(info, indent=4))
+        test_case_store.intern(case_id)
 
         if old_test_case_id:
-            old_test_case = os.path.join(settings.TEST_CASE_DIR, old_test_case_id)
-            if old_test_case:
-                shutil.rmtree(old_test_case, ignore_errors=True)
+            verdict_cache.invalidate(old_test_case_id)
+            test_case_zip_cache.invalidate(old_test_case_id)
+            test_case_store.release(old_test_case_id)
 
         return test_case_score
 
@@ -370,8 +421,8 @@ class ProblemAPI(APIView):
                 pk=problem_id).update(
                 visible=visible)
 
-            list_cache_prefix = _redis.keys(f"{CacheKey.problems}:*")
-            [cache.delete(key.decode()) for key in list_cache_prefix]
+            problem_list_namespace.invalidate()
+            problem_index.update(problem_id)
             cache.delete(CacheKey.public_pro_count)
             return self.success(r)
 
@@ -384,7 +435,7 @@ class ProblemAPI(APIView):
         test_cases = data.get("test_cases")
         score = data.pop("score", 10)
 
-        res = self._create_tase_case(test_case_id, test_cases, score, data.get("test_case_id", ""))
+        res = self._create_tase_case(test_case_id, test_cases, score, problem.test_case_id)
         if not res:
             return self.error(msg="测试用例格式错误")
 
@@ -403,6 +454,8 @@ class ProblemAPI(APIView):
             tag, _ = ProblemTag.objects.get_or_create(name=tag)
             problem.tags.add(tag)
 
+        problem_list_namespace.invalidate()
+        problem_index.update(problem_id)
         return self.success()
 
     def delete(self, request):
@@ -416,11 +469,11 @@ class ProblemAPI(APIView):
             return self.error("试题不存在")
         p = p[0].get("test_case_id")
 
-        test_case_dir = os.path.join(settings.TEST_CASE_DIR, p)
-        if test_case_dir:
-            shutil.rmtree(test_case_dir, ignore_errors=True)
+        test_case_store.release(p)
+        test_case_zip_cache.invalidate(p)
 
         _ = Problem.objects.filter(pk=pro_id).delete()
+        problem_index.remove([pro_id])
 
         return self.success()
 
@@ -436,9 +489,8 @@ class BulkDeleteProblemAPI(APIView):
             return pro_id
         p = p[0].get("test_case_id")
 
-        test_case_dir = os.path.join(settings.TEST_CASE_DIR, p)
-        if test_case_dir:
-            shutil.rmtree(test_case_dir, ignore_errors=True)
+        test_case_store.release(p)
+        test_case_zip_cache.invalidate(p)
 
     def post(self, request):
         list_pro_id = request.data.get("delete_pro_ids")
@@ -453,6 +505,7 @@ class BulkDeleteProblemAPI(APIView):
                 delete_problems.append(pro_id)
 
         Problem.objects.filter(pk__in=delete_problems).delete()
+        problem_index.remove(delete_problems)
         if flag:
             return self.error(msg=duplicate)
         return self.success()
@@ -513,6 +566,8 @@ class AddContestProblemAPI(APIView):
             pro['accepted_number'] = 0
             pro['statistic_info'] = {}
             pro['bank'] = ProblemBankType.Con
+            # 竞赛试题使用自己的测试用例目录(硬链接), 修改或删除时不影响原题
+            pro['test_case_id'] = test_case_store.copy(pro['test_case_id'])
             cp = ContestProblem(**pro)
 
             p_list.append(cp)
@@ -529,9 +584,11 @@ class AddContestProblemAPI(APIView):
                 contest.save(update_fields=('p_number', "has_problem_list",))
                 Problem.objects.filter(id__in=data['pro_id_list']).update(call_count=F("call_count") + 1)
         except IntegrityError as e:
+            for cp in p_list:
+                test_case_store.release(cp.test_case_id)
             return self.error("试题重复,请核实后再提交" + str(e))
 
-        cache.delete(f"{CacheKey.contest_problem_list}:{con_id}")
+        contest_problem_list_cache.invalidate(con_id)
 
         return self.success(res)
 
@@ -633,6 +690,7 @@ class FPSProblemImport(CSRFExemptAPIView):
                 os.mkdir(test_case_dir)
 
                 helper.save_test_case(_problem, test_case_dir)
+                test_case_store.intern(test_case_id)
                 problem_data = helper.save_image(
                     _problem, settings.UPLOAD_DIR, settings.UPLOAD_PREFIX)
 
@@ -679,6 +737,7 @@ class CollectionProblem(APIView):
         pro['accepted_number'] = 0
         pro['statistic_info'] = {}
         pro['old_pro_id'] = pro_id
+        pro['test_case_id'] = test_case_store.copy(pro['test_case_id'])
         cp = Problem(**pro)
         p_list = (cp,)
 
@@ -686,6 +745,7 @@ class CollectionProblem(APIView):
             with transaction.atomic():
                 Problem.objects.bulk_create(p_list)
         except IntegrityError as e:
+            test_case_store.release(cp.test_case_id)
             return self.error("试题重复,请核实后再提交" + str(e))
 
         # add user collection
@@ -705,7 +765,10 @@ class CollectionProblem(APIView):
 
     def delete(self, request):
         pro_id = request.GET.get("problem_id")
-        _ = Problem.objects.filter(old_pro_id=pro_id).delete()
+        collections = Problem.objects.filter(old_pro_id=pro_id)
+        for test_case_id in collections.values_list("test_case_id", flat=True):
+            test_case_store.release(test_case_id)
+        _ = collections.delete()
 
         uid = request.session.get("_auth_user_id")
         collect_problem = UserProfile.objects.filter(
@@ -762,11 +825,12 @@ class ContestProblemAPI(APIView):
         }
         with open(os.path.join(base_dir, "info"), "w", encoding="utf-8") as f:
             f.write(json.dumps(info, indent=4))
+        test_case_store.intern(case_id)
 
         if old_test_case_id:
-            old_test_case = os.path.join(settings.TEST_CASE_DIR, old_test_case_id)
-            if old_test_case:
-                shutil.rmtree(old_test_case, ignore_errors=True)
+            verdict_cache.invalidate(old_test_case_id)
+            test_case_zip_cache.invalidate(old_test_case_id)
+            test_case_store.release(old_test_case_id)
         return test_case_score
 
     @validate_serializer(CreateProblemSerializer)
@@ -781,8 +845,8 @@ class ContestProblemAPI(APIView):
                 pk=problem_id).update(
                 visible=visible)
 
-            cache.delete(f"{CacheKey.contest_problem_list}:{contest_id}")
-            cache.delete(f"{CacheKey.contest_problemOne}:{problem_id}")
+            contest_problem_list_cache.invalidate(contest_id)
+            contest_problem_cache.invalidate(problem_id)
 
             return self.success(r)
 
@@ -795,7 +859,7 @@ class ContestProblemAPI(APIView):
         test_cases = data.get("test_cases")
         score = data.pop("score", 10)
 
-        res = self._create_tase_case(test_case_id, test_cases, score, data.get("test_case_id", ""))
+        res = self._create_tase_case(test_case_id, test_cases, score, problem.test_case_id)
         if not res:
             return self.error(msg="测试用例格式错误")
 
@@ -810,8 +874,8 @@ class ContestProblemAPI(APIView):
         problem.save(update_fields=data.keys())
 
         # problem.tags.remove(*problem.tags.all())
-        cache.delete(f"{CacheKey.contest_problem_list}:{contest_id}")
-        cache.delete(f"{CacheKey.contest_problemOne}:{problem_id}")
+        contest_problem_list_cache.invalidate(contest_id)
+        contest_problem_cache.invalidate(problem_id)
 
         return self.success()
 
@@ -854,6 +918,9 @@ class ContestProblemAPI(APIView):
         pro_id = int(request.GET.get("problem_id"))
         con_id = request.GET.get("contest_id")
 
+        for test_case_id in ContestProblem.objects.filter(pk=pro_id).values_list("test_case_id", flat=True):
+            test_case_store.release(test_case_id)
+            test_case_zip_cache.invalidate(test_case_id)
         rows, res = ContestProblem.objects.filter(
             pk=pro_id).delete()
 
@@ -884,8 +951,8 @@ class ContestProblemAPI(APIView):
 
         Submission.objects.filter(contest_id=con_id, problem_id=pro_id).delete()
 
-        cache.delete(f"{CacheKey.contest_problem_list}:{con_id}")
-        cache.delete(f"{CacheKey.contest_problemOne}:{pro_id}")
+        contest_problem_list_cache.invalidate(con_id)
+        contest_problem_cache.invalidate(pro_id)
 
         return self.success(data=rows)
 
@@ -952,11 +1019,12 @@ class CollectProblemChanged(APIView):
         }
         with open(os.path.join(base_dir, "info"), "w", encoding="utf-8") as f:
             f.write(json.dumps(info, indent=4))
+        test_case_store.intern(case_id)
 
         if old_test_case_id:
-            old_test_case = os.path.join(settings.TEST_CASE_DIR, old_test_case_id)
-            if old_test_case:
-                shutil.rmtree(old_test_case, ignore_errors=True)
+            verdict_cache.invalidate(old_test_case_id)
+            test_case_zip_cache.invalidate(old_test_case_id)
+            test_case_store.release(old_test_case_id)
 
         return test_case_score
 
@@ -983,7 +1051,7 @@ class CollectProblemChanged(APIView):
         data['test_case_id'] = rand_str()
         score = data.pop("score", 10)
         res = self._create_tase_case(
-            data['test_case_id'], data['test_cases'], score, data.get("test_case_id", ""))
+            data['test_case_id'], data['test_cases'], score, problem.test_case_id)
         if not res:
             return self.error(msg="测试用例格式错误")
 
@@ -1049,6 +1117,7 @@ class ProblemDiffConfirm(APIView):
             diff = self.check_diff(item['submission_number'], item['accepted_number'])
             Problem.objects.filter(pk=item['id']).update(difficulty=diff)
 
+        problem_index.invalidate()
         return self.success()
 
 
@@ -1102,6 +1171,7 @@ class ProblemTagManagerAPI(APIView):
         rows = ProblemTag.objects.filter(id=tag_id).update(name=new_name)
         if rows == 0:
             return self.error("修改失败")
+        problem_index.invalidate()
         return self.success()
 
     def post(self, request):
@@ -1117,6 +1187,7 @@ class ProblemTagManagerAPI(APIView):
             ProblemTag.objects.get(pk=tag_id).delete()
         except Problem.DoesNotExist:
             return self.error("删除失败,Tag不存在")
+        problem_index.invalidate()
         return self.success()
 
 
@@ -1134,4 +1205,5 @@ class ProblemTagDeleteShip(APIView):
         except Problem.DoesNotExist:
             return self.error("试题不存在")
         pro.tags.remove(tag)
+        problem_index.update(pro.id)
         return self.success()
@@ -3,11 +3,15 @@ from random import shuffle
 from django.db.models import Count
 
 from account.decorators import check_contest_permission
-from account.models import UserProfile
+from account.models import UserProblemStatus
+from account.status_bitmap import problem_status_bitmap
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView
-from utils.cache import cache
+from utils.api.pagination import cached_count
+from utils.cache import cache, problem_list_namespace
 from utils.constants import CacheKey
+from ..caches import contest_problem_cache, contest_problem_list_cache
+from ..index import problem_index
 from ..models import ProblemTag, Problem, ContestProblem, ProblemBankType
 from ..serializers import ProblemSerializer, TagSerializer, ContestProblemSerializer, ProblemTitleListSerializer
 
@@ -30,38 +34,28 @@ class ProblemTagAPI(APIView):
 class ProblemAPI(APIView):
     @staticmethod
     def _add_problem_status(user_login, queryset_values):
-
-        acm_problems_status = UserProfile.objects.filter(user_id=user_login).values_list(
-            "acm_problems_status", flat=True)[0].get("problems", {})
-
         problems = queryset_values.get("results")
         if problems:
+            status_bits = problem_status_bitmap.load(user_login)
             for problem in problems:
-                problem["my_status"] = acm_problems_status.get(
-                    str(problem["id"]), {}).get("status")
+                problem["my_status"] = status_bits.status(problem["id"])
 
     def user_problem_status(self, status, uid, problems):
         # status = 0 解决
         # status = 1 未解决
         # status = -1 未做过
-        acm_problems_status = UserProfile.objects.filter(user_id=uid).values_list(
-            *("acm_problems_status",), flat=True)[0].get("problems", {})
+        done_problems = UserProblemStatus.objects.filter(user_id=uid, contest_id=0)
 
         if status == '0':
-            conform_ids = filter(
-                lambda item: acm_problems_status[item]["status"] == 0,
-                acm_problems_status.keys())
-            result = problems.filter(id__in=conform_ids)
+            result = problems.filter(id__in=done_problems.filter(
+                status=JudgeStatus.ACCEPTED).values("problem_id"))
 
         elif status == '-1':
-            result = problems.exclude(
-                id__in=acm_problems_status.keys())
+            result = problems.exclude(id__in=done_problems.values("problem_id"))
 
         else:
-            conform_ids = filter(
-                lambda item: acm_problems_status[item]["status"] != 0,
-                acm_problems_status.keys())
-            result = problems.filter(id__in=conform_ids)
+            result = problems.filter(id__in=done_problems.exclude(
+                status=JudgeStatus.ACCEPTED).values("problem_id"))
 
         return result
 
@@ -112,7 +106,7 @@ class ProblemAPI(APIView):
 
         if not any((tag_text, keyword, difficulty, status,)):
             # 可以去找缓存
-            cache_key = f"{CacheKey.problems}:{limit}:{offset}"
+            cache_key = problem_list_namespace.key(limit, offset)
             data = cache.get(cache_key)
 
             if not data:
@@ -125,35 +119,43 @@ class ProblemAPI(APIView):
                 cache.set(cache_key, data, timeout=60 * 10)
 
         else:
-            # 不能缓存
-            fields = (
-                "description", "hint", "input_description", "output_description", "template", "samples", "test_case_id",
-                "test_case_score", "spj", "languages", "create_time", "last_update_time", "time_limit", "memory_limit",
-                "rule_type", "source", "answer", "total_score", "test_cases", "statistic_info",)
-            problems = Problem.objects.filter(
-                bank=1,
-                visible=True).defer(*fields).prefetch_related("tags")
-
-            # 按照标签筛选
-            if tag_text:
-                problems = problems.filter(tags__name=tag_text)
-
-            # 搜索的情况
-            if keyword:
-                if keyword.isdigit():
-                    problems = problems.filter(_id=keyword)
-                else:
-                    problems = problems.filter(title__icontains=keyword)
+            # 从公有题库索引中筛选
+            problems = problem_index.query(tag=tag_text, keyword=keyword, difficulty=difficulty)
+            if problems is not None:
+                if status and user_login:
+                    problems = problem_status_bitmap.load(user_login).filter(status, problems)
+                data = self.paginate_data(request, problems)
+            else:
+                # 索引正在重建, 查询数据库
+                fields = (
+                    "description", "hint", "input_description", "output_description", "template", "samples",
+                    "test_case_id", "test_case_score", "spj", "languages", "create_time", "last_update_time",
+                    "time_limit", "memory_limit", "rule_type", "source", "answer", "total_score", "test_cases",
+                    "statistic_info",)
+                problems = Problem.objects.filter(
+                    bank=1,
+                    visible=True).defer(*fields).prefetch_related("tags")
+
+                # 按照标签筛选
+                if tag_text:
+                    problems = problems.filter(tags__name=tag_text)
+
+                # 搜索的情况
+                if keyword:
+                    if keyword.isdigit():
+                        problems = problems.filter(_id=keyword)
+                    else:
+                        problems = problems.filter(title__icontains=keyword)
 
-            # 难度筛选
-            if difficulty:
-                problems = problems.filter(difficulty=difficulty)
+                # 难度筛选
+                if difficulty:
+                    problems = problems.filter(difficulty=difficulty)
 
-            # 按照结果
-            if status and user_login:
-                problems = self.user_problem_status(
-                    status, user_login, problems)
-            data = self.paginate_data(request, problems, ProblemSerializer)
+                # 按照结果
+                if status and user_login:
+                    problems = self.user_problem_status(
+                        status, user_login, problems)
+                data = self.paginate_data(request, problems, ProblemSerializer, count_strategy=cached_count)
 
         if user_login:
             self._add_problem_status(user_login, data)
@@ -183,109 +185,40 @@ class ProblemTitleListAPI(APIView):
 
 class ContestProblemAPI(APIView):
 
-    def _add_problem_status(self, queryset_values,
-                            acm_problems_status=None):
-        if not acm_problems_status:
-            acm_problems_status = UserProfile.objects.filter(user_id=self.uid).values_list(
-                *("acm_problems_status",), flat=True)[0].get("contest_problems", {})
-
+    def _add_problem_status(self, queryset_values, status_bits):
         problems = queryset_values.get("results")
         if problems:
             for problem in problems:
-                problem["my_status"] = acm_problems_status.get(
-                    str(problem["id"]), {}).get("status")
-
-    def user_problem_status(self, status, contest_problems):
-        # status = 0 解决
-        # status = 1 未解决
-        # status = -1 未做过
-        acm_problems_status = UserProfile.objects.filter(user_id=self.uid).values_list(
-            *("acm_problems_status",), flat=True)[0].get("contest_problems", {})
-
-        if status == '0':
-            conform_ids = filter(
-                lambda item: acm_problems_status[item]["status"] == 0,
-                acm_problems_status.keys())
-            result = contest_problems.filter(id__in=conform_ids)
-
-        elif status == '-1':
-            result = contest_problems.exclude(
-                id__in=acm_problems_status.keys())
-
-        else:
-            conform_ids = filter(
-                lambda item: acm_problems_status[item]["status"] != 0,
-                acm_problems_status.keys())
-
-            result = contest_problems.filter(id__in=conform_ids)
-        return result, acm_problems_status
+                problem["my_status"] = status_bits.status(problem["id"])
 
     @check_contest_permission(check_type="problems")
     def get(self, request):
-        acm_problems_status = None
         problem_id = request.GET.get("problem_id", "")
 
         if problem_id.isdigit():
-            cache_key = f"{CacheKey.contest_problemOne}:{problem_id}"
-            data = cache.get(cache_key)
-            if not data:
-                fields = (
-                    "id",
-                    "_id",
-                    "title",
-                    "hint",
-                    "samples",
-                    "template",
-                    "rule_type",
-                    "time_limit",
-                    "description",
-                    "memory_limit",
-                    "accepted_number",
-                    "submission_number",
-                    "input_description",
-                    "output_description",
-                )
-                problem = ContestProblem.objects.filter(
-                    pk=problem_id).values(*fields)
-                if not problem.exists():
-                    return self.success("此试题不存在")
-                data = problem[0]
-
-                cache.set(cache_key, data, timeout=900)
+            data = contest_problem_cache.get(problem_id, lambda: ContestProblem.objects.filter(
+                pk=problem_id).values(*contest_problem_cache.fields).first())
+            if data is None:
+                return self.success("此试题不存在")
 
         else:
-            fields = (
-                "id",
-                "_id",
-                "title",
-                "rule_type",
-                "difficulty",
-                "submission_number",
-                "accepted_number",
-            )
             keyword = request.GET.get("keyword")
             status = request.GET.get("status")
 
-            cache_key = f"{CacheKey.contest_problem_list}:{self.contest_id}"
-
-            contest_problems = cache.get(cache_key)
-            if not contest_problems:
-                contest_problems = ContestProblem.objects.values(
-                    *fields).filter(contest_id=self.contest_id)
-                cache.set(cache_key, contest_problems, timeout=300)
+            contest_problems = contest_problem_list_cache.get(self.contest_id, lambda: list(
+                ContestProblem.objects.values(*contest_problem_list_cache.fields).filter(contest_id=self.contest_id)))
 
             if keyword:
-                contest_problems = contest_problems.filter(
-                    title__contains=keyword)
+                contest_problems = [problem for problem in contest_problems if keyword in problem["title"]]
 
+            status_bits = problem_status_bitmap.load(self.uid, self.contest_id)
             if status:
-                contest_problems, acm_problems_status = self.user_problem_status(
-                    status, contest_problems)
+                contest_problems = status_bits.filter(status, contest_problems)
 
             data = self.paginate_data(
                 request, contest_problems, ContestProblemSerializer)
 
-            self._add_problem_status(data, acm_problems_status)
+            self._add_problem_status(data, status_bits)
 
         return self.success(data)
 
@@ -306,18 +239,14 @@ class ProblemIdRandom(APIView):
         if not uid:
             return self.success()
 
-        do_problem_list = UserProfile.objects.filter(
-            user_id=uid).values_list("acm_problems_status", flat=True)
-
-        do_problem_list = do_problem_list[0].get("problems", [])
-
         _id_list = list(Problem.objects.filter(bank=1, visible=True).all()[
                         :100].values_list("id", flat=True))
+        status_bits = problem_status_bitmap.load(uid)
 
         shuffle(_id_list)
         results_id = 0
         for pk in _id_list:
-            if str(pk) not in do_problem_list:
+            if status_bits.status(pk) is None:
                 results_id = pk
                 break
 
@@ -0,0 +1,21 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('submission', '0003_submission_list_result'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='create_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='创建时间'),
+        ),
+        migrations.AlterIndexTogether(
+            name='submission',
+            index_together={('problem_id', 'create_time'), ('contest', 'create_time')},
+        ),
+    ]
@@ -50,7 +50,7 @@ class Submission(models.Model):
     statistic_info = MyJSONField(default=dict)
     list_result = MyJSONField(default=[])
     ip = MyCharField(max_length=20, default='')
-    create_time = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    create_time = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="创建时间")
     user_id = models.IntegerField(db_index=True, verbose_name="用户id")
     real_name = models.CharField(max_length=50, default="", verbose_name="用户名")
     code = models.TextField(verbose_name="提交代码")
@@ -67,6 +67,8 @@ class Submission(models.Model):
     class Meta:
         db_table = "submission"
         ordering = ("-create_time",)
+        # 提交列表按 (create_time, id) 游标分页
+        index_together = (("problem_id", "create_time"), ("contest", "create_time"),)
 
     def __str__(self):
         return self.sub_id
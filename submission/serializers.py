@@ -55,6 +55,13 @@ class CreateSubmissionLikeSerializer(serializers.Serializer):
     dislike = serializers.IntegerField()
 
 
+class BulkRejudgeSerializer(serializers.Serializer):
+    problem_id = serializers.IntegerField(required=False, allow_null=True)
+    contest_id = serializers.IntegerField(required=False, allow_null=True)
+    start_time = serializers.DateTimeField(required=False, allow_null=True)
+    end_time = serializers.DateTimeField(required=False, allow_null=True)
+
+
 class ShareSubmissionSerializer(serializers.Serializer):
     id = serializers.CharField()
     shared = serializers.BooleanField()
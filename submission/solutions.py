@@ -0,0 +1,138 @@
+import json
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from .models import JudgeStatus, Submission
+from .serializers import SubmissionPassListSerializer
+
+# 每道题的列表在redis中保留的时间(秒), 每次写入时延长, 过期后下次查询时从数据库重建
+SOLUTIONS_TTL = 7 * 24 * 3600
+
+# 只有已经在索引中的提交才更新点赞数
+# KEYS[1]: 这道题的点赞数hash  ARGV[1]: submission.id  ARGV[2]: 点赞增量  ARGV[3]: 点踩增量
+_LIKE_SCRIPT = """
+if redis.call("HEXISTS", KEYS[1], ARGV[1] .. ":like") == 0 then
+    return 0
+end
+redis.call("HINCRBY", KEYS[1], ARGV[1] .. ":like", ARGV[2])
+redis.call("HINCRBY", KEYS[1], ARGV[1] .. ":dislike", ARGV[3])
+return 1
+"""
+
+
+class AcceptedSolutionIndex(object):
+    """
+    公有试题已通过提交的物化列表, 保存在redis中:
+    hash <key>:<problem_id>: submission.id -> 序列化后的提交(不含点赞数)
+    hash <key>:<problem_id>:likes: "<id>:like" / "<id>:dislike" -> 点赞/点踩数
+    判题通过和点赞时增量更新, 查询时整道题的列表在内存中过滤和排序;
+    每道题的key同时设置过期时间, 没有访问的试题过期后释放内存
+    """
+    fields = (
+        "id",
+        "sub_id",
+        "result",
+        "problem_id",
+        "language",
+        "statistic_info",
+        "create_time",
+        "user_id",
+        "display_id",
+        "real_name",
+        "contest_id",
+        "length",
+        "like",
+        "dislike",
+    )
+
+    def __init__(self):
+        self._like_script = None
+
+    @staticmethod
+    def _keys(problem_id):
+        key = f"{CacheKey.problems_pass_submit}:{problem_id}"
+        return key, f"{key}:built", f"{key}:likes"
+
+    def _expire(self, p, problem_id):
+        for key in self._keys(problem_id):
+            p.expire(key, SOLUTIONS_TTL)
+
+    def _write(self, p, submission, only_new=False):
+        key, _, likes_key = self._keys(submission["problem_id"])
+        row = dict(SubmissionPassListSerializer(submission).data)
+        like, dislike = row.pop("like"), row.pop("dislike")
+        if only_new:
+            p.hsetnx(key, row["id"], json.dumps(row))
+            p.hsetnx(likes_key, f"{row['id']}:like", like)
+            p.hsetnx(likes_key, f"{row['id']}:dislike", dislike)
+        else:
+            p.hset(key, row["id"], json.dumps(row))
+            p.hset(likes_key, f"{row['id']}:like", like)
+            p.hset(likes_key, f"{row['id']}:dislike", dislike)
+
+    def add(self, submission):
+        """
+        提交判为通过后调用, 竞赛提交不加入
+        """
+        if submission.contest_id:
+            return
+        p = cache.pipeline()
+        self._write(p, {field: getattr(submission, field) for field in self.fields})
+        self._expire(p, submission.problem_id)
+        p.execute()
+
+    def remove(self, problem_id, submission_id):
+        """
+        重新判题后不再通过
+        """
+        key, _, likes_key = self._keys(problem_id)
+        p = cache.pipeline()
+        p.hdel(key, submission_id)
+        p.hdel(likes_key, f"{submission_id}:like", f"{submission_id}:dislike")
+        p.execute()
+
+    def invalidate(self, problem_id):
+        """
+        批量重新判题后调用, 下次查询时重建
+        """
+        cache.delete(*self._keys(problem_id))
+
+    def like(self, problem_id, submission_id, like, dislike):
+        if self._like_script is None:
+            self._like_script = cache.register_script(_LIKE_SCRIPT)
+        self._like_script(keys=[self._keys(problem_id)[2]], args=[submission_id, like, dislike])
+
+    def rebuild(self, problem_id):
+        """
+        从数据库加载整道题的列表, 已经存在的行是增量写入的, 不覆盖
+        """
+        submissions = Submission.objects.filter(
+            problem_id=problem_id, contest__isnull=True, result=JudgeStatus.ACCEPTED).values(*self.fields)
+        p = cache.pipeline()
+        for submission in submissions:
+            self._write(p, submission, only_new=True)
+        p.set(self._keys(problem_id)[1], 1)
+        self._expire(p, problem_id)
+        p.execute()
+
+    def rows(self, problem_id):
+        """
+        :return: 与 SubmissionPassListSerializer 格式相同的列表, 未排序
+        """
+        key, built_key, likes_key = self._keys(problem_id)
+        if not cache.exists(built_key):
+            self.rebuild(problem_id)
+        rows = [json.loads(row.decode("utf-8")) for row in cache.hvals(key)]
+        if not rows:
+            return rows
+        fields = []
+        for row in rows:
+            fields.extend((f"{row['id']}:like", f"{row['id']}:dislike"))
+        counts = cache.hmget(likes_key, fields)
+        for i, row in enumerate(rows):
+            row["like"] = int(counts[2 * i] or 0)
+            row["dislike"] = int(counts[2 * i + 1] or 0)
+        return rows
+
+
+accepted_solutions = AcceptedSolutionIndex()
@@ -1,10 +1,12 @@
 import time
 
 from account.models import Grade, User
-from judge.tasks import judge_task
-from utils.api import APIView
+from judge.rejudge import rejudge_jobs
+from judge.tasks import dispatch_judge_task, start_rejudge
+from utils.api import APIView, validate_serializer
+from utils.api.pagination import cached_count
 from ..models import Submission, JudgeStatus
-from ..serializers import SubmissionListSerializer
+from ..serializers import SubmissionListSerializer, BulkRejudgeSerializer
 
 
 class SubmissionListAPI(APIView):
@@ -46,7 +48,7 @@ class SubmissionListAPI(APIView):
             submissions = submissions.filter(result=result)
         submissions = submissions.filter(user_id__in=uids).values(*fields)
 
-        data = self.paginate_data(request, submissions)
+        data = self.paginate_data(request, submissions, count_strategy=cached_count)
         data["results"] = SubmissionListSerializer(
             data["results"], many=True).data
         return self.success(data)
@@ -63,7 +65,7 @@ class SubmissionRejudgeAPI(APIView):
         submission.statistic_info = {}
         submission.save(update_fields=('info', 'statistic_info',))
 
-        judge_task.delay(submission.sub_id, submission.problem_id)
+        dispatch_judge_task(submission.sub_id, submission.problem_id, contest_id=submission.contest_id, rejudge=True)
         time.sleep(5)
         result = Submission.objects.filter(sub_id=pk).values_list("result", flat=True)
         if 6 <= result[0] <= 7:
@@ -71,6 +73,30 @@ class SubmissionRejudgeAPI(APIView):
         return self.success({"result": 0})
 
 
+class BulkRejudgeAPI(APIView):
+    @validate_serializer(BulkRejudgeSerializer)
+    def post(self, request):
+        """
+        重新判题某道题/某场竞赛/某段时间内的全部提交, 返回任务id
+        """
+        data = request.data
+        try:
+            job_id = rejudge_jobs.create(**data)
+        except ValueError:
+            return self.error("请指定试题, 竞赛或时间范围")
+        start_rejudge.delay(job_id)
+        return self.success({"job_id": job_id})
+
+    def get(self, request):
+        """
+        查询批量重新判题的进度
+        """
+        job = rejudge_jobs.progress(request.GET.get("job_id", ""))
+        if job is None:
+            return self.error("任务不存在")
+        return self.success(job)
+
+
 class SubmissionBlockList(APIView):
     def get(self, request):
         fields = (
@@ -1,15 +1,19 @@
-from django.db.models import Count, Max, F
+from django.db import connection
+from django.db.models import Count, F
 from django.db.utils import IntegrityError
 
 from account.decorators import login_required
 from account.models import Likes, LikeType
 from account.tasks import create_notify
 from contest.models import Contest, ContestPartner
-from judge.tasks import judge_task
+from judge.notifier import verdict_notifier
+from judge.tasks import dispatch_judge_task
 from problem.models import Problem, ContestProblem
 from submission.models import Submission, TestSubmission, JudgeStatus
+from submission.solutions import accepted_solutions
 from submission.tasks import increase_submit_view_count
 from utils.api import APIView, validate_serializer
+from utils.api.pagination import KeysetPagination, cached_count, estimated_count
 from utils.cache import cache
 from utils.constants import ContestStatus, CacheKey
 from ..serializers import (
@@ -17,7 +21,7 @@ from ..serializers import (
     CreateConSubmissionSerializer,
     CreateSubmissionSerializer,
     SubmissionListSerializer,
-    CreateTestSubmissionSer, CreateSubmissionLikeSerializer, SubmissionPassListSerializer)
+    CreateTestSubmissionSer, CreateSubmissionLikeSerializer)
 
 
 class ContestSubmission(APIView):
@@ -74,7 +78,7 @@ class ContestSubmission(APIView):
         req_body['display_id'] = pro[0]
         submission = Submission.objects.create(**req_body)
 
-        judge_task.delay(submission.sub_id, req_body['problem_id'])
+        dispatch_judge_task(submission.sub_id, req_body['problem_id'], contest_id=req_body['contest_id'])
         return self.success({"submission_id": submission.sub_id})
 
 
@@ -95,16 +99,15 @@ class SubmissionAPI(APIView):
         req_body['display_id'] = pro['_id']
 
         submission = Submission.objects.create(**req_body)
-        judge_task.delay(submission.sub_id, pro["id"])
+        dispatch_judge_task(submission.sub_id, pro["id"])
 
         cache.hset(CacheKey.submit_prefix, submission.sub_id, 6)
         return self.success({"submission_id": submission.sub_id})
 
 
 class ResultSubmission(APIView):
-    @login_required
-    def get(self, request):
-        submission_id = request.GET.get("id")
+    @staticmethod
+    def get_result(submission_id):
         resp = {
             "sub_id": submission_id,
             "result": 7,
@@ -121,9 +124,30 @@ class ResultSubmission(APIView):
                 only_fields).filter(
                 sub_id=submission_id)
             if not sub.exists():
-                return self.error("提交不存在")
+                return None
             resp = sub[0]
+        return resp
 
+    @login_required
+    def get(self, request):
+        submission_id = request.GET.get("id")
+        if not request.GET.get("wait"):
+            resp = self.get_result(submission_id)
+        else:
+            # 长轮询: 判题未结束时挂起请求, 直到判题结束或超时, 超时后客户端再次请求
+            pubsub = verdict_notifier.subscribe(submission_id)
+            try:
+                resp = self.get_result(submission_id)
+                if resp and resp["result"] in (JudgeStatus.PENDING, JudgeStatus.JUDGING):
+                    # 等待期间不占用数据库连接
+                    connection.close()
+                    if verdict_notifier.wait(pubsub):
+                        resp = self.get_result(submission_id)
+            finally:
+                pubsub.close()
+
+        if resp is None:
+            return self.error("提交不存在")
         return self.success(resp)
 
 
@@ -144,7 +168,7 @@ class TestSubmissionAPI(APIView):
         custom_test_cases = req_body.pop("custom_test_cases")
         submission = TestSubmission.objects.create(**req_body)
 
-        judge_task.delay(submission.sub_id, req_body['problem_id'], custom_test_cases, True)
+        dispatch_judge_task(submission.sub_id, req_body['problem_id'], custom_test_cases, True)
 
         return self.success({"submission_id": submission.sub_id})
 
@@ -166,11 +190,10 @@ class ResultTestSubmission(APIView):
 class SubmissionListAPI(APIView):
     def get(self, request):
 
-        submissions, flag = Submission.objects, False
+        submissions = Submission.objects
         problem_id = request.GET.get("problem_id", "")
         if problem_id:
             if problem_id.isdigit():
-                flag = True
                 submissions = submissions.filter(problem_id=problem_id)
             else:
                 return self.error("参数不正确")
@@ -178,14 +201,12 @@ class SubmissionListAPI(APIView):
         myself = request.GET.get("myself")
         if myself:
             # 仅查找自己的提交记录
-            flag = True
             submissions = submissions.filter(
                 user_id=request.session.get(
                     "_auth_user_id"))
 
         keyword = request.GET.get("keyword", "")
         if keyword:
-            flag = True
             # 按用户名查找
             if keyword.isdigit():
                 # 试题id
@@ -195,17 +216,16 @@ class SubmissionListAPI(APIView):
 
         result = request.GET.get("result")
         if result:
-            flag = True
             # 按结果类型
             submissions = submissions.filter(result=result)
 
         lang = request.GET.get("lang")
         if lang:
-            flag = True
             # 按语言类型
             submissions = submissions.filter(language=lang)
 
         fields = (
+            "id",
             "sub_id",
             "result",
             "problem_id",
@@ -217,16 +237,8 @@ class SubmissionListAPI(APIView):
             "user_id",
             "contest_id",
         )
-        data = {}
-        if not flag:
-            data['total'] = submissions.aggregate(Max("id")).get("id__max")
-            offset = int(request.GET.get("offset", 0))
-            limit = int(request.GET.get("limit", 0))
-            page = (offset // limit) + 1
-            data['results'] = submissions.filter(id__gte=(data['total'] - limit * page),
-                                                 id__lte=data['total'] - offset).values(*fields)[:limit]
-        else:
-            data = self.paginate_data(request, submissions.values(*fields))
+        data = self.paginate_data(request, submissions.values(*fields), cursor_fields=("-create_time", "-id"),
+                                  count_strategy=estimated_count)
         data["results"] = SubmissionListSerializer(
             data['results'], many=True).data
         return self.success(data)
@@ -309,6 +321,7 @@ class ContestSubmissionList(APIView):
         if result:
             submissions = submissions.filter(result=result)
         fields = (
+            "id",
             "sub_id",
             "result",
             "problem_id",
@@ -319,7 +332,8 @@ class ContestSubmissionList(APIView):
             "display_id",
             "real_name",
         )
-        data = self.paginate_data(request, submissions.values(*fields))
+        data = self.paginate_data(request, submissions.values(*fields), cursor_fields=("-create_time", "-id"),
+                                  count_strategy=cached_count)
         data["results"] = ContestSubmissionListSerializer(
             data['results'], many=True).data
 
@@ -342,49 +356,26 @@ class ProblemPassedSubmitListAPI(APIView):
         pro_id = request.GET.get("problem_id")
         submit_by = request.GET.get("submit_by")
         language = request.GET.get("language")
+        if not pro_id or not pro_id.isdigit():
+            return self.error("参数不正确")
 
         uid = request.session.get("_auth_user_id")
         if not Submission.objects.filter(user_id=uid, problem_id=pro_id, result=JudgeStatus.ACCEPTED).exists():
             return self.error("没通过,你是看不到的呦")
 
-        cache_key = f"{CacheKey.problems_pass_submit}:{pro_id}"
-        list_submit = cache.get(cache_key)
-        if not list_submit:
-            list_submit = Submission.objects.filter(problem_id=pro_id, contest__isnull=True,
-                                                    result=JudgeStatus.ACCEPTED)
-            cache.set(cache_key, list_submit, timeout=3600)
-
+        list_submit = accepted_solutions.rows(pro_id)
         if submit_by:
-            list_submit = list_submit.filter(real_name__contains=submit_by)
+            list_submit = [row for row in list_submit if submit_by in row["real_name"]]
         if language:
-            list_submit = list_submit.filter(language=language)
+            list_submit = [row for row in list_submit if row["language"] == language]
 
-        order_fields = 'length'
+        order_fields = ("length", "id")
         sort_like = request.GET.get("sort_like", "0")
         if sort_like == "1":
-            order_fields = "-like"
-
-        fields = (
-            "id",
-            "sub_id",
-            "result",
-            "problem_id",
-            "language",
-            "statistic_info",
-            "create_time",
-            "user_id",
-            "display_id",
-            "real_name",
-            "contest_id",
-            "length",
-            "like",
-            "dislike",
-        )
-        list_submit = self.paginate_data(request, list_submit.values(*fields).order_by(order_fields))
+            order_fields = ("-like", "-id")
+        list_submit.sort(key=KeysetPagination(order_fields).sort_key)
 
-        list_submit["results"] = SubmissionPassListSerializer(
-            list_submit["results"], many=True).data
-        return self.success(data=list_submit)
+        return self.success(data=self.paginate_data(request, list_submit, cursor_fields=order_fields))
 
 
 class SubmissionLike(APIView):
@@ -404,6 +395,9 @@ class SubmissionLike(APIView):
             Submission.objects.filter(pk=req_body['liked_id']).update(**sub_up_fields)
         except IntegrityError:
             return self.error("点赞失败了耶")
+        problem_id = Submission.objects.filter(pk=req_body['liked_id']).values_list("problem_id", flat=True).first()
+        if problem_id:
+            accepted_solutions.like(problem_id, req_body['liked_id'], req_body['like'], req_body['dislike'])
 
         filter_fields = {"liked_id": req_body['liked_id'],
                          "user_id": curr_uid,
@@ -8,6 +8,8 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+from .pagination import KeysetPagination, exact_count
+
 logger = logging.getLogger("")
 
 
@@ -111,13 +113,8 @@ class APIView(View):
     def server_error(self,msg="server error"):
         return self.error(err="server-error", msg=msg)
 
-    def paginate_data(self, request, query_set, object_serializer=None):
-        """
-        :param request: django的request
-        :param query_set: django model的query set或者其他list like objects
-        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
-        :return:
-        """
+    @staticmethod
+    def get_limit_offset(request):
         try:
             limit = int(request.GET.get("limit", 10))
         except ValueError:
@@ -131,14 +128,39 @@ class APIView(View):
 
         if offset < 0:
             offset = 0
+        return limit, offset
 
-        results = query_set[offset:offset + limit]
-        count = query_set.count()
+    def paginate_data(self, request, query_set, object_serializer=None, cursor_fields=None,
+                      count_strategy=exact_count):
+        """
+        :param request: django的request
+        :param query_set: django model的query set或者其他list like objects
+        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
+        :param cursor_fields: 用于大表, 如 ("-create_time", "-id"),
+            请求中带有 cursor 参数(第一页为空)时使用游标分页, 返回下一页的 next_cursor
+        :param count_strategy: 总数的统计方式, exact_count / cached_count / estimated_count,
+            返回的 total_exact 表示总数是否精确
+        :return:
+        """
+        limit, offset = self.get_limit_offset(request)
+        use_cursor = cursor_fields is not None and "cursor" in request.GET
+        if use_cursor:
+            try:
+                results, next_cursor = KeysetPagination(cursor_fields).page(
+                    query_set, request.GET["cursor"], limit)
+            except ValueError as e:
+                raise APIError(msg=str(e))
+        else:
+            results = query_set[offset:offset + limit]
+        count, exact = count_strategy.count(query_set)
         if object_serializer:
             results = object_serializer(results, many=True).data
 
         data = {"results": results,
-                "total": count}
+                "total": count,
+                "total_exact": exact}
+        if use_cursor:
+            data["next_cursor"] = next_cursor
         return data
 
     def dispatch(self, request, *args, **kwargs):
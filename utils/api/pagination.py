@@ -0,0 +1,165 @@
+import base64
+import bisect
+import hashlib
+import json
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import Q
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 分页总数缓存的时间(秒)
+COUNT_CACHE_TIMEOUT = 60
+
+
+class KeysetPagination(object):
+    """
+    游标(keyset)分页: 按 order_fields 排序, 下一页的查询条件是"排在上一页最后一行之后",
+    不使用 OFFSET, 翻到多深的页查询代价都相同
+    order_fields 形如 ("-create_time", "-id"), 最后一个字段必须唯一, 且要包含在查询结果中
+    """
+
+    def __init__(self, order_fields):
+        self.order_fields = order_fields
+
+    @staticmethod
+    def _value(row, field):
+        return row[field] if isinstance(row, dict) else getattr(row, field)
+
+    def encode(self, row):
+        values = [self._value(row, field.lstrip("-")) for field in self.order_fields]
+        # datetime 保留微秒, 不能用 DjangoJSONEncoder(只保留到毫秒)
+        raw = json.dumps(values, default=lambda o: o.isoformat())
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")).decode("utf-8"))
+        except (ValueError, TypeError):
+            raise ValueError("invalid cursor")
+        if not isinstance(values, list) or len(values) != len(self.order_fields):
+            raise ValueError("invalid cursor")
+        return values
+
+    def after(self, query_set, values):
+        """
+        (a, b) 在 (va, vb) 之后: a 在 va 之后, 或 a = va 且 b 在 vb 之后
+        """
+        condition, equals = Q(), {}
+        for field, value in zip(self.order_fields, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= Q(**equals, **{f"{name}__{lookup}": value})
+            equals[name] = value
+        return query_set.filter(condition)
+
+    def sort_key(self, row):
+        """
+        内存中排序使用, 排序字段只能是数字
+        """
+        return tuple(-self._value(row, field[1:]) if field.startswith("-") else self._value(row, field)
+                     for field in self.order_fields)
+
+    def page(self, query_set, cursor, limit):
+        """
+        :param query_set: queryset, 或者已经在内存中的list
+        :return: (当前页的行, 下一页的游标), 没有下一页时游标为None
+        """
+        if isinstance(query_set, list):
+            rows = sorted(query_set, key=self.sort_key)
+            if cursor:
+                values = self.decode(cursor)
+                try:
+                    last = self.sort_key(dict(zip((field.lstrip("-") for field in self.order_fields), values)))
+                    rows = rows[bisect.bisect_right([self.sort_key(row) for row in rows], last):]
+                except TypeError:
+                    raise ValueError("invalid cursor")
+        else:
+            query_set = query_set.order_by(*self.order_fields)
+            if cursor:
+                query_set = self.after(query_set, self.decode(cursor))
+            rows = list(query_set[:limit + 1])
+        next_cursor = self.encode(rows[limit - 1]) if 0 < limit < len(rows) else None
+        return rows[:limit], next_cursor
+
+
+class ExactCount(object):
+    """
+    每次都执行 count()
+    """
+    exact = True
+
+    def count(self, query_set):
+        """
+        :return: (总数, 是否精确)
+        """
+        if isinstance(query_set, list):
+            return len(query_set), True
+        return query_set.count(), self.exact
+
+
+class CachedCount(ExactCount):
+    """
+    相同查询条件的 count() 结果缓存一段时间, 大表上每次翻页不再重新统计,
+    缓存key只与过滤条件有关, 与排序和查询的字段无关
+    """
+    exact = False
+
+    def __init__(self, timeout=COUNT_CACHE_TIMEOUT):
+        self.timeout = timeout
+
+    @staticmethod
+    def signature(query_set):
+        sql, params = query_set.order_by().values("pk").query.sql_with_params()
+        return hashlib.md5(f"{sql}{params}".encode("utf-8")).hexdigest()
+
+    def count(self, query_set):
+        if isinstance(query_set, list):
+            return len(query_set), True
+        try:
+            cache_key = f"{CacheKey.query_count}:{self.signature(query_set)}"
+        except EmptyResultSet:
+            return 0, True
+        count = cache.get(cache_key)
+        if count is None:
+            count = query_set.count()
+            cache.set(cache_key, count, timeout=self.timeout)
+        return count, self.exact
+
+
+class EstimatedCount(CachedCount):
+    """
+    没有过滤条件时直接读取MySQL的表统计信息(information_schema.TABLES.TABLE_ROWS),
+    InnoDB的这个值是估算的; 有过滤条件时与 CachedCount 相同
+    """
+
+    def _table_rows(self, query_set):
+        connection = connections[query_set.db]
+        if connection.vendor != "mysql" or query_set.query.where or query_set.query.distinct:
+            return None
+        cache_key = f"{CacheKey.query_count}:table:{query_set.model._meta.db_table}"
+        count = cache.get(cache_key)
+        if count is None:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+                    "AND TABLE_NAME = %s", (query_set.model._meta.db_table,))
+                row = cursor.fetchone()
+            if not row:
+                return None
+            count = row[0]
+            cache.set(cache_key, count, timeout=self.timeout)
+        return count
+
+    def count(self, query_set):
+        count = self._table_rows(query_set)
+        if count is None:
+            return super().count(query_set)
+        return count, self.exact
+
+
+exact_count = ExactCount()
+cached_count = CachedCount()
+estimated_count = EstimatedCount()
@@ -1,10 +1,17 @@
 
+import datetime
+import time
+
+import msgpack
 from django.core.cache import cache  # noqa
 import redis
+from django.db.models import QuerySet
 from django_redis.cache import RedisCache
 from django_redis.client.default import DefaultClient
 from django.conf import settings
 
+from utils.constants import CacheKey
+
 
 class MyRedisClient(DefaultClient):
     def __getattr__(self, item):
@@ -35,3 +42,109 @@ redis_help = redis.ConnectionPool(
     db=1)
 
 _redis = redis.Redis(connection_pool=redis_help)
+
+
+class RowCache(object):
+    """
+    cache-aside 缓存查询结果的行:
+     - loader 必须返回已经取出的行(dict的list或单个dict), 不接受未执行的queryset
+     - 只保存 fields 中的字段, 按顺序编码成元组后用 msgpack 序列化, 读取时还原成dict
+     - 未命中时只有拿到锁的进程执行 loader, 其余进程等待结果, 避免缓存击穿
+     - key中带有版本号, 修改 fields 时同时修改 version, 旧格式的缓存自然失效
+    """
+
+    def __init__(self, prefix, fields, version=1, timeout=300, lock_timeout=10):
+        self.prefix = prefix
+        self.fields = fields
+        self.version = version
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def _client():
+        return cache.get_client(write=True)
+
+    def key(self, name):
+        return f"{self.prefix}:v{self.version}:{name}"
+
+    def _encode(self, rows):
+        many = isinstance(rows, list)
+        rows = [tuple(row[field] for field in self.fields) for row in (rows if many else [rows])]
+        return msgpack.packb((many, rows), default=_msgpack_default, use_bin_type=True)
+
+    def _decode(self, raw):
+        many, rows = msgpack.unpackb(raw, raw=False)
+        rows = [dict(zip(self.fields, row)) for row in rows]
+        return rows if many else rows[0]
+
+    def _load(self, key, loader):
+        rows = loader()
+        if isinstance(rows, QuerySet):
+            raise TypeError("RowCache loader must return evaluated rows, not a QuerySet")
+        if rows is None:
+            return None
+        raw = self._encode(rows)
+        self._client().set(key, raw, ex=self.timeout)
+        # 与命中缓存时返回的格式保持一致
+        return self._decode(raw)
+
+    def get(self, name, loader):
+        """
+        :param loader: 未命中时调用, 返回None表示不存在, 不缓存
+        """
+        key = self.key(name)
+        client = self._client()
+        raw = client.get(key)
+        if raw is not None:
+            return self._decode(raw)
+
+        lock_key = f"{key}:lock"
+        if client.set(lock_key, 1, nx=True, ex=self.lock_timeout):
+            try:
+                return self._load(key, loader)
+            finally:
+                client.delete(lock_key)
+
+        # 其他进程正在加载, 等待结果
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            raw = client.get(key)
+            if raw is not None:
+                return self._decode(raw)
+            if not client.exists(lock_key):
+                break
+        return self._load(key, loader)
+
+    def invalidate(self, name):
+        self._client().delete(self.key(name))
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"can not serialize {type(obj)}")
+
+
+class CacheNamespace(object):
+    """
+    一组列表缓存共用一个版本号(generation), 缓存key中带有版本号,
+    版本号加一后旧的key不会再被读到(等待自然过期), 代替 KEYS 扫描后逐个删除
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._generation_key = f"{name}:generation"
+
+    def key(self, *parts):
+        generation = cache.get_client(write=True).get(self._generation_key)
+        generation = int(generation) if generation else 0
+        return ":".join([self.name, f"g{generation}"] + [str(part) for part in parts])
+
+    def invalidate(self):
+        cache.get_client(write=True).incr(self._generation_key)
+
+
+problem_list_namespace = CacheNamespace(CacheKey.problems)
+user_rank_namespace = CacheNamespace(CacheKey.user_rank)
+announcement_list_namespace = CacheNamespace(CacheKey.announcementsList)
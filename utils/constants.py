@@ -24,6 +24,8 @@ class ContestRuleType(Choices):
 class CacheKey:
     option = "option"
     problems = "problems"
+    problem_index = "problem:index"
+    problem_index_lock = "problem:index:lock"
     problems_tags = "problem:tags"
     auth_token = "auth_token"
     find_password = "find_pw"
@@ -35,21 +37,33 @@ class CacheKey:
     daily_result = "dailyResult"
     throttle_user = "throttle_user"
     waiting_queue = "waitingQueue"
+    waiting_queue_stats = "waitingQueue:stats"
+    judge_server = "judge:server"
+    judge_server_ids = "judge:serverIds"
+    judge_server_hostnames = "judge:serverHostnames"
+    judge_slot_lease_stats = "judge:slotLeases:stats"
+    verdict_events = "judge:verdictEvents"
+    verdict_events_lock = "judge:verdictEvents:lock"
+    verdict_cache = "judge:verdictCache"
+    rejudge_job = "judge:rejudge"
+    test_case_catalog = "judge:testCaseCatalog"
     website_config = "website_config"
 
     contest_problem_list = "contest:problemList"
     contest_problemOne = "contest:problemOne"
-    contest_rank_cache = "contest:rank"
-    contest_rank_change_count = "conRankChNum"
+    contest_scoreboard = "contest:scoreboard"
     contest_times = "contest:times"
     contest_list = "contest:list"
     notify_message = "user:notify"
     user_rank = "user:rank"
+    user_problem_status = "user:problemStatus"
     submit_prefix = "submit:status"
+    submit_result_channel = "submit:result"
     custom_test_cases = "submit:custom_test_cases"
     announcementsList = "announcementList"
     public_pro_count = "public_pro_count"
-    problems_pass_submit = "problem:pass_submit"
+    problems_pass_submit = "problem:acceptedSubmit"
+    query_count = "query:count"
 
     options_last_test_sub_id = "options:options_last_test_sub_id"
 
@@ -0,0 +1,29 @@
+from django.test.testcases import TestCase
+
+from account.models import User
+from utils.cache import RowCache
+
+
+class RowCacheTest(TestCase):
+    fields = ("id", "username")
+
+    def setUp(self):
+        self.row_cache = RowCache("test:rowCache", fields=self.fields, timeout=60)
+        self.row_cache.invalidate("users")
+        User.objects.create(username="maxin", email="maxin")
+
+    def tearDown(self):
+        self.row_cache.invalidate("users")
+
+    def load_users(self):
+        return list(User.objects.values(*self.fields))
+
+    def test_cache_hit_issues_no_query(self):
+        with self.assertNumQueries(1):
+            rows = self.row_cache.get("users", self.load_users)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.row_cache.get("users", self.load_users), rows)
+
+    def test_reject_lazy_queryset(self):
+        with self.assertRaises(TypeError):
+            self.row_cache.get("users", lambda: User.objects.values(*self.fields))
@@ -0,0 +1,56 @@
+import zipfile
+
+# 每次从文件中读取的字节数
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer(object):
+    """
+    只能追加写入的文件对象, 没有 seek, zipfile 会在每个文件数据之后写入 data descriptor,
+    写入的数据由 zip_stream 及时取走, 内存占用与文件大小无关
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_stream(files, compression=zipfile.ZIP_DEFLATED):
+    """
+    边读文件边生成zip, 可以直接作为 StreamingHttpResponse 的内容
+    :param files: 可迭代的 (文件路径, 压缩包中的文件名)
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression) as zip_file:
+        for path, arcname in files:
+            zip_info = zipfile.ZipInfo.from_file(path, arcname)
+            zip_info.compress_type = compression
+            with open(path, "rb") as src, zip_file.open(zip_info, "w") as dst:
+                while True:
+                    chunk = src.read(ZIP_STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            data = buffer.pop()
+            if data:
+                yield data
+    yield buffer.pop()